@@ -16,13 +16,14 @@ import motor
 import tornado.auth
 import premailer
 from handlers import BaseHandler, TileMakerMixin, DeleteImageMixin
+from stats import get_stats, get_hit_keys
+from pagination import find_page, get_count
+from metadata import get_key as get_metadata_key
 from utils import (
-    count_all_tiles,
-    find_all_tiles,
     find_original,
     make_thumbnail
 )
-from awsuploader import update_tiles_metadata
+from awsuploader import update_tiles_metadata, get_uploaded_key
 from awsdownloader import download_original
 from tweeter import tweet_with_media
 from emailer import send_newsletter
@@ -48,39 +49,13 @@ class AdminBaseHandler(BaseHandler):
             return False
         return user in settings.ADMIN_EMAILS
 
-    def _count_tiles(self, image):
-        count_key = 'count_all_tiles:%s' % image['fileid']
-        count = self.redis.get(count_key)
-        if count is None:
-            count = count_all_tiles(
-                image['fileid'],
-                self.application.settings['static_path']
-            )
-            self.redis.setex(
-                count_key,
-                count,
-                60 * 5
-            )
-        return count
-
-    def _calculate_ranges(self, image):
-        ranges = []
-        _range = self.DEFAULT_RANGE_MIN
-
-        area = image['width'] * image['height']
-        r = 1.0 * image['width'] / image['height']
-
-        while True:
-            ranges.append(_range)
-            range_width = 256 * (2 ** _range)
-            range_height = range_width / r
-            range_area = range_width * range_height
-            if _range >= self.DEFAULT_RANGE_MAX:
-                break
-            if range_area > area:
-                break
-            _range += 1
-        return ranges
+    @tornado.gen.engine
+    def _count_tiles(self, image, callback):
+        manifest = yield tornado.gen.Task(
+            self.get_tile_manifest,
+            image['fileid']
+        )
+        callback(manifest.count())
 
     def _expected_tiles(self, image):
         count = 0
@@ -91,30 +66,33 @@ class AdminBaseHandler(BaseHandler):
             count += (cols * rows)
         return count
 
-    def attach_tiles_info(self, image):
-        image['found_tiles'] = self._count_tiles(image)
+    @tornado.gen.engine
+    def attach_tiles_info(self, image, callback):
+        image['found_tiles'] = yield tornado.gen.Task(
+            self._count_tiles,
+            image
+        )
         _ranges = image.get('ranges')
         if _ranges:
             _ranges = [int(x) for x in _ranges]
         image['ranges'] = (
-            _ranges or self._calculate_ranges(image)
+            _ranges or
+            self.calculate_ranges(image['width'], image['height'])
         )
         image['expected_tiles'] = self._expected_tiles(image)
         image['too_few_tiles'] = (
             image['found_tiles'] < image['expected_tiles']
         )
+        callback()
 
     def attach_hits_info(self, image, now=None):
         if not now:
             now = datetime.datetime.utcnow()
-        fileid = image['fileid']
-        hit_key = 'hits:%s' % fileid
-        hit_month_key = (
-            'hits:%s:%s:%s' %
-            (now.year, now.month, fileid)
+        hit_key, hit_month_key = get_hit_keys(image['fileid'], now)
+        image['hits'], image['hits_this_month'] = self.redis.mget(
+            hit_key,
+            hit_month_key
         )
-        image['hits'] = self.redis.get(hit_key)
-        image['hits_this_month'] = self.redis.get(hit_month_key)
 
     def attach_comments_info(self, image):
         image['comments'] = self.redis.hget('comments', image['fileid'])
@@ -148,26 +126,26 @@ class AdminHomeHandler(AdminBaseHandler):
     @tornado.gen.engine
     def get(self):
         data = {}
-        page = int(self.get_argument('page', 1))
         page_size = 20
-        skip = page_size * (page - 1)
         search = {'width': {'$exists': True}}
-        total_count = yield motor.Op(self.db.images.find(search).count)
-        cursor = (
-            self.db.images.find(search)
-            .sort([('date', -1)])
-            .limit(page_size)
-            .skip(skip)
+        total_count = yield tornado.gen.Task(
+            get_count,
+            self.redis,
+            self.db.images,
+            search,
+            'admin'
+        )
+        found, pagination = yield tornado.gen.Task(
+            find_page,
+            self.db.images,
+            search,
+            page_size,
+            after=self.get_cursor_argument('after'),
+            before=self.get_cursor_argument('before')
         )
-        #image = yield motor.Op(cursor.next_object)
         images = []
-        count = 0
-        total_bytes_served = 0
-        total_hits = 0
-        _shown_image_ids = []
 
-        while (yield cursor.fetch_next):
-            image = cursor.next_object()
+        for image in found:
             if not image.get('width'):
                 if image['contenttype'] == 'image/jpeg':
                     extension = 'jpg'
@@ -181,7 +159,6 @@ class AdminHomeHandler(AdminBaseHandler):
                     extension,
                 )
                 if not original:
-                    image = yield motor.Op(cursor.next_object)
                     continue
 
                 size = Image.open(original).size
@@ -197,20 +174,10 @@ class AdminHomeHandler(AdminBaseHandler):
                 image['width'] = data['width']
                 image['height'] = data['height']
 
-            self.attach_tiles_info(image)
+            yield tornado.gen.Task(self.attach_tiles_info, image)
             if not image.get('cdn_domain'):
                 lock_key = 'uploading:%s' % image['fileid']
                 image['uploading_locked'] = self.redis.get(lock_key)
-            count += 1
-            served = self.redis.hget('bytes_served', image['fileid'])
-            if served is not None:
-                total_bytes_served += int(served)
-                image['bytes_served'] = int(served)
-            hits = self.redis.get('hits:%s' % image['fileid'])
-            if hits is not None:
-                total_hits += int(hits)
-                image['hits'] = int(hits)
-            _shown_image_ids.append(image['_id'])
             comments = self.redis.hget('comments', image['fileid'])
             if comments is not None:
                 comments = int(comments)
@@ -218,40 +185,26 @@ class AdminHomeHandler(AdminBaseHandler):
             self.attach_tweet_info(image)
             self.attach_original_info(image)
             images.append(image)
-            #image = yield motor.Op(cursor.next_object)
 
-        pagination = None
-        if total_count > count:
-            # pagination in order!
-            pagination = {
-                'current_page': page,
-                'range': range(1, total_count / page_size + 2)
-            }
-            if (page - 1) * page_size > 0:
-                pagination['prev'] = page - 1
-            if page * page_size < total_count:
-                pagination['next'] = page + 1
+        stats = get_stats(self.redis, [x['fileid'] for x in images])
+        for image in images:
+            numbers = stats[image['fileid']]
+            if numbers['bytes_served'] is not None:
+                image['bytes_served'] = numbers['bytes_served']
+            if numbers['hits'] is not None:
+                image['hits'] = numbers['hits']
 
+        if not pagination['before'] and not pagination['after']:
+            pagination = None
         data['pagination'] = pagination
 
         data['images'] = images
         data['total_count'] = total_count
         data['bytes_downloaded'] = self.redis.get('bytes_downloaded')
 
-        cursor = self.db.images.find({}, ('fileid',))
-        #image = yield motor.Op(cursor.next_object)
-        while (yield cursor.fetch_next):
-            image = cursor.next_object()
-            if image['_id'] not in _shown_image_ids:
-                served = self.redis.hget('bytes_served', image['fileid'])
-                if served is not None:
-                    total_bytes_served += int(served)
-                hits = self.redis.get('hits:%s' % image['fileid'])
-                if hits is not None:
-                    total_hits += int(hits)
-            #image = yield motor.Op(cursor.next_object)
-        data['total_bytes_served'] = total_bytes_served
-        data['total_hits'] = total_hits
+        totals = yield tornado.gen.Task(self.get_site_totals)
+        data['total_bytes_served'] = totals['total_bytes_served']
+        data['total_hits'] = totals['total_hits']
         total_comments = yield motor.Op(self.db.comments.find().count)
         data['total_comments'] = total_comments
         self.render('admin/home.html', **data)
@@ -314,7 +267,7 @@ class AdminImageHandler(AdminBaseHandler):
         if not image:
             raise tornado.web.HTTPError(404, "File not found")
 
-        self.attach_tiles_info(image)
+        yield tornado.gen.Task(self.attach_tiles_info, image)
         self.attach_hits_info(image)
         self.attach_comments_info(image)
         self.attach_tweet_info(image)
@@ -403,11 +356,17 @@ class AdminTilesHandler(AdminBaseHandler):
         else:
             raise NotImplementedError
 
-        image['found_tiles'] = self._count_tiles(image)
+        image['found_tiles'] = yield tornado.gen.Task(
+            self._count_tiles,
+            image
+        )
         _ranges = image.get('ranges')
         if _ranges:
             _ranges = [int(x) for x in _ranges]
-        image['ranges'] = _ranges or self._calculate_ranges(image)
+        image['ranges'] = _ranges or self.calculate_ranges(
+            image['width'],
+            image['height']
+        )
         image['expected_tiles'] = self._expected_tiles(image)
         _tiles_before = self.get_argument('before', None)
         if _tiles_before is not None and _tiles_before != image['found_tiles']:
@@ -431,8 +390,9 @@ class AdminTilesHandler(AdminBaseHandler):
         _cols = {}
         _rows = {}
         tiles = {}
-        root = self.application.settings['static_path']
+        manifest = yield tornado.gen.Task(self.get_tile_manifest, fileid)
         for zoom in image['ranges']:
+            names = manifest.get_names(zoom)
             extra = self.get_extra_rows_cols(zoom)
             tiles[zoom] = {}
             width = 256 * (2 ** zoom)
@@ -442,15 +402,7 @@ class AdminTilesHandler(AdminBaseHandler):
             for row in range(rows):
                 for col in range(cols):
                     key = '%s,%s' % (row, col)
-                    filename = os.path.join(
-                        root,
-                        'tiles',
-                        image_split,
-                        '256',
-                        str(zoom),
-                        key + '.' + extension
-                    )
-                    tiles[zoom][key] = os.path.isfile(filename)
+                    tiles[zoom][key] = key + '.' + extension in names
         data['rows'] = _rows
         data['cols'] = _cols
         data['tiles'] = tiles
@@ -480,12 +432,15 @@ class AdminPrepareAllTilesHandler(AdminBaseHandler, TileMakerMixin):
             content_type=image['contenttype']
         )
 
-        count_before = self._count_tiles(image)
+        count_before = yield tornado.gen.Task(self._count_tiles, image)
 
         _ranges = image.get('ranges')
         if _ranges:
             _ranges = [int(x) for x in _ranges]
-        ranges = _ranges or self._calculate_ranges(image)
+        ranges = _ranges or self.calculate_ranges(
+            image['width'],
+            image['height']
+        )
 
         extension = destination.split('.')[-1]
 
@@ -497,9 +452,6 @@ class AdminPrepareAllTilesHandler(AdminBaseHandler, TileMakerMixin):
             extension,
         )
 
-        count_key = 'count_all_tiles:%s' % image['fileid']
-        self.redis.delete(count_key)
-
         url = self.reverse_url('admin_tiles', fileid)
         data = {
             'before': str(count_before),
@@ -533,6 +485,7 @@ class AdminToggleFeaturedHandler(AdminBaseHandler):
             {'_id': image['_id']},
             {'$set': {'featured': not featured}}
         )
+        self.clear_thumbnail_grid_cache()
 
         url = self.reverse_url('admin_image', fileid)
         self.redirect(url)
@@ -565,8 +518,8 @@ class AdminUnsetCDNHandler(AdminBaseHandler):
         # locking it from aws upload for 1 hour
         self.redis.setex(lock_key, time.time(), 60 * 60)
 
-        metadata_key = 'metadata:%s' % fileid
-        self.redis.delete(metadata_key)
+        metadata_key = get_metadata_key(fileid)
+        self.redis.delete(metadata_key, get_uploaded_key(fileid))
 
         upload_log = os.path.join(
             self.application.settings['static_path'],
@@ -672,19 +625,7 @@ class AdminResendEmailHandler(AdminBaseHandler, TileMakerMixin):
             extension,
             email,
         )
-
-        delay = 1
-        total_delay = 0
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        while job.result is None:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
-            )
-            delay += 1
-            total_delay += delay
-            if total_delay > 3:
-                break
+        yield tornado.gen.Task(self.job_notifier.wait, job, 3)
 
         url = self.reverse_url('admin_image', fileid)
         self.redirect(url)
@@ -708,10 +649,9 @@ class AdminAWSUpdateHandler(AdminBaseHandler):
         if not image:
             raise tornado.web.HTTPError(404, "File not found")
 
-        all_tiles = find_all_tiles(
-            fileid,
-            self.application.settings['static_path']
-        )
+        image_split = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
+        manifest = yield tornado.gen.Task(self.get_tile_manifest, fileid)
+        all_tiles = manifest.iter_tiles()
         count = 0
         q = Queue('low', connection=self.redis)
         years = int(self.get_argument('years', 1))
@@ -719,12 +659,10 @@ class AdminAWSUpdateHandler(AdminBaseHandler):
         buckets = []
         bucket = []
         for tile in all_tiles:
-            tile_path = tile.replace(
-                self.application.settings['static_path'],
-                ''
+            tile_path = self.tile_store.get_relative_path(
+                image_split,
+                *tile
             )
-            if tile_path.startswith('/'):
-                tile_path = tile_path[1:]
             bucket.append(tile_path)
             if len(bucket) > 50:
                 buckets.append(bucket)
@@ -789,7 +727,7 @@ class AdminRecalculateSizeHandler(AdminBaseHandler):
             {'$set': {'size': size}}
         )
 
-        metadata_key = 'metadata:%s' % fileid
+        metadata_key = get_metadata_key(fileid)
         self.redis.delete(metadata_key)
         self.redis.hdel('metadata-rendered', fileid)
 
@@ -924,28 +862,16 @@ class AdminTweetImageHandler(AdminBaseHandler):
             )
 
             q = Queue('low', connection=self.redis)
-            job = q.enqueue(
+            job = self.job_notifier.enqueue(
+                q,
                 tweet_with_media,
-                text,
-                thumbnail_path
+                args=(text, thumbnail_path)
             )
         else:
             raise NotImplementedError('regular tweeting not done yet')
 
-        delay = 1
-        total_delay = 0
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        while job.result is None:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
-            )
-            delay += 1
-            total_delay += delay
-            if total_delay > 5:
-                break
-        if job.result:
-            id_ = job.result
+        id_ = yield tornado.gen.Task(self.job_notifier.wait, job, 5)
+        if id_:
             self.redis.hset('tweets', fileid, id_)
 
         #url = self.reverse_url('admin_image', fileid)
@@ -1010,25 +936,16 @@ class AdminRecoverImageOriginalHandler(AdminBaseHandler):
         image = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
 
         q = Queue('default', connection=self.redis)
-        job = q.enqueue(
+        job = self.job_notifier.enqueue(
+            q,
             download_original,
-            os.path.join('uploads', image + '.' + extension),
-            self.application.settings['static_path'],
-            settings.ORIGINALS_BUCKET_ID
-        )
-
-        delay = 1
-        total_delay = 0
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        while job.result is None:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
+            args=(
+                os.path.join('uploads', image + '.' + extension),
+                self.application.settings['static_path'],
+                settings.ORIGINALS_BUCKET_ID
             )
-            delay += 1
-            total_delay += delay
-            if total_delay > 5:
-                break
+        )
+        yield tornado.gen.Task(self.job_notifier.wait, job, 5)
 
         url = self.reverse_url('admin_image', fileid)
         self.redirect(url)
@@ -112,41 +112,41 @@ class APIUploadHandler(APIBaseHandler,
         self.finish()
 
 
-@route('/api/upload/(?P<fileid>\w{9})$', name='api_upload_progress')
-class APIUploadProgressHandler(APIBaseHandler, ProgressMixin):
+class APIProgressMixin(ProgressMixin):
 
-    def get(self, fileid):
-        content_type = self.redis.get('contenttype:%s' % fileid)
-        if content_type is None:
+    def get_full_url(self, path):
+        return '%s://%s%s' % (self.request.protocol, self.request.host, path)
+
+    def get_progress_or_410(self, fileid):
+        data = self.get_progress(fileid)
+        if data is None:
             raise tornado.web.HTTPError(
                 410,
                 'Elvis has already left the building'
             )
-        expected_size = self.redis.get('expectedsize:%s' % fileid)
-
-        data = self.get_progress(fileid, content_type=content_type)
-        # data will only contain `done` to say how much has been saved,
-        # let's make it a bit richer
-        if expected_size is not None:
-            data['left'] = int(expected_size) - data['done']
-            data['percentage'] = (
-                round(100.0 * data['done'] / int(expected_size), 1)
-            )
+        return data
 
-        sizeinfo = self.redis.get('sizeinfo:%s' % fileid)
-        if sizeinfo is not None:
-            sizeinfo = tornado.escape.json_decode(sizeinfo)
-            for key in ('width', 'height'):
-                if key in sizeinfo:
-                    data[key] = sizeinfo[key]
-            base_url = (
-                '%s://%s' %
-                (self.request.protocol, self.request.host)
-            )
-            data['url'] = base_url + self.reverse_url('image', fileid)
+
+@route('/api/upload/(?P<fileid>\w{9})$', name='api_upload_progress')
+class APIUploadProgressHandler(APIBaseHandler, APIProgressMixin):
+
+    def get(self, fileid):
+        data = self.get_progress_or_410(fileid)
+        if data.get('url'):
+            data['url'] = self.get_full_url(data['url'])
         self.write(data)
 
 
+@route('/api/upload/(?P<fileid>\w{9})/stream$',
+       name='api_upload_progress_stream')
+class APIUploadProgressStreamHandler(APIBaseHandler, APIProgressMixin):
+
+    @tornado.web.asynchronous
+    def get(self, fileid):
+        self.get_progress_or_410(fileid)
+        self.stream_progress(fileid)
+
+
 @route('/api/(?P<fileid>\w{9})$', name='api_image')
 class APIImageHandler(APIBaseHandler, ImageMetadataMixin):
 
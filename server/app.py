@@ -5,13 +5,24 @@ import re
 import logging
 from time import sleep
 import tornado.httpserver
+import tornado.httpclient
+import tornado.curl_httpclient
 import tornado.ioloop
 from tornado.options import define, options
 from tornado_utils.routes import route
 import redis.client
+import tornadoredis
 from rq import Queue
 import motor
 import settings
+from tilestore import get_tile_store
+from tilecache import TileCache
+from fileio import FileIO
+from jobs import JobNotifier
+from progress import ProgressHub
+from stats import HitBuffer
+from metadata import MetadataLoader
+from indexes import ensure_indexes, get_db
 import handlers
 import api_handlers
 import admin_handlers
@@ -38,6 +49,80 @@ class Application(tornado.web.Application):
             )
         return self._redis
 
+    _redis_pool = None
+
+    @property
+    def redis_pool(self):
+        if not self._redis_pool:
+            self._redis_pool = tornadoredis.ConnectionPool(
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                wait_for_available=True,
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT
+            )
+        return self._redis_pool
+
+    _tile_store = None
+
+    @property
+    def tile_store(self):
+        if not self._tile_store:
+            self._tile_store = get_tile_store(self.settings['static_path'])
+        return self._tile_store
+
+    _tile_cache = None
+
+    @property
+    def tile_cache(self):
+        if not self._tile_cache:
+            self._tile_cache = TileCache(settings.TILE_CACHE_MAX_BYTES)
+            self._tile_cache.listen()
+        return self._tile_cache
+
+    _file_io = None
+
+    @property
+    def file_io(self):
+        if not self._file_io:
+            self._file_io = FileIO(settings.FILE_IO_THREADS)
+        return self._file_io
+
+    _job_notifier = None
+
+    @property
+    def job_notifier(self):
+        if not self._job_notifier:
+            self._job_notifier = JobNotifier()
+        return self._job_notifier
+
+    _progress_hub = None
+
+    @property
+    def progress_hub(self):
+        if not self._progress_hub:
+            self._progress_hub = ProgressHub()
+        return self._progress_hub
+
+    _hit_buffer = None
+
+    @property
+    def hit_buffer(self):
+        if not self._hit_buffer:
+            self._hit_buffer = HitBuffer(
+                self.redis,
+                settings.HIT_FLUSH_INTERVAL,
+                settings.HIT_FLUSH_EVENTS
+            )
+        return self._hit_buffer
+
+    _metadata_loader = None
+
+    @property
+    def metadata_loader(self):
+        if not self._metadata_loader:
+            self._metadata_loader = MetadataLoader(self.db, self.redis_pool)
+        return self._metadata_loader
+
     _db_connection = None
 
     @property
@@ -79,6 +164,12 @@ class Application(tornado.web.Application):
             ui_modules_map['Static'] = tornado_static.PlainStatic
             ui_modules_map['StaticURL'] = tornado_static.PlainStaticURL
 
+        # from the start so every request made by the handlers goes
+        # through the same client
+        tornado.httpclient.AsyncHTTPClient.configure(
+            tornado.curl_httpclient.CurlAsyncHTTPClient
+        )
+
         routed_handlers = route.get_routes()
         app_settings = dict(
             template_path=os.path.join(os.path.dirname(__file__), "templates"),
@@ -128,7 +219,10 @@ def main():  # pragma: no cover
     else:
         raise SystemError("Queue workers not responding")
 
-    http_server = tornado.httpserver.HTTPServer(Application())
+    ensure_indexes(get_db())
+
+    application = Application()
+    http_server = tornado.httpserver.HTTPServer(application)
     print "Starting tornado on port", options.port
     logging.info("Starting tornado on port :%s" % options.port)
     http_server.listen(options.port)
@@ -136,6 +230,9 @@ def main():  # pragma: no cover
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt:
         pass
+    finally:
+        if application._hit_buffer:
+            application._hit_buffer.flush()
 
 
 if __name__ == "__main__":  # pragma: no cover
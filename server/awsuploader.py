@@ -6,15 +6,17 @@ import os
 import time
 import email
 import motor
-import pymongo
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 from boto.s3.connection import Location, S3Connection
 from boto.s3.key import Key
-from tornado import gen
-from tornado.ioloop import IOLoop
-import redis.client
 import settings
-from utils import find_all_tiles, find_original
+from utils import find_original
+from tilestore import get_tile_store
+from manifest import TileManifest, get_redis
+from indexes import get_db
+from metadata import get_key as get_metadata_key
 
 
 def upload_original(fileid, extension, static_path, bucket_id):
@@ -76,108 +78,142 @@ def _get_aggressive_cache_headers(key, years):
     return metadata
 
 
-@gen.engine
-def upload_all_tiles(fileid, static_path, bucket_id, max_count=0,
-                     only_if_no_cdn_domain=False,
-                     replace=True):
-    log_file = os.path.join(static_path, 'upload.%s.txt' % fileid)
+def get_uploaded_key(fileid):
+    """set of the relative paths of the tiles that are on S3"""
+    return 'uploaded:%s' % fileid
 
-    conn = S3Connection(settings.AWS_ACCESS_KEY, settings.AWS_SECRET_KEY)
-    bucket = conn.lookup(bucket_id) or conn.create_bucket(bucket_id, location=Location.EU)
-    #bucket.set_acl('public-read')
 
-    db_connection = motor.MotorClient().open_sync()
-    db = db_connection[settings.DATABASE_NAME]
+_local = threading.local()
 
-    document = yield motor.Op(
-        db.images.find_one,
-        {'fileid': fileid}
-    )
+
+def _get_bucket(bucket_id):
+    """one S3 connection per thread, reused for every upload"""
+    if not hasattr(_local, 'buckets'):
+        _local.connection = S3Connection(
+            settings.AWS_ACCESS_KEY,
+            settings.AWS_SECRET_KEY
+        )
+        _local.buckets = {}
+    if bucket_id not in _local.buckets:
+        _local.buckets[bucket_id] = (
+            _local.connection.lookup(bucket_id) or
+            _local.connection.create_bucket(bucket_id, location=Location.EU)
+        )
+    return _local.buckets[bucket_id]
+
+
+def _import_upload_log(_redis, fileid, static_path):
+    # what uploads used to be recorded in
+    log_file = os.path.join(static_path, 'upload.%s.txt' % fileid)
+    try:
+        done = [x.strip() for x in open(log_file) if x.strip()]
+    except IOError:
+        return
+    if done:
+        _redis.sadd(get_uploaded_key(fileid), *done)
+    os.remove(log_file)
+
+
+def upload_all_tiles(fileid, static_path, bucket_id, max_count=0,
+                     only_if_no_cdn_domain=False,
+                     replace=True):
+    """upload every tile that isn't uploaded yet on
+    `settings.S3_UPLOAD_THREADS` threads and set the cdn_domain once
+    they all are.
+
+    Each uploaded tile is added to the `uploaded:<fileid>` set straight
+    away so if the worker dies the next attempt carries on where this
+    one stopped.
+    """
+    db = get_db()
+    document = db.images.find_one({'fileid': fileid})
     if not document:
         logging.warning("Image %r does not exist" % fileid)
-        IOLoop.instance().stop()
         return
 
     if document.get('cdn_domain'):
         if only_if_no_cdn_domain:
-            IOLoop.instance().stop()
             return
         else:
             warnings.warn("%s already has a cdn_domain (%s)" %
                           (fileid, document['cdn_domain']))
 
-    try:
-        count = 0
-        all_done = True
-        all_tiles = list(find_all_tiles(fileid, static_path))
-        random.shuffle(all_tiles)
-        #if len(all_tiles) > max_count:
-        #    total = max_count
-        #else:
-        #    total = len(all_tiles)
-        total = len(all_tiles)
-        aggressive_headers = get_aggressive_headers()
-        for each in all_tiles:
-            # load which ones we've done every time to prevent
-            # parallel workers uploading the same file more than once
-            try:
-                done = [x.strip() for x in open(log_file) if x.strip()]
-            except IOError:
-                done = []
-            if each not in done:
-                done.append(each)
-                relative_path = each.replace(static_path, '')
-                k = Key(bucket)
-                k.key = relative_path
-                # docs:
-                # http://boto.cloudhackers.com/en/latest/ref/s3.html#boto.s3.\
-                #   key.Key.set_contents_from_filename
-                print "uploading", relative_path,
-                try:
-                    count_done = set(x.strip() for x in open(log_file))
-                except IOError:
-                    count_done = []
-                print "(%d of %d)" % (len(count_done), total)
-                k.set_contents_from_filename(
-                    each,
-                    replace=replace,
-                    reduced_redundancy=True,
-                    headers=aggressive_headers,
-                )
-                k.make_public()
-                open(log_file, 'a').write(each + '\n')
-                count += 1
-                if max_count > 0 and count >= max_count:
-                    print "STOPPING @", count
-                    all_done = False
-                    break
-
-        if all_done:
-            data = {'cdn_domain': settings.DEFAULT_CDN_TILER_DOMAIN}
-            print "Updating document finally"
-            yield motor.Op(
-                db.images.update,
-                {'_id': document['_id']},
-                {'$set': data}
-            )
-            # invalidate some redis keys
-            _redis = redis.client.Redis(
-                settings.REDIS_HOST,
-                settings.REDIS_PORT
-            )
-            lock_key = 'uploading:%s' % fileid
-            _redis.delete(lock_key)
-            metadata_key = 'metadata:%s' % fileid
-            # make it expire in a minute
-            data = _redis.get(metadata_key)
-            if data:
-                # this gives all workers a chance to finish
-                # any leftover jobs such as optimizations
-                _redis.setex(metadata_key, data, 60)
+    store = get_tile_store(static_path)
+    image = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
+    _redis = get_redis()
+    uploaded_key = get_uploaded_key(fileid)
+    _import_upload_log(_redis, fileid, static_path)
+
+    manifest = TileManifest(_redis, fileid)
+    if manifest.is_built():
+        all_tiles = list(manifest.iter_tiles())
+    else:
+        all_tiles = list(store.list_tiles(image))
+    paths = dict(
+        (store.get_relative_path(image, *tile), tile)
+        for tile in all_tiles
+    )
+    todo = list(set(paths) - _redis.smembers(uploaded_key))
+    # so parallel workers are less likely to pick the same ones
+    random.shuffle(todo)
+    if max_count > 0:
+        todo = todo[:max_count]
+    total = len(todo)
+    aggressive_headers = get_aggressive_headers()
+
+    def upload(each):
+        # another worker might have done it since we started
+        if _redis.sismember(uploaded_key, each):
+            return 0
+        tile = paths[each]
+        headers = dict(aggressive_headers)
+        if tile[-1] == 'png':
+            headers['Content-Type'] = 'image/png'
+        else:
+            headers['Content-Type'] = 'image/jpeg'
+        k = Key(_get_bucket(bucket_id))
+        k.key = '/' + each
+        # docs:
+        # http://boto.cloudhackers.com/en/latest/ref/s3.html#boto.s3.\
+        #   key.Key.set_contents_from_string
+        k.set_contents_from_string(
+            store.read(image, *tile),
+            replace=replace,
+            reduced_redundancy=True,
+            headers=headers,
+            policy='public-read',
+        )
+        _redis.sadd(uploaded_key, each)
+        return 1
 
+    pool = ThreadPool(settings.S3_UPLOAD_THREADS)
+    try:
+        count = sum(pool.map(upload, todo))
     finally:
-        print "# done", count
-        IOLoop.instance().stop()
+        pool.close()
+        pool.join()
+    print "# uploaded", count, "of", total
+
+    if set(paths) - _redis.smembers(uploaded_key):
+        # not done yet
+        return
+
+    data = {'cdn_domain': settings.DEFAULT_CDN_TILER_DOMAIN}
+    print "Updating document finally"
+    db.images.update(
+        {'_id': document['_id']},
+        {'$set': data}
+    )
+    # invalidate some redis keys
+    lock_key = 'uploading:%s' % fileid
+    _redis.delete(lock_key, uploaded_key)
+    metadata_key = get_metadata_key(fileid)
+    # make it expire in a minute
+    data = _redis.get(metadata_key)
+    if data:
+        # this gives all workers a chance to finish
+        # any leftover jobs such as optimizations
+        _redis.setex(metadata_key, data, 60)
 
 
 def get_aggressive_headers(years=1):
@@ -193,7 +229,7 @@ def get_aggressive_headers(years=1):
     }
 
 
-def upload_tiles(fileid, static_path, max_count=10,
+def upload_tiles(fileid, static_path, max_count=0,
                  only_if_no_cdn_domain=False,
                  replace=True):
     upload_all_tiles(
@@ -204,7 +240,6 @@ def upload_tiles(fileid, static_path, max_count=10,
         only_if_no_cdn_domain=only_if_no_cdn_domain,
         replace=replace
     )
-    IOLoop.instance().start()
 
 
 def run(*fileids):
@@ -212,9 +247,7 @@ def run(*fileids):
     for fileid in fileids:
         upload_original(fileid, 'jpg', static_path, settings.ORIGINALS_BUCKET_ID)
 
-        #upload_all_tiles(fileid, static_path, settings.TILES_BUCKET_ID,
-        #                 max_count=3)
-        #IOLoop.instance().start()
+        #upload_tiles(fileid, static_path, max_count=3)
 
 
 if __name__ == '__main__':
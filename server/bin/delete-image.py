@@ -9,6 +9,10 @@ import sys
 ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, ROOT)
 import settings
+from fragments import bump_generation, THUMBNAIL_GRID
+import ranking
+from awsuploader import get_uploaded_key
+from tilecache import invalidate as invalidate_tile_cache
 
 
 HERE = os.path.dirname(__file__)
@@ -38,17 +42,16 @@ def run(*fileids):
             print "Invalidated metadata cache"
             _redis.delete(metadata_key)
         lock_key = 'uploading:%s' % document['fileid']
-        _redis.delete(lock_key)
+        _redis.delete(lock_key, get_uploaded_key(document['fileid']))
+        ranking.remove_image(_redis, document['fileid'], document['user'])
+        invalidate_tile_cache(_redis, image_split)
 
         all_fileids_key = 'allfileids'
         _redis.delete(all_fileids_key)
         all_fileids_key += ':%s' % document['user']
         _redis.delete(all_fileids_key)
 
-        cache_keys_key = 'thumbnail_grid:keys'
-        for key in _redis.lrange(cache_keys_key, 0, -1):
-            _redis.delete(key)
-        _redis.delete(cache_keys_key)
+        bump_generation(_redis, THUMBNAIL_GRID)
 
         yield motor.Op(
             db.images.remove,
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""Create all the indexes in indexes.INDEXES.
+
+With --audit it then runs explain() on every known query shape and
+exits with an error if any of them would scan a whole collection.
+"""
+
+import os, sys
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), '..')
+)
+
+from indexes import ensure_indexes, audit, get_db
+
+
+def run(*args):
+    db = get_db()
+    ensure_indexes(db)
+    print "Indexes ensured"
+    if '--audit' in args:
+        bad = audit(db)
+        for collection, spec, sort in bad:
+            print "COLLSCAN", collection, spec, sort or ''
+        if bad:
+            return 1
+        print "All query shapes use an index"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(*sys.argv[1:]))
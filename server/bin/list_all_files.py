@@ -6,15 +6,19 @@ sys.path.insert(
     os.path.join(os.path.dirname(__file__), '..')
 )
 
-from utils import find_all_tiles
+from tilestore import get_tile_store
 
 
-def run(fileids):
+def run(*fileids):
     static_path = os.path.join(os.path.abspath(os.curdir), 'static')
+    store = get_tile_store(static_path)
     for fileid in fileids:
-        for each in find_all_tiles(fileid, static_path):
-            print each
-            assert os.path.isfile(each), each
+        image = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
+        for size, zoom, row, col, extension in store.list_tiles(image):
+            print store.get_relative_path(
+                image, size, zoom, row, col, extension
+            )
+            assert store.exists(image, size, zoom, row, col, extension)
 
 
 if __name__ == '__main__':
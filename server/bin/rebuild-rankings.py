@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+import os
+import motor
+from tornado import gen
+from tornado.ioloop import IOLoop
+import redis.client
+import sys
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+import settings
+import ranking
+from stats import get_stats
+
+
+@gen.engine
+def run(*args):
+    _redis = redis.client.Redis(
+        settings.REDIS_HOST,
+        settings.REDIS_PORT
+    )
+    connection = motor.MotorClient().open_sync()
+    db = connection[settings.DATABASE_NAME]
+
+    try:
+        images = []
+        cursor = db.images.find({}, ('fileid', 'user'))
+        while (yield cursor.fetch_next):
+            image = cursor.next_object()
+            images.append((image['fileid'], image['user']))
+        print len(images), "images"
+        stats = get_stats(_redis, [x[0] for x in images])
+        ranking.rebuild(_redis, images, stats)
+        for board in (ranking.HITS, ranking.HITS_THIS_MONTH,
+                      ranking.BYTES_SERVED):
+            print board
+            for score, fileid in ranking.get_top(_redis, board, 3):
+                print "\t", fileid, score
+    finally:
+        IOLoop.instance().stop()
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:])
+    IOLoop.instance().start()
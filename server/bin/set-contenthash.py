@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+import os
+import hashlib
+import motor
+from tornado import gen
+from tornado.ioloop import IOLoop
+import sys
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+import settings
+from utils import find_original
+
+
+def get_content_hash(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+@gen.engine
+def run(*args):
+    connection = motor.MotorClient().open_sync()
+    db = connection[settings.DATABASE_NAME]
+    static_path = os.path.join(ROOT, 'static')
+
+    try:
+        cursor = db.images.find(
+            {'contenthash': {'$exists': False}, 'width': {'$exists': True}},
+            ('_id', 'fileid', 'contenttype')
+        )
+        count = missing = 0
+        while (yield cursor.fetch_next):
+            image = cursor.next_object()
+            if image['contenttype'] == 'image/png':
+                extension = 'png'
+            else:
+                extension = 'jpg'
+            original = find_original(image['fileid'], static_path, extension)
+            if not original:
+                missing += 1
+                continue
+            yield motor.Op(
+                db.images.update,
+                {'_id': image['_id']},
+                {'$set': {'contenthash': get_content_hash(original)}}
+            )
+            count += 1
+        print count, "images given a contenthash"
+        if missing:
+            print missing, "images without an original on disk"
+    finally:
+        IOLoop.instance().stop()
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:])
+    IOLoop.instance().start()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import os
+import motor
+from tornado import gen
+from tornado.ioloop import IOLoop
+import sys
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+import settings
+from sampling import get_random_value, RANDOM_FIELD
+
+
+@gen.engine
+def run(*args):
+    connection = motor.MotorClient().open_sync()
+    db = connection[settings.DATABASE_NAME]
+
+    try:
+        cursor = db.images.find({RANDOM_FIELD: {'$exists': False}}, ('_id',))
+        count = 0
+        while (yield cursor.fetch_next):
+            image = cursor.next_object()
+            yield motor.Op(
+                db.images.update,
+                {'_id': image['_id']},
+                {'$set': {RANDOM_FIELD: get_random_value()}}
+            )
+            count += 1
+        print count, "images given a random value"
+    finally:
+        IOLoop.instance().stop()
+
+
+if __name__ == '__main__':
+    run(*sys.argv[1:])
+    IOLoop.instance().start()
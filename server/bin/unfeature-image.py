@@ -10,6 +10,7 @@ import sys
 ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, ROOT)
 import settings
+from fragments import bump_generation, THUMBNAIL_GRID
 
 
 
@@ -32,10 +33,7 @@ def run(*fileids):
                 {'$set': {'featured': False}}
             )
 
-            cache_keys_key = 'thumbnail_grid:keys'
-            for key in _redis.lrange(cache_keys_key, 0, -1):
-                _redis.delete(key)
-            _redis.delete(cache_keys_key)
+            bump_generation(_redis, THUMBNAIL_GRID)
 
     finally:
         IOLoop.instance().stop()
@@ -11,6 +11,7 @@ import sys
 ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, ROOT)
 import settings
+from awsuploader import get_uploaded_key
 
 
 
@@ -39,6 +40,7 @@ def run(*fileids):
             lock_key = 'uploading:%s' % document['fileid']
             # locking it from aws upload for 1 hour
             _redis.setex(lock_key, time.time(), 60 * 60)
+            _redis.delete(get_uploaded_key(document['fileid']))
 
             upload_log = os.path.join(
                 ROOT,
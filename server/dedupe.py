@@ -0,0 +1,65 @@
+import tornado.gen
+
+
+# the response headers that say whether a URL still serves the same
+# thing as last time
+SOURCE_HEADERS = (
+    ('etag', 'ETag'),
+    ('last_modified', 'Last-Modified'),
+    ('content_length', 'Content-Length'),
+)
+
+
+def get_source_info(headers):
+    info = {}
+    for key, header in SOURCE_HEADERS:
+        if headers.get(header):
+            info[key] = headers[header]
+    return info
+
+
+def is_same_source(info, other):
+    """True if there's an ETag or Last-Modified to go by and nothing
+    the two have in common disagrees"""
+    if not info or not other:
+        return False
+    common = set(info) & set(other)
+    if not common & set(['etag', 'last_modified']):
+        return False
+    return all(info[key] == other[key] for key in common)
+
+
+@tornado.gen.engine
+def find_by_source(collection, url, info, callback):
+    """callback with the newest finished image that was downloaded from
+    `url` when it served the same thing or None"""
+    cursor = (
+        collection.find({'source': url, 'contenthash': {'$exists': True}})
+        .sort([('date', -1)])
+        .limit(5)
+    )
+    found = None
+    while (yield cursor.fetch_next):
+        image = cursor.next_object()
+        if not found and is_same_source(info, image.get('sourceinfo')):
+            found = image
+    callback(found)
+
+
+@tornado.gen.engine
+def find_by_content(collection, contenthash, user, callback):
+    """callback with a finished image with exactly the same bytes, the
+    user's own if there is one, or None"""
+    cursor = (
+        collection.find({
+            'contenthash': contenthash,
+            'width': {'$exists': True},
+        })
+        .limit(10)
+    )
+    found = None
+    while (yield cursor.fetch_next):
+        image = cursor.next_object()
+        if not found or image['user'] == user:
+            found = image
+    callback(found)
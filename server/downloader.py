@@ -1,7 +1,16 @@
+import os
 import re
+import time
+import json
 import cStringIO
 import functools
 import pycurl
+from imageprobe import ImageProbe
+from progress import ByteCounter
+import settings
+
+
+RANGES_REFUSED = 'Server did not return ranges'
 
 
 def slow_writer(f, buf):
@@ -10,18 +19,84 @@ def slow_writer(f, buf):
     f.write(buf)
 
 def download(url, destination,
-            follow_redirects=False, request_timeout=600):
+            follow_redirects=False, request_timeout=600,
+            min_width=None,
+            connections=settings.DOWNLOAD_CONNECTIONS,
+            range_size=settings.DOWNLOAD_RANGE_SIZE,
+            fileid=None, expected_size=None):
+    """download `url` to `destination` and work out the MD5
+    ('contenthash'), number of bytes ('size') and dimensions ('width'
+    and 'height') on the way.
+
+    If the image turns out to be less than `min_width` wide the download
+    is stopped as soon as the header has been read.
+
+    If there's a `fileid` how many bytes are in is published as the
+    progress of that upload.
+
+    Big files from servers that accept ranges are downloaded as
+    `range_size` pieces over `connections` connections at a time and
+    can be resumed, see `download_ranges()`.
+    """
+    if connections > 1:
+        length, effective_url = get_ranged_length(url, follow_redirects)
+        if length and length > range_size:
+            response = download_ranges(
+                effective_url,
+                destination,
+                length,
+                request_timeout=request_timeout,
+                min_width=min_width,
+                connections=connections,
+                range_size=range_size,
+                fileid=fileid,
+            )
+            if response.get('body') == RANGES_REFUSED:
+                # it said it would. Do it the old fashioned way.
+                os.remove(get_sidecar_path(destination))
+                response = download(
+                    effective_url,
+                    destination,
+                    request_timeout=request_timeout,
+                    min_width=min_width,
+                    connections=1,
+                    fileid=fileid,
+                    expected_size=length,
+                )
+            if effective_url != url:
+                response['url'] = effective_url
+            return response
+
     _error = _effective_url = None
+    probe = ImageProbe()
+    counter = fileid and ByteCounter(fileid, total=expected_size)
+
+    def too_small():
+        return min_width and probe.size and probe.size[0] < min_width
+
     with open(destination, 'wb') as destination_file:
+        def write(buf):
+            destination_file.write(buf)
+            probe.feed(buf)
+            if counter:
+                counter.update(probe.bytes)
+            if too_small():
+                # anything but len(buf) makes curl stop
+                return 0
+
         hdr = cStringIO.StringIO()
         c = pycurl.Curl()
         c.setopt(pycurl.URL, str(url))
         c.setopt(pycurl.FOLLOWLOCATION, follow_redirects)
         c.setopt(pycurl.HEADERFUNCTION, hdr.write)
-        c.setopt(pycurl.WRITEFUNCTION, destination_file.write)
+        c.setopt(pycurl.WRITEFUNCTION, write)
         #c.setopt(pycurl.WRITEFUNCTION, functools.partial(slow_writer, destination_file))
         c.setopt(pycurl.TIMEOUT_MS, int(1000 * request_timeout))
-        c.perform()
+        try:
+            c.perform()
+        except pycurl.error:
+            if not too_small():
+                raise
         code = c.getinfo(pycurl.HTTP_CODE)
         _effective_url = c.getinfo(pycurl.EFFECTIVE_URL)
         if _effective_url == url:
@@ -32,11 +107,263 @@ def download(url, destination,
             for each in re.findall(r'HTTP\/\S*\s*\d+\s*(.*?)\s*$', status_line):
                 _error = each
 
+    if counter:
+        counter.update(probe.bytes, force=True)
     response = {'code': code}
     if _error:
         response['body'] = _error
     if _effective_url:
         response['url'] = _effective_url
+    if code == 200:
+        _add_probe(response, probe)
+    return response
+
+
+def _add_probe(response, probe):
+    response['size'] = probe.bytes
+    response['contenthash'] = probe.hexdigest
+    if probe.size:
+        response['width'], response['height'] = probe.size
+
+
+def get_ranged_length(url, follow_redirects=False):
+    """return (length, effective_url). `length` is None unless the
+    server says it accepts byte ranges and how big the file is."""
+    hdr = cStringIO.StringIO()
+    c = pycurl.Curl()
+    c.setopt(pycurl.URL, str(url))
+    c.setopt(pycurl.NOBODY, True)
+    c.setopt(pycurl.FOLLOWLOCATION, follow_redirects)
+    c.setopt(pycurl.HEADERFUNCTION, hdr.write)
+    c.setopt(pycurl.TIMEOUT, 30)
+    try:
+        c.perform()
+    except pycurl.error:
+        return None, url
+    effective_url = c.getinfo(pycurl.EFFECTIVE_URL) or url
+    if c.getinfo(pycurl.HTTP_CODE) != 200:
+        return None, effective_url
+    # only the headers of the last response if there were redirects
+    headers = {}
+    for line in hdr.getvalue().splitlines():
+        if line.startswith('HTTP/'):
+            headers = {}
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    if headers.get('accept-ranges', '').lower() != 'bytes':
+        return None, effective_url
+    try:
+        return int(headers['content-length']), effective_url
+    except (KeyError, ValueError):
+        return None, effective_url
+
+
+def get_sidecar_path(destination):
+    """where download_ranges() keeps track of a partial download"""
+    return destination + '.ranges'
+
+
+def is_partial(destination):
+    return os.path.isfile(get_sidecar_path(destination))
+
+
+def _load_sidecar(destination, url, length):
+    """return {range start: bytes received} of a previous attempt at
+    the same download"""
+    try:
+        with open(get_sidecar_path(destination)) as f:
+            sidecar = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if sidecar.get('url') != url or sidecar.get('length') != length:
+        return {}
+    if not os.path.isfile(destination):
+        return {}
+    if os.path.getsize(destination) != length:
+        return {}
+    return dict((int(k), v) for k, v in sidecar['received'].items())
+
+
+def _save_sidecar(destination, url, length, received):
+    path = get_sidecar_path(destination)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'url': url, 'length': length, 'received': received}, f)
+    os.rename(path + '.tmp', path)
+
+
+def download_ranges(url, destination, length, request_timeout=600,
+                    min_width=None,
+                    connections=settings.DOWNLOAD_CONNECTIONS,
+                    range_size=settings.DOWNLOAD_RANGE_SIZE,
+                    attempts=settings.DOWNLOAD_RANGE_ATTEMPTS,
+                    fileid=None):
+    """download `length` bytes of `url` as ranges of `range_size` into
+    a preallocated `destination`, `connections` at a time with one
+    `pycurl.CurlMulti`.
+
+    A range that fails or stalls is carried on from its last byte. It's
+    only given up on after `attempts` tries in a row that got nothing.
+    How much of each range has been received is kept in a sidecar file
+    next to `destination` until the whole file is there so calling this
+    again after a timeout or a dead worker picks up where it stopped.
+    """
+    deadline = time.time() + request_timeout
+    starts = range(0, length, range_size)
+    resumed = _load_sidecar(destination, url, length)
+    received = dict((start, 0) for start in starts)
+    received.update(resumed)
+    failures = dict((start, 0) for start in starts)
+    counter = fileid and ByteCounter(fileid, total=length)
+
+    def get_end(start):
+        return min(start + range_size, length) - 1
+
+    pending = [
+        start for start in starts
+        if received[start] < get_end(start) - start + 1
+    ]
+    # the header is in the first range and that's where a too small
+    # image is noticed, unless it came in on a previous attempt
+    probe = None if received[0] else ImageProbe()
+
+    def too_small():
+        return (
+            min_width and probe is not None and probe.size and
+            probe.size[0] < min_width
+        )
+
+    if not resumed:
+        open(destination, 'wb').close()
+    destination_file = open(destination, 'r+b')
+    # preallocate
+    destination_file.truncate(length)
+
+    def save_progress():
+        destination_file.flush()
+        _save_sidecar(destination, url, length, received)
+
+    # so is_partial() knows from the start
+    save_progress()
+
+    multi = pycurl.CurlMulti()
+    active = {}
+    error = None
+    aborted = False
+
+    def start_range(start):
+        c = pycurl.Curl()
+        c.start = start
+        c.offset = received[start]
+        # getinfo() can't be used until perform() is done
+        status = []
+
+        def header(line):
+            if line.startswith('HTTP/'):
+                status.append(line.split()[1])
+
+        def write(buf):
+            if status[-1] != '206':
+                # the server didn't send just the range after all
+                return 0
+            destination_file.seek(start + received[start])
+            destination_file.write(buf)
+            received[start] += len(buf)
+            if counter:
+                counter.update(sum(received.values()))
+            if start == 0 and probe is not None:
+                probe.feed(buf)
+                if too_small():
+                    return 0
+
+        c.setopt(pycurl.URL, str(url))
+        c.setopt(pycurl.RANGE, '%d-%d' % (start + received[start],
+                                          get_end(start)))
+        c.setopt(pycurl.HEADERFUNCTION, header)
+        c.setopt(pycurl.WRITEFUNCTION, write)
+        c.setopt(pycurl.CONNECTTIMEOUT, 30)
+        # give up on a range that has stalled and carry on from there
+        c.setopt(pycurl.LOW_SPEED_LIMIT, 1)
+        c.setopt(pycurl.LOW_SPEED_TIME, 30)
+        multi.add_handle(c)
+        active[start] = c
+
+    def finish_range(c, failed):
+        start = c.start
+        multi.remove_handle(c)
+        del active[start]
+        code = c.getinfo(pycurl.HTTP_CODE)
+        c.close()
+        # so a worker that gets killed can carry on from here
+        save_progress()
+        if received[start] >= get_end(start) - start + 1:
+            return None
+        if code and code != 206:
+            return RANGES_REFUSED
+        if received[start] == c.offset:
+            # only count the attempts that got nowhere
+            failures[start] += 1
+        if failures[start] >= attempts:
+            return failed or 'Range %d ended early' % start
+        pending.append(start)
+
+    try:
+        while pending or active:
+            if time.time() > deadline:
+                error = 'Download timed out'
+                break
+            while pending and len(active) < connections:
+                start_range(pending.pop(0))
+            while True:
+                ret, _ = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            while True:
+                queued, ok_list, error_list = multi.info_read()
+                for c in ok_list:
+                    failed = finish_range(c, None)
+                    error = error or failed
+                for c, errno, errmsg in error_list:
+                    failed = finish_range(c, errmsg)
+                    error = error or failed
+                if not queued:
+                    break
+            if too_small():
+                aborted = True
+                break
+            if error:
+                break
+            multi.select(1.0)
+    finally:
+        for c in active.values():
+            multi.remove_handle(c)
+            c.close()
+        multi.close()
+        if pending or active or error:
+            save_progress()
+        destination_file.close()
+        if counter:
+            counter.update(sum(received.values()), force=True)
+
+    if aborted:
+        # not worth resuming
+        os.remove(get_sidecar_path(destination))
+        response = {'code': 200}
+        _add_probe(response, probe)
+        return response
+    if error:
+        return {'code': 0, 'body': error}
+
+    if is_partial(destination):
+        os.remove(get_sidecar_path(destination))
+    # the pieces came in out of order so the digest has to be worked
+    # out from the file, which is still cheaper than decoding it
+    probe = ImageProbe()
+    with open(destination, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            probe.feed(chunk)
+    response = {'code': 200}
+    _add_probe(response, probe)
     return response
 
 
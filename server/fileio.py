@@ -0,0 +1,55 @@
+import os
+import logging
+from multiprocessing.pool import ThreadPool
+import tornado.ioloop
+
+
+class FileIO(object):
+    """Runs blocking disk work on a small pool of threads and hands the
+    result back on the IOLoop so a slow disk doesn't stall every other
+    request. Use it with `tornado.gen.Task`::
+
+        data = yield tornado.gen.Task(self.file_io.read, path)
+    """
+
+    def __init__(self, threads):
+        self.pool = ThreadPool(threads)
+
+    def call(self, func, *args, **kwargs):
+        callback = kwargs.pop('callback')
+        io_loop = tornado.ioloop.IOLoop.instance()
+
+        def done(result):
+            io_loop.add_callback(lambda: callback(result))
+
+        def run():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                logging.error('%r failed', func, exc_info=True)
+                return None
+
+        self.pool.apply_async(run, callback=done)
+
+    def read(self, path, callback):
+        """callback with the contents of the file or None if it can't
+        be read"""
+        self.call(_read, path, callback=callback)
+
+    def stat(self, path, callback):
+        self.call(_stat, path, callback=callback)
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
@@ -0,0 +1,22 @@
+import hashlib
+
+
+# rendered fragments that become stale at the same time share a
+# generation number. Bumping it makes every cache key of that kind
+# new and the old ones just expire.
+GENERATION_KEY = 'fragments:%s:generation'
+
+THUMBNAIL_GRID = 'thumbnail_grid'
+
+
+def get_fragment_key(redis, name, *parts):
+    generation = redis.get(GENERATION_KEY % name) or 0
+    return 'fragments:%s:%s:%s' % (
+        name,
+        generation,
+        hashlib.md5(repr(parts)).hexdigest()
+    )
+
+
+def bump_generation(redis, name):
+    redis.incr(GENERATION_KEY % name)
@@ -1,13 +1,13 @@
 import os
-import stat
+import math
 import urllib
-import json
 import uuid
 import random
 import logging
 import hashlib
 import time
 import datetime
+import email.utils
 from pprint import pprint
 
 import premailer
@@ -16,22 +16,37 @@ import tornado.web
 import tornado.gen
 import tornado.escape
 import tornado.httpclient
-import tornado.curl_httpclient
 import tornado.ioloop
 from PIL import Image
 from tornado_utils.routes import route
 from tornado_utils.timesince import smartertimesince as _smartertimesince
 from rq import Queue
 import motor
+import tornadoredis
 from utils import (
-    mkdir, make_tile, make_tiles, make_thumbnail, delete_image,
-    count_all_tiles
+    mkdir, make_tile, make_pyramid, make_thumbnail, get_thumbnail_path,
+    delete_image, clone_image, find_original
+)
+from manifest import TileManifest
+from tilecache import invalidate as invalidate_tile_cache
+from pagination import find_page, get_count, decode_cursor
+from sampling import find_random, get_random_value, RANDOM_FIELD
+from fragments import get_fragment_key, bump_generation, THUMBNAIL_GRID
+from metadata import get_key as get_metadata_key
+import ranking
+from stats import (
+    get_totals, get_site_totals, initialize_site_totals, forget_image,
+    get_hit_keys
 )
 from optimizer import optimize_images, optimize_thumbnails
-from awsuploader import upload_tiles, upload_original
-from resizer import make_resize
+from awsuploader import upload_tiles, upload_original, get_uploaded_key
 from emailer import send_url, send_feedback
-from downloader import download
+from downloader import (
+    download, is_partial, get_sidecar_path
+)
+from imageprobe import ImageProbe
+from dedupe import get_source_info, find_by_source, find_by_content
+import progress
 import settings
 
 
@@ -54,6 +69,8 @@ class BaseHandler(tornado.web.RequestHandler):
     DEFAULT_LAT = 70.0
     DEFAULT_LNG = 00.0
     DEFAULT_EXTENSION = 'png'
+    # anything narrower doesn't even fill the smallest zoom level
+    MIN_WIDTH = 256 * (2 ** DEFAULT_RANGE_MIN)
 
     @property
     def redis(self):
@@ -63,10 +80,160 @@ class BaseHandler(tornado.web.RequestHandler):
     def db(self):
         return self.application.db
 
+    def get_cursor_argument(self, name):
+        """return a pagination cursor from the query string or None"""
+        value = self.get_argument(name, None)
+        if value:
+            try:
+                decode_cursor(value)
+            except ValueError:
+                raise tornado.web.HTTPError(400, 'Invalid %s' % name)
+        return value or None
+
+    _async_redis = None
+
+    @property
+    def async_redis(self):
+        """non-blocking Redis client to use with `tornado.gen.Task`.
+        Its connection goes back to the pool when the request is
+        finished."""
+        if not self._async_redis:
+            self._async_redis = tornadoredis.Client(
+                connection_pool=self.application.redis_pool
+            )
+        return self._async_redis
+
+    def on_finish(self):
+        if self._async_redis:
+            self._async_redis.disconnect()
+            self._async_redis = None
+
+    _prefetched_metadata = None
+
+    @property
+    def prefetched_metadata(self):
+        if self._prefetched_metadata is None:
+            self._prefetched_metadata = {}
+        return self._prefetched_metadata
+
+    @tornado.gen.engine
+    def prefetch_metadata(self, fileids, callback):
+        """fetch everything ShowMetaData needs for these images in one
+        round trip so it doesn't have to block on Redis"""
+        fileids = [x for x in fileids if x not in self.prefetched_metadata]
+        if fileids:
+            _now = datetime.datetime.utcnow()
+            hit_keys, hit_month_keys = zip(
+                *[get_hit_keys(x, _now) for x in fileids]
+            )
+            pipe = self.async_redis.pipeline()
+            pipe.hmget('metadata-rendered', fileids)
+            pipe.mget(hit_keys)
+            pipe.mget(hit_month_keys)
+            pipe.hmget('comments', fileids)
+            rendered, hits, hits_this_month, comments = (
+                yield tornado.gen.Task(pipe.execute)
+            )
+            for i, fileid in enumerate(fileids):
+                self.prefetched_metadata[fileid] = {
+                    'rendered': rendered.get(fileid),
+                    'hits': hits[i],
+                    'hits_this_month': hits_this_month[i],
+                    'comments': comments.get(fileid),
+                }
+        callback()
+
     @property
     def queue(self):
         return self.application.queue
 
+    @property
+    def tile_store(self):
+        return self.application.tile_store
+
+    @property
+    def tile_cache(self):
+        return self.application.tile_cache
+
+    @property
+    def file_io(self):
+        return self.application.file_io
+
+    @property
+    def job_notifier(self):
+        return self.application.job_notifier
+
+    @property
+    def progress_hub(self):
+        return self.application.progress_hub
+
+    def get_metadata(self, fileid, callback):
+        """use with `motor.Op`. The metadata is None if there's no such
+        image"""
+        self.application.metadata_loader.load(fileid, callback)
+
+    @tornado.gen.engine
+    def get_all_fileids(self, callback, user=None):
+        cache_key = 'allfileids'
+        if user:
+            cache_key += ':%s' % user
+        fileids = self.redis.lrange(cache_key, 0, -1)
+        if not fileids:
+            # cache miss
+            fileids = []  # in case it was None
+            search = {}
+            if user:
+                search['user'] = user
+            cursor = self.db.images.find(search, ('fileid',))
+            #image = yield motor.Op(cursor.next_object)
+            while (yield cursor.fetch_next):
+                image = cursor.next_object()
+                self.redis.lpush(cache_key, image['fileid'])
+                fileids.append(image['fileid'])
+                #image = yield motor.Op(cursor.next_object)
+        callback(fileids)
+
+    @tornado.gen.engine
+    def get_site_totals(self, callback):
+        stats = get_site_totals(self.redis)
+        if stats is None:
+            # first time, count up what every image has had so far
+            fileids = yield tornado.gen.Task(self.get_all_fileids)
+            stats = initialize_site_totals(self.redis, fileids)
+        callback(stats)
+
+    def check_not_modified(self, etag, modified):
+        """set the ETag and Last-Modified headers and return True if the
+        copy the client already has is still good"""
+        modified = datetime.datetime.utcfromtimestamp(int(modified))
+        self.set_header('Etag', etag)
+        self.set_header('Last-Modified', modified)
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match:
+            etags = [x.strip() for x in if_none_match.split(',')]
+            return etag in etags or '*' in etags
+        if_modified_since = self.request.headers.get('If-Modified-Since')
+        if if_modified_since:
+            since = email.utils.parsedate(if_modified_since)
+            if since:
+                return modified <= datetime.datetime(*since[:6])
+        return False
+
+    @tornado.gen.engine
+    def get_tile_manifest(self, fileid, callback):
+        manifest = TileManifest(self.redis, fileid)
+        if not manifest.is_built():
+            # images from before there was a manifest. Finding out means
+            # walking the tile store so it's done on the file IO threads.
+            image = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
+            yield tornado.gen.Task(
+                self.file_io.call,
+                manifest.rebuild,
+                self.tile_store,
+                image
+            )
+        callback(manifest)
+
     def get_current_user(self):
         return self.get_secure_cookie('user')
 
@@ -150,22 +317,44 @@ class BaseHandler(tornado.web.RequestHandler):
         return url
 
     def clear_thumbnail_grid_cache(self):
-        logging.warning('clear_thumbnail_grid_cache is deprecated')
-        cache_keys_key = 'thumbnail_grid:keys'
-        for key in self.redis.lrange(cache_keys_key, 0, -1):
-            self.redis.delete(key)
-        self.redis.delete(cache_keys_key)
-
-    def remember_thumbnail_grid_cache_key(self, key):
-        logging.warning('remember_thumbnail_grid_cache_key is deprecated')
-        cache_keys_key = 'thumbnail_grid:keys'
-        self.redis.lpush(cache_keys_key, key)
+        """call when an image is added, removed or changed in a way
+        that shows in the thumbnail grid"""
+        bump_generation(self.redis, THUMBNAIL_GRID)
 
     def get_extra_rows_cols(self, zoom):
         if zoom == 2:
             return 0
         return 1  # default
 
+    def calculate_ranges(self, width, height):
+        """the zoom levels worth making tiles for"""
+        area = width * height
+        r = 1.0 * width / height
+        ranges = []
+        _range = self.DEFAULT_RANGE_MIN
+        while True:
+            ranges.append(_range)
+            range_width = 256 * (2 ** _range)
+            range_height = range_width / r
+            range_area = range_width * range_height
+            if _range >= self.DEFAULT_RANGE_MAX:
+                break
+            if range_area > area:
+                break
+            _range += 1
+        return ranges
+
+    def estimate_tile_count(self, width, height, ranges):
+        """roughly how many tiles make_pyramid() will cut"""
+        count = 0
+        for zoom in ranges:
+            # the same scaling make_pyramid() does
+            scale = 256.0 * (2 ** zoom) / max(width, height)
+            cols = math.ceil(width * scale / 256)
+            rows = math.ceil(height * scale / 256)
+            count += int(rows * cols)
+        return count
+
     def make_destination(self, fileid, content_type=None):
         root = os.path.join(
             self.application.settings['static_path'],
@@ -198,41 +387,48 @@ class BaseHandler(tornado.web.RequestHandler):
     def base_url(self):
         return '%s://%s' % (self.request.protocol, self.request.host)
 
+    def get_duplicate_message(self, image):
+        url = self.base_url + self.reverse_url('image', image['fileid'])
+        return 'Picture matches an identical upload %s' % url
+
 
 class ThumbnailGridRendererMixin(object):
 
     @tornado.gen.engine
-    def render_thumbnail_grid(self, search, page, page_size, callback):
+    def render_thumbnail_grid(self, search, page_size, callback,
+                              after=None, before=None):
         data = {
             'recent_images_rows': [],
         }
-        skip = page_size * (page - 1)
-        cursor = (
-            self.db.images.find(search)
-            .sort([('date', -1)])
-            .limit(page_size)
-            .skip(skip)
-        )
-        #image = yield motor.Op(cursor.next_object)
+        images, pagination = yield tornado.gen.Task(
+            find_page,
+            self.db.images,
+            search,
+            page_size,
+            after=after,
+            before=before
+        )
         row = []
-        count = 0
-        while (yield cursor.fetch_next):
-            image = cursor.next_object()
+        for image in images:
             if image.get('width') and image.get('featured', True):
                 row.append(image)
             elif not image.get('width'):
                 print image
 
-            count += 1
-            #image = yield motor.Op(cursor.next_object)
-
             if len(row) == 3:
                 data['recent_images_rows'].append(row)
                 row = []
         if row:
             data['recent_images_rows'].append(row)
 
-        callback((self.render_string('_thumbnail_grid.html', **data), count))
+        yield tornado.gen.Task(
+            self.prefetch_metadata,
+            [x['fileid'] for row in data['recent_images_rows'] for x in row]
+        )
+        callback((
+            self.render_string('_thumbnail_grid.html', **data),
+            pagination
+        ))
 
 
 @route('/', name='home')
@@ -254,57 +450,79 @@ class HomeHandler(BaseHandler, ThumbnailGridRendererMixin):
             'featured': True
         }
 
+        count_key = 'home'
         if self.get_argument('user', None):
             search['user'] = self.get_argument('user')
             data['yours'] = True
-        page = int(self.get_argument('page', 1))
+            count_key += ':%s' % search['user']
+        after = self.get_cursor_argument('after')
+        before = self.get_cursor_argument('before')
 
-        total_count = yield motor.Op(self.db.images.find(search).count)
+        total_count = yield tornado.gen.Task(
+            get_count,
+            self.redis,
+            self.db.images,
+            search,
+            count_key
+        )
 
         page_size = 15
-        t0 = time.time()
-        thumbnail_grid, count = yield tornado.gen.Task(
-            self.render_thumbnail_grid,
-            search, page, page_size
+        fragment_key = get_fragment_key(
+            self.redis,
+            THUMBNAIL_GRID,
+            search.get('user'), page_size, after, before
+        )
+        fragment = yield tornado.gen.Task(
+            self.async_redis.get,
+            fragment_key
         )
-        t1 = time.time()
-        logging.debug('%s seconds to render thumbnail grid', t1 - t0)
+        if fragment:
+            thumbnail_grid, pagination = tornado.escape.json_decode(fragment)
+        else:
+            t0 = time.time()
+            thumbnail_grid, pagination = yield tornado.gen.Task(
+                self.render_thumbnail_grid,
+                search, page_size,
+                after=after, before=before
+            )
+            t1 = time.time()
+            logging.debug('%s seconds to render thumbnail grid', t1 - t0)
+            # short enough for the hit counts in it to not get too old
+            yield tornado.gen.Task(
+                self.async_redis.setex,
+                fragment_key,
+                60 * 5,
+                tornado.escape.json_encode([thumbnail_grid, pagination])
+            )
         data['thumbnail_grid'] = thumbnail_grid
 
-        pagination = None
-        if total_count > count:
-            # pagination in order!
-            pagination = {
-                'current_page': page,
-                'range': range(1, total_count / page_size + 2)
-            }
-            if (page - 1) * page_size > 0:
-                pagination['prev'] = page - 1
-            if page * page_size < total_count:
-                pagination['next'] = page + 1
-
+        if not pagination['before'] and not pagination['after']:
+            pagination = None
         data['pagination'] = pagination
-        data['show_hero_unit'] = self.get_argument('page', None) is None
+        data['show_hero_unit'] = not after and not before
         data['total_count'] = total_count
         if total_count:
-            _cache_key = 'totalstats'
-            value = self.redis.get(_cache_key)
-            if value:
-                stats = tornado.escape.json_decode(value)
+            user = self.get_argument('user', None)
+            if user:
+                _cache_key = 'totalstats:%s' % user
+                value = self.redis.get(_cache_key)
+                if value:
+                    stats = tornado.escape.json_decode(value)
+                else:
+                    fileids = yield tornado.gen.Task(
+                        self.get_all_fileids,
+                        user=user
+                    )
+                    stats = get_totals(self.redis, fileids)
+                    self.redis.setex(
+                        _cache_key,
+                        tornado.escape.json_encode(stats),
+                        60
+                    )
             else:
-                fileids = yield tornado.gen.Task(
-                    self.get_all_fileids,
-                    user=self.get_argument('user', None)
-                )
-                stats = self.get_stats_by_fileids(
-                    fileids,
-                    user=self.get_argument('user', None)
-                )
-                self.redis.setex(
-                    _cache_key,
-                    tornado.escape.json_encode(stats),
-                    60
-                )
+                # running totals kept up to date by the hit and
+                # weight counters
+                stats = yield tornado.gen.Task(self.get_site_totals)
             data['total_bytes_served'] = stats['total_bytes_served']
             data['total_hits'] = stats['total_hits']
             data['total_hits_this_month'] = stats['total_hits_this_month']
@@ -312,6 +530,11 @@ class HomeHandler(BaseHandler, ThumbnailGridRendererMixin):
         data['featured_past'] = yield tornado.gen.Task(
             self.get_featured_past
         )
+        if data['featured_past']:
+            yield tornado.gen.Task(
+                self.prefetch_metadata,
+                [data['featured_past']['fileid']]
+            )
 
         self.render('index.html', **data)
 
@@ -323,17 +546,13 @@ class HomeHandler(BaseHandler, ThumbnailGridRendererMixin):
             then = datetime.datetime.utcnow() - datetime.timedelta(days=30)
             search = {'title': {'$exists': True},
                       'date': {'$lt': then}}
-            total_count = yield motor.Op(self.db.images.find(search).count)
-            cursor = (
-                self.db.images.find(search)
-                .sort([('date', -1)])
-                .limit(1)
-                .skip(random.randint(0, total_count - 1))
+            featured_past = yield tornado.gen.Task(
+                find_random,
+                self.db.images,
+                search
             )
-            (yield cursor.fetch_next)
-            featured_past = cursor.next_object()
-            fileid = featured_past['fileid']
-            self.redis.setex(cache_key, fileid, 60 * 60)
+            if featured_past:
+                self.redis.setex(cache_key, featured_past['fileid'], 60 * 60)
         else:
             featured_past = yield motor.Op(
                 self.db.images.find_one,
@@ -341,53 +560,6 @@ class HomeHandler(BaseHandler, ThumbnailGridRendererMixin):
             )
         callback(featured_past)
 
-    def get_stats_by_fileids(self, fileids, user=None):
-        total_hits = total_hits_this_month = total_bytes_served = 0
-
-        _now = datetime.datetime.utcnow()
-        for fileid in fileids:
-            hit_key = 'hits:%s' % fileid
-            hit_month_key = (
-                'hits:%s:%s:%s' %
-                (_now.year, _now.month, fileid)
-            )
-            hits = self.redis.get(hit_key)
-            if hits:
-                total_hits += int(hits)
-            hits = self.redis.get(hit_month_key)
-            if hits:
-                total_hits_this_month += int(hits)
-            served = self.redis.hget('bytes_served', fileid)
-            if served is not None:
-                total_bytes_served += int(served)
-
-        return {
-            'total_hits': total_hits,
-            'total_hits_this_month': total_hits_this_month,
-            'total_bytes_served': total_bytes_served,
-        }
-
-    @tornado.gen.engine
-    def get_all_fileids(self, callback, user=None):
-        cache_key = 'allfileids'
-        if user:
-            cache_key += ':%s' % user
-        fileids = self.redis.lrange(cache_key, 0, -1)
-        if not fileids:
-            # cache miss
-            fileids = []  # in case it was None
-            search = {}
-            if user:
-                search['user'] = user
-            cursor = self.db.images.find(search, ('fileid',))
-            #image = yield motor.Op(cursor.next_object)
-            while (yield cursor.fetch_next):
-                image = cursor.next_object()
-                self.redis.lpush(cache_key, image['fileid'])
-                fileids.append(image['fileid'])
-                #image = yield motor.Op(cursor.next_object)
-        callback(fileids)
-
 
 @route('/(\w{9})', 'image')
 class ImageHandler(BaseHandler):
@@ -425,66 +597,17 @@ class ImageHandler(BaseHandler):
                 self.finish()
                 return
 
-        metadata_key = 'metadata:%s' % fileid
-        metadata = self.redis.get(metadata_key)
-        #metadata=None;self.redis.delete('uploading:%s' % fileid)
-
-        if metadata and 'description' not in metadata:
-            # legacy
-            metadata = None
-        if metadata and 'width' not in metadata:
-            # legacy (old)
-            metadata = None
-        if metadata and 'date_timestamp' not in metadata:
-            # legacy (old)
-            metadata = None
-
-        if metadata is not None:
-            metadata = json.loads(metadata)
-            content_type = metadata['content_type']
-            owner = metadata['owner']
-            title = metadata['title']
-            description = metadata['description']
-            date_timestamp = metadata['date_timestamp']
-            width = metadata['width']
-            cdn_domain = metadata.get('cdn_domain')
-            wrap = metadata.get('wrap', False)
-
-        else:
-            logging.info("Meta data cache miss (%s)" % fileid)
-            document = yield motor.Op(
-                self.db.images.find_one,
-                {'fileid': fileid}
-            )
-            if not document:
-                raise tornado.web.HTTPError(404, "File not found")
-
-            content_type = document['contenttype']
-            owner = document['user']
-            title = document.get('title', '')
-            description = document.get('description', '')
-            width = document['width']
-            cdn_domain = document.get('cdn_domain', None)
-            date_timestamp = time.mktime(document['date'].timetuple())
-            wrap = document.get('wrap', False)
-
-            metadata = {
-                'content_type': content_type,
-                'owner': owner,
-                'title': title,
-                'description': description,
-                'date_timestamp': date_timestamp,
-                'width': width,
-                'cdn_domain': cdn_domain,
-                'wrap': wrap,
-            }
-            if document.get('ranges'):
-                metadata['ranges'] = document['ranges']
-            self.redis.setex(
-                metadata_key,
-                json.dumps(metadata),
-                60 * 60  # * 24
-            )
+        metadata = yield motor.Op(self.get_metadata, fileid)
+        if metadata is None:
+            raise tornado.web.HTTPError(404, "File not found")
+        content_type = metadata['content_type']
+        owner = metadata['owner']
+        title = metadata['title']
+        description = metadata['description']
+        date_timestamp = metadata['date_timestamp']
+        width = metadata['width']
+        cdn_domain = metadata.get('cdn_domain')
+        wrap = metadata.get('wrap', False)
         no_wrap = not wrap
 
         now = time.mktime(datetime.datetime.utcnow().timetuple())
@@ -520,25 +643,31 @@ class ImageHandler(BaseHandler):
         if age > 60 * 60 and not cdn_domain:
             # it might be time to upload this to S3
             lock_key = 'uploading:%s' % fileid
-            if self.redis.get(lock_key):
+            locked = yield tornado.gen.Task(self.async_redis.get, lock_key)
+            if locked:
                 print "AWS uploading is locked"
             else:
                 # we're ready to upload it
-                _no_tiles = count_all_tiles(
-                    fileid,
-                    self.application.settings['static_path']
+                manifest = yield tornado.gen.Task(
+                    self.get_tile_manifest,
+                    fileid
+                )
+                _no_tiles = manifest.count()
+                yield tornado.gen.Task(
+                    self.async_redis.setex,
+                    lock_key,
+                    60 * 60,
+                    time.time()
                 )
-                self.redis.setex(lock_key, time.time(), 60 * 60)
                 q = Queue('low', connection=self.redis)
                 logging.info("About to upload %s tiles" % _no_tiles)
-                # bulk the queue workers with 100 each
-                for i in range(_no_tiles / 100 + 1):
-                    q.enqueue(
-                        upload_tiles,
-                        fileid,
-                        self.application.settings['static_path'],
-                        max_count=100
-                    )
+                # one job does them all and if it doesn't finish in
+                # time the next one picks up where it stopped
+                q.enqueue_call(
+                    func=upload_tiles,
+                    args=(fileid, self.application.settings['static_path']),
+                    timeout=60 * 60
+                )
 
                 # upload the original
                 q.enqueue(
@@ -622,15 +751,7 @@ class ImageHitCounterHandler(BaseHandler):
     def post(self, fileid):
 
         # increment a hit counter
-        _now = datetime.datetime.utcnow()
-        hit_key = 'hits:%s' % fileid
-        hit_month_key = (
-            'hits:%s:%s:%s' %
-            (_now.year, _now.month, fileid)
-        )
-        self.redis.incr(hit_key)
-        self.redis.incr(hit_month_key)
-        self.redis.hdel('metadata-rendered', fileid)
+        self.application.hit_buffer.hit(fileid)
 
         self.write('OK')
 
@@ -641,34 +762,32 @@ class ImageWeightCounterHandler(BaseHandler):
     def check_xsrf_cookie(self):
         pass
 
+    @tornado.web.asynchronous
+    @tornado.gen.engine
     def post(self, fileid):
+        # or anybody could make manifests for images that don't exist
+        metadata = yield motor.Op(self.get_metadata, fileid)
+        if metadata is None:
+            raise tornado.web.HTTPError(404, "File not found")
         urls = self.get_argument('urls')
-        extension = self.get_argument('extension')
-        root = os.path.join(
-            self.settings['static_path'],
-            'tiles',
-            fileid[:1],
-            fileid[1:3],
-            fileid[3:],
-            '256',
-        )
-        bytes = 0
+        extension = self.get_argument('extension').lstrip('.')
+        tiles = []
         for each in urls.split('|'):
-            path = os.path.join(root, each + extension)
+            # e.g. '3/1,2'
             try:
-                bytes += os.stat(path)[stat.ST_SIZE]
-            except OSError:
-                pass
+                zoom, row_col = each.split('/')
+                row, col = [int(x) for x in row_col.split(',')]
+                zoom = int(zoom)
+            except ValueError:
+                continue
+            tiles.append((zoom, row, col, extension))
+        manifest = yield tornado.gen.Task(self.get_tile_manifest, fileid)
+        bytes = sum(x for x in manifest.get_sizes(tiles) if x)
         if bytes:
-            # try self.redis.hget('bytes_served', fileid)
-            # or self.redis.hgetall('bytes_served')
-            try:
-                self.redis.hincrby('bytes_served', fileid, bytes)
-            except:
-                if self.application.settings['debug']:
-                    raise
+            self.application.hit_buffer.serve(fileid, bytes)
 
         self.write({'bytes': bytes})
+        self.finish()
 
 
 @route('/(\w{9})/metadata', 'image_metadata')
@@ -677,23 +796,12 @@ class ImageMetadataHandler(BaseHandler):
     @tornado.web.asynchronous
     @tornado.gen.engine
     def get(self, fileid):
-        cache_key = 'metadata:%s' % fileid
-        metadata = self.redis.get(cache_key)
+        metadata = yield motor.Op(self.get_metadata, fileid)
         if metadata is None:
-            document = yield motor.Op(
-                self.db.images.find_one,
-                {'fileid': fileid},
-            )
-            title = document.get('title')
-            description = document.get('description')
-        else:
-            metadata = tornado.escape.json_decode(metadata)
-            title = metadata.get('title')
-            description = metadata.get('description')
-
+            raise tornado.web.HTTPError(404, "File not found")
         data = {
-            'title': title,
-            'description': description,
+            'title': metadata['title'],
+            'description': metadata['description'],
         }
         self.write(data)
         self.finish()
@@ -826,9 +934,10 @@ class ImageMetadataMixin(object):
             {'$set': data}
         )
 
-        metadata_key = 'metadata:%s' % document['fileid']
+        metadata_key = get_metadata_key(document['fileid'])
         self.redis.delete(metadata_key)
         self.redis.hdel('metadata-rendered', fileid)
+        self.clear_thumbnail_grid_cache()
         data['_needs_refresh'] = (
             document.get('wrap', False) != data['wrap']
         )
@@ -1116,9 +1225,13 @@ class DeleteImageMixin(object):
             {'_id': document['_id']}
         )
 
-        metadata_key = 'metadata:%s' % fileid
-        self.redis.delete(metadata_key)
+        metadata_key = get_metadata_key(fileid)
+        self.redis.delete(metadata_key, get_uploaded_key(fileid))
         self.redis.hdel('metadata-rendered', fileid)
+        TileManifest(self.redis, fileid).delete()
+        forget_image(self.redis, fileid)
+        ranking.remove_image(self.redis, fileid, document['user'])
+        self.clear_thumbnail_grid_cache()
 
         q = Queue(connection=self.redis)
         image_split = (
@@ -1128,6 +1241,8 @@ class DeleteImageMixin(object):
             '/' +
             fileid[3:]
         )
+        # in every web process, not just this one
+        invalidate_tile_cache(self.redis, image_split)
         q.enqueue(
             delete_image,
             image_split,
@@ -1170,6 +1285,34 @@ class UploadHandler(BaseHandler):
 
 class PreviewMixin(object):
 
+    # how much of the image to fetch to find out its dimensions
+    PROBE_BYTES = 128 * 1024
+
+    @tornado.gen.engine
+    def probe_dimensions(self, url, callback):
+        """callback with (width, height) worked out from the first few
+        KB of the image or None if that's not enough"""
+        probe = ImageProbe()
+
+        def streaming_callback(chunk):
+            # If the server ignores the Range header the rest is thrown
+            # away here. What the callback returns can't be relied on to
+            # stop the transfer (only some versions of the curl client
+            # pass it on to curl) so that's what the timeout is for.
+            if probe.size or probe.bytes >= self.PROBE_BYTES:
+                return
+            probe.feed(chunk)
+
+        http_client = tornado.httpclient.AsyncHTTPClient()
+        yield tornado.gen.Task(
+            http_client.fetch,
+            url,
+            headers={'Range': 'bytes=0-%d' % (self.PROBE_BYTES - 1)},
+            streaming_callback=streaming_callback,
+            request_timeout=10,
+        )
+        callback(probe.size)
+
     @tornado.gen.engine
     def run_preview(self, url, callback):
         http_client = tornado.httpclient.AsyncHTTPClient()
@@ -1228,6 +1371,35 @@ class PreviewMixin(object):
                             head_response.headers.get('Content-Encoding', ''))
             expected_size = 0
 
+        source_info = get_source_info(head_response.headers)
+        existing = yield tornado.gen.Task(
+            find_by_source,
+            self.db.images,
+            url,
+            source_info
+        )
+        if existing and existing['user'] == self.get_current_user():
+            callback({'error': self.get_duplicate_message(existing)})
+            return
+
+        size = yield tornado.gen.Task(self.probe_dimensions, url)
+        dimensions = {}
+        if size:
+            if size[0] < self.MIN_WIDTH:
+                callback({'error': 'Picture too small (%sx%s)' % size})
+                return
+            ranges = self.calculate_ranges(*size)
+            dimensions = {
+                'width': size[0],
+                'height': size[1],
+                'ranges': ranges,
+                'estimated_tiles': self.estimate_tile_count(
+                    size[0],
+                    size[1],
+                    ranges
+                ),
+            }
+
         fileid = uuid.uuid4().hex[:9]
         _count = yield motor.Op(self.db.images.find({'fileid': fileid}).count)
         while _count:
@@ -1240,7 +1412,9 @@ class PreviewMixin(object):
             'fileid': fileid,
             'source': url,
             'date': datetime.datetime.utcnow(),
-            'user': self.get_current_user()
+            'user': self.get_current_user(),
+            RANDOM_FIELD: get_random_value(),
+            'sourceinfo': source_info,
         }
         self.redis.setex(
             'contenttype:%s' % fileid,
@@ -1248,20 +1422,27 @@ class PreviewMixin(object):
             60 * 60
         )
         document['contenttype'] = content_type
-        self.redis.setex(
-            'expectedsize:%s' % fileid,
-            expected_size,
-            60 * 60
-        )
         if expected_size:
             document['size'] = expected_size
         yield motor.Op(self.db.images.insert, document)
+        # in case somebody guessed it and it got cached as missing
+        self.redis.delete(get_metadata_key(fileid))
+        progress.publish(
+            self.redis,
+            fileid,
+            progress.QUEUED,
+            done=0,
+            total=expected_size,
+            content_type=content_type,
+        )
 
-        callback({
+        response = {
             'fileid': fileid,
             'content_type': content_type,
             'expected_size': expected_size,
-        })
+        }
+        response.update(dimensions)
+        callback(response)
 
 
 @route('/upload/preview', 'upload_preview')
@@ -1292,16 +1473,76 @@ class PreviewUploadHandler(UploadHandler, PreviewMixin):
 
 class ProgressMixin(object):
 
-    def get_progress(self, fileid, content_type=None):
-        destination = self.make_destination(fileid, content_type=content_type)
-        data = {
-            'done': 0
-        }
-        if os.path.isfile(destination):
-            size = os.stat(destination)[stat.ST_SIZE]
-            data['done'] = size
+    # how long to keep a stream open
+    STREAM_TIMEOUT = 10 * 60
+
+    _stream_fileid = None
+
+    def get_progress(self, fileid):
+        """return what the workers have published about the upload of
+        `fileid` (see progress.py) or None if there is nothing"""
+        data = progress.get_progress(self.redis, fileid)
+        if data is None:
+            return None
+        return self._add_percentage(data)
+
+    def _add_percentage(self, data):
+        data.setdefault('done', 0)
+        if data.get('total'):
+            data['left'] = data['total'] - data['done']
+            data['percentage'] = round(
+                100.0 * data['done'] / data['total'],
+                1
+            )
         return data
 
+    def stream_progress(self, fileid):
+        """send everything that happens to the upload of `fileid` as
+        Server-Sent Events until it's finished"""
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self._stream_fileid = fileid
+        # listen before reading the state so nothing is missed in between
+        self.progress_hub.add(fileid, self._progress_published)
+        self._stream_timeout = tornado.ioloop.IOLoop.instance().add_timeout(
+            time.time() + self.STREAM_TIMEOUT,
+            self._end_stream
+        )
+        self._stream_data = {}
+        self._progress_published(progress.get_progress(self.redis, fileid))
+
+    def _progress_published(self, fields):
+        if self.request.connection.stream.closed():
+            self._end_stream()
+            return
+        if not fields:
+            return
+        self._stream_data.update(fields)
+        data = self._add_percentage(dict(self._stream_data))
+        if data.get('url'):
+            data['url'] = self.get_full_url(data['url'])
+        self.write('data: %s\n\n' % tornado.escape.json_encode(data))
+        self.flush()
+        if data.get('finished'):
+            self._end_stream()
+
+    def get_full_url(self, path):
+        """how the `url` of the image is sent"""
+        return path
+
+    def _end_stream(self):
+        if self._stream_fileid is None:
+            return
+        self.progress_hub.remove(self._stream_fileid,
+                                 self._progress_published)
+        tornado.ioloop.IOLoop.instance().remove_timeout(self._stream_timeout)
+        self._stream_fileid = None
+        if not self.request.connection.stream.closed():
+            self.finish()
+
+    def on_connection_close(self):
+        self._end_stream()
+
 
 @route('/upload/progress', 'upload_progress')
 class ProgressUploadHandler(UploadHandler, ProgressMixin):
@@ -1310,10 +1551,20 @@ class ProgressUploadHandler(UploadHandler, ProgressMixin):
         if not self.get_current_user():
             raise tornado.web.HTTPError(403, "You must be logged in")
         fileid = self.get_argument('fileid')
-        data = self.get_progress(fileid)
+        data = self.get_progress(fileid) or {'done': 0}
         self.write(data)
 
 
+@route('/upload/progress/stream', 'upload_progress_stream')
+class ProgressStreamUploadHandler(UploadHandler, ProgressMixin):
+
+    @tornado.web.asynchronous
+    def get(self):
+        if not self.get_current_user():
+            raise tornado.web.HTTPError(403, "You must be logged in")
+        self.stream_progress(self.get_argument('fileid'))
+
+
 class TileMakerMixin(object):
 
     @tornado.gen.engine
@@ -1325,87 +1576,115 @@ class TileMakerMixin(object):
         q = Queue(connection=self.redis)
         jobs = []
 
+        grids = []
         for zoom in ranges:
-            jobs.append(q.enqueue(
-                make_resize,
-                original,
-                zoom
-            ))
-
             extra = self.get_extra_rows_cols(zoom)
             width = 256 * (2 ** zoom)
             cols = rows = extra + width / 256
+            grids.append((zoom, rows, cols))
 
-            jobs.append(q.enqueue(
-                make_tiles,
+        # one job decodes the original once and cuts every zoom level
+        pyramid_job = self.job_notifier.enqueue(
+            q,
+            make_pyramid,
+            args=(
                 image_split,
                 256,
-                zoom,
-                rows,
-                cols,
+                grids,
                 extension,
                 self.application.settings['static_path'],
-            ))
+            ),
+            timeout=60 * 60,
+        )
+        jobs.append(pyramid_job)
 
+        thumbnail_job = None
         for width_ in (100, 300):
-            jobs.append(q.enqueue(
+            # one after the other so the last one finishing means both
+            # are there to be optimized
+            thumbnail_job = self.job_notifier.enqueue(
+                q,
                 make_thumbnail,
-                image_split,
-                width_,
-                extension,
-                self.application.settings['static_path'],
-            ))
+                args=(
+                    image_split,
+                    width_,
+                    extension,
+                    self.application.settings['static_path'],
+                ),
+                depends_on=thumbnail_job,
+            )
+            jobs.append(thumbnail_job)
 
+        # not until the tiles are all written or the optimizers would
+        # only find some of them
         for zoom in ranges:
-            q.enqueue(
-                optimize_images,
+            q.enqueue_call(
+                func=optimize_images,
+                args=(
+                    image_split,
+                    zoom,
+                    extension,
+                    self.application.settings['static_path'],
+                ),
+                depends_on=pyramid_job,
+            )
+
+        q.enqueue_call(
+            func=optimize_thumbnails,
+            args=(
                 image_split,
-                zoom,
                 extension,
                 self.application.settings['static_path'],
-            )
-
-        q.enqueue(
-            optimize_thumbnails,
-            image_split,
-            extension,
-            self.application.settings['static_path'],
+            ),
+            depends_on=thumbnail_job,
         )
 
         lock_key = 'uploading:%s' % fileid
         self.redis.setex(lock_key, time.time(), 60 * 60)
 
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        delay = 1
-        total_delay = 0
-        while add_delay:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
-            )
-            delay += 1
-            total_delay += delay
-
-            jobs_done = len([
-                x for x in jobs
-                if x.result is not None
-            ])
-            jobs_remaining = [
-                x for x in jobs
-                if x.result is None
-            ]
-            if not jobs_remaining:
-                break
-            if total_delay > 50:
-                # if at least 2 jobs had been done,
-                # it means the resizing and and tiles were made for
-                # the default zoom level.
-                # and it's a healthy sign it managed to do one more
-                had_to_give_up = jobs_done > 2
-                break
+        if add_delay:
+            # the tiles will still be made by the queue worker if it
+            # takes longer but we can't keep the user waiting for it
+            give_up = time.time() + 50
+            for job in jobs:
+                result = yield tornado.gen.Task(
+                    self.job_notifier.wait,
+                    job,
+                    max(give_up - time.time(), 0)
+                )
+                if job is pyramid_job:
+                    had_to_give_up = result is None
+        else:
+            for job in jobs:
+                # nobody is going to wait for these
+                self.job_notifier.forget(job)
 
         callback(had_to_give_up)
 
+    @tornado.gen.engine
+    def clone_tiles(self, source_fileid, fileid, callback,
+                    with_original=False):
+        """callback with True if the cloning didn't finish in time or
+        None if it failed"""
+        q = Queue(connection=self.redis)
+        job = self.job_notifier.enqueue(
+            q,
+            clone_image,
+            args=(
+                source_fileid[:1] + '/' + source_fileid[1:3] + '/' +
+                source_fileid[3:],
+                fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:],
+                self.application.settings['static_path'],
+            ),
+            kwargs={'with_original': with_original},
+            timeout=60 * 10,
+        )
+        result = yield tornado.gen.Task(self.job_notifier.wait, job, 50)
+        if result is False:
+            callback(None)
+        else:
+            callback(result is None)
+
     @tornado.gen.engine
     def email_about_upload(self, fileid, extension, email, callback):
         url = self.base_url + self.reverse_url('image', fileid)
@@ -1460,20 +1739,36 @@ class TileMakerMixin(object):
 
         q = Queue(connection=self.redis)
         logging.info('Enqueueing email to %s', email)
-        job = q.enqueue(
+        job = self.job_notifier.enqueue(
+            q,
             send_url,
-            url,
-            fileid,
-            email,
-            html_email_body,
-            plain_body=email_body,
-            debug=self.application.settings['debug']
+            args=(url, fileid, email, html_email_body),
+            kwargs={
+                'plain_body': email_body,
+                'debug': self.application.settings['debug']
+            }
         )
         callback(job)
 
 
 class DownloadMixin(object):
 
+    # how many times to try a download that can be resumed
+    DOWNLOAD_ATTEMPTS = 3
+
+    def has_local_original(self, image):
+        """False if the original of `image` isn't on disk, e.g. because
+        it has been archived to S3, so there's nothing to clone"""
+        if image['contenttype'] == 'image/png':
+            extension = 'png'
+        else:
+            extension = 'jpg'
+        return bool(find_original(
+            image['fileid'],
+            self.application.settings['static_path'],
+            extension
+        ))
+
     @tornado.gen.engine
     def run_download(self, fileid, callback,
                      add_delay=True):
@@ -1482,31 +1777,62 @@ class DownloadMixin(object):
             {'fileid': fileid}
         )
         url = document['source']
-        tornado.httpclient.AsyncHTTPClient.configure(
-            tornado.curl_httpclient.CurlAsyncHTTPClient
-        )
         destination = self.make_destination(fileid)
         q = Queue(connection=self.redis)
-        job = q.enqueue_call(
-            func=download,
-            args=(url, destination),
-            kwargs={'request_timeout': 500},
-            timeout=501,
-        )
-        delay = 1
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        while job.result is None:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
+        existing = yield tornado.gen.Task(
+            find_by_source,
+            self.db.images,
+            url,
+            document.get('sourceinfo')
+        )
+        if existing and not self.has_local_original(existing):
+            # it has to be downloaded after all
+            existing = None
+        # no need to download what has been downloaded before
+        downloaded = not existing
+        if existing:
+            response = {
+                'code': 200,
+                'width': existing['width'],
+                'height': existing['height'],
+                'contenthash': existing['contenthash'],
+                'size': existing.get('size'),
+            }
+        for i in range(self.DOWNLOAD_ATTEMPTS if downloaded else 0):
+            job = self.job_notifier.enqueue(
+                q,
+                download,
+                args=(url, destination),
+                kwargs={
+                    'request_timeout': 500,
+                    'min_width': self.MIN_WIDTH,
+                    'fileid': fileid,
+                    'expected_size': document.get('size'),
+                },
+                timeout=501,
             )
-
-        response = job.result
+            response = yield tornado.gen.Task(
+                self.job_notifier.wait,
+                job,
+                510
+            )
+            if response is None:
+                response = {'code': 0, 'body': 'Download never finished'}
+            if response['code'] == 200 or not is_partial(destination):
+                break
+            # a ranged download that got part of the way
+            logging.warning("Resuming download of %s" % fileid)
         if response['code'] == 200:
-            img = Image.open(destination)
-            size = img.size
-            if size[0] < 256 * (2 ** self.DEFAULT_RANGE_MIN):
+            if response.get('width'):
+                size = (response['width'], response['height'])
+            else:
+                # the downloader couldn't make sense of the header.
+                # This only reads the header, not the pixels.
+                size = Image.open(destination).size
+            if size[0] < self.MIN_WIDTH:
                 message = 'Picture too small (%sx%s)' % size
+                progress.publish(self.redis, fileid, progress.FAILED,
+                                 error=message)
                 callback({'error': message})
 
                 # reverse the upload by deleting the record
@@ -1514,36 +1840,32 @@ class DownloadMixin(object):
                     self.db.images.remove,
                     {'_id': document['_id']}
                 )
-                os.remove(destination)
+                if downloaded:
+                    os.remove(destination)
                 return
-            # img.histogram() is a long list of integers
-            histogram_hash = hashlib.md5(
-                ','.join(str(x) for x in img.histogram())
-            ).hexdigest()
+            content_hash = response['contenthash']
 
             data = {
                 'width': size[0],
                 'height': size[1],
-                'histogramhash': histogram_hash,
+                'contenthash': content_hash,
                 'featured': True,
             }
 
-            replica_search = {
-                'histogramhash': histogram_hash,
-                'user': document['user'],
-            }
-            cursor = (
-                self.db.images.find(replica_search)
-                .limit(1)
+            # the same bytes uploaded by anybody
+            replica_image = yield tornado.gen.Task(
+                find_by_content,
+                self.db.images,
+                content_hash,
+                document['user']
             )
-            #replica_image = yield motor.Op(cursor.next_object)
-            if (yield cursor.fetch_next):
-                replica_image = cursor.next_object()
-                url = self.base_url + self.reverse_url(
-                    'image',
-                    replica_image['fileid']
-                )
-                message = 'Picture matches an identical upload %s' % url
+            if not downloaded:
+                # the original has to come from somewhere
+                replica_image = replica_image or existing
+            if replica_image and replica_image['user'] == document['user']:
+                message = self.get_duplicate_message(replica_image)
+                progress.publish(self.redis, fileid, progress.FAILED,
+                                 error=message)
                 callback({'error': message})
 
                 # reverse the upload by deleting the record
@@ -1551,49 +1873,48 @@ class DownloadMixin(object):
                     self.db.images.remove,
                     {'_id': document['_id']}
                 )
-                os.remove(destination)
+                if downloaded:
+                    os.remove(destination)
                 return
+            if replica_image and not self.has_local_original(replica_image):
+                # make the tiles from our own copy instead
+                replica_image = None if downloaded else existing
 
             if not document.get('size'):
-                data['size'] = document['size'] = os.stat(destination)[stat.ST_SIZE]
+                data['size'] = document['size'] = response['size']
 
             yield motor.Op(
                 self.db.images.update,
                 {'_id': document['_id']},
                 {'$set': data}
             )
-            self.redis.setex(
-                'sizeinfo:%s' % fileid,
-                tornado.escape.json_encode(data),
-                60 * 60
+            progress.publish(
+                self.redis,
+                fileid,
+                width=size[0],
+                height=size[1],
+                url=self.reverse_url('image', fileid),
             )
-            area = size[0] * size[1]
-            r = 1.0 * size[0] / size[1]
 
             # this is used for doing things like stats on all uploads
             all_fileids_key = 'allfileids'
             self.redis.lpush(all_fileids_key, fileid)
-            all_fileids_key = ':%s' % document['user']
+            all_fileids_key = 'allfileids:%s' % document['user']
             self.redis.lpush(all_fileids_key, fileid)
+            ranking.add_image(self.redis, fileid, document['user'])
+            self.clear_thumbnail_grid_cache()
 
             try:
-                self.redis.incr('bytes_downloaded', amount=document['size'])
+                if downloaded:
+                    self.redis.incr(
+                        'bytes_downloaded',
+                        amount=document['size']
+                    )
             except:
                 if self.application.settings['debug']:
                     raise
 
-            ranges = []
-            _range = self.DEFAULT_RANGE_MIN
-            while True:
-                ranges.append(_range)
-                range_width = 256 * (2 ** _range)
-                range_height = range_width / r
-                range_area = range_width * range_height
-                if _range >= self.DEFAULT_RANGE_MAX:
-                    break
-                if range_area > area:
-                    break
-                _range += 1
+            ranges = self.calculate_ranges(*size)
 
             # since zoom level 3 is the default, make sure that's
             # prepared first
@@ -1601,24 +1922,47 @@ class DownloadMixin(object):
             ranges.insert(0, self.DEFAULT_ZOOM)
             extension = destination.split('.')[-1]
 
-            #tiles_made = yield tornado.gen.Task(
-            had_to_give_up = yield tornado.gen.Task(
-                self.prepare_all_tiles,
-                fileid,
-                destination,
-                ranges,
-                extension,
-                add_delay=add_delay,
-            )
+            had_to_give_up = None
+            if replica_image:
+                # somebody else's copy has already been tiled
+                had_to_give_up = yield tornado.gen.Task(
+                    self.clone_tiles,
+                    replica_image['fileid'],
+                    fileid,
+                    with_original=not downloaded,
+                )
+                if had_to_give_up is None:
+                    logging.warning(
+                        "Unable to clone %r for %r. Tiling it instead."
+                        % (replica_image['fileid'], fileid)
+                    )
+            if had_to_give_up is None:
+                # a brand new image so there are no tiles the manifest
+                # doesn't know about
+                TileManifest(self.redis, fileid).mark_built()
+
+                #tiles_made = yield tornado.gen.Task(
+                had_to_give_up = yield tornado.gen.Task(
+                    self.prepare_all_tiles,
+                    fileid,
+                    destination,
+                    ranges,
+                    extension,
+                    add_delay=add_delay,
+                )
             if had_to_give_up:
                 logging.warning(
                     "Had to give up when generating tiles %r"
                     % fileid
                 )
+                # the tiles will be ready when the email says so
+                progress.publish(self.redis, fileid, progress.DONE,
+                                 email=document['user'])
                 callback({
                     'email': document['user']
                 })
             else:
+                progress.publish(self.redis, fileid, progress.DONE)
                 callback({
                     'url': self.reverse_url('image', fileid),
                 })
@@ -1627,12 +1971,13 @@ class DownloadMixin(object):
             # has not unsubscribed
             if (had_to_give_up or not
                 self.redis.sismember('unsubscribed', document['user'])):
-                yield tornado.gen.Task(
+                job = yield tornado.gen.Task(
                     self.email_about_upload,
                     fileid,
                     extension,
                     document['user'],
                 )
+                self.job_notifier.forget(job)
             else:
                 logging.info('Skipping to send email')
         else:
@@ -1642,12 +1987,19 @@ class DownloadMixin(object):
             )
             try:
                 os.remove(destination)
+                if is_partial(destination):
+                    os.remove(get_sidecar_path(destination))
             except:
                 logging.error("Unable to remove %s" % destination,
                               exc_info=True)
+            message = (
+                "FAILED TO DOWNLOAD\n%s\n%s\n" %
+                (response['code'], response['body'])
+            )
+            progress.publish(self.redis, fileid, progress.FAILED,
+                             error=message)
             callback({
-                'error': "FAILED TO DOWNLOAD\n%s\n%s\n" %
-                         (response['code'], response['body'])
+                'error': message
             })
 
 
@@ -1752,60 +2104,41 @@ class TileHandler(BaseHandler):
         size = int(size)
         if size != 256:
             raise tornado.web.HTTPError(400, 'size must be 256')
-
-        q = Queue(connection=self.redis)
-        job = q.enqueue(
-            make_tile,
-            image,
-            size,
-            zoom,
-            row,
-            col,
-            extension,
-            self.application.settings['static_path']
-        )
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        delay = 0.1
-        while True:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
-            )
-            delay *= 2
-            if job.result is not None:
-                save_filepath = job.result
-                break
-
-        try:
-            _cache_seconds = 60 * 60 * 24
-            self.set_header(
-                'Cache-Control',
-                'max-age=%d, public' % _cache_seconds
+        zoom, row, col = int(zoom), int(row), int(col)
+
+        cache_key = (image, zoom, row, col, extension)
+        tile = self.tile_cache.get(cache_key)
+        if tile is None:
+            tile = yield tornado.gen.Task(
+                self._load_tile,
+                image, size, zoom, row, col, extension
             )
-            if _cache_seconds > 3600:
-                _expires = (
-                    datetime.datetime.utcnow() +
-                    datetime.timedelta(seconds=_cache_seconds)
-                )
-                self.set_header(
-                    'Expires',
-                    _expires.strftime('%a, %d %b %Y %H:%M:%S GMT')
-                )
-            self.write(open(save_filepath, 'rb').read())
-            fileid = image.replace('/', '')
-
-            lock_key = 'uploading:%s' % fileid
-            if not self.redis.get(lock_key):
-                q = Queue(connection=self.redis)
-                q.enqueue(
-                    upload_tiles,
-                    fileid,
-                    self.application.settings['static_path'],
-                    max_count=10,
-                    only_if_no_cdn_domain=True
+        made = False
+        if tile is None:
+            # only go to the queue if the tile really doesn't exist yet
+            q = Queue(connection=self.redis)
+            job = self.job_notifier.enqueue(
+                q,
+                make_tile,
+                args=(
+                    image,
+                    size,
+                    zoom,
+                    row,
+                    col,
+                    extension,
+                    self.application.settings['static_path']
                 )
+            )
+            result = yield tornado.gen.Task(self.job_notifier.wait, job, 60)
+            tile = yield tornado.gen.Task(
+                self._load_tile,
+                image, size, zoom, row, col, extension
+            )
+            made = True
 
-        except IOError:
+        if tile is None:
+            logging.warning('Unable to make tile %r' % (result,))
             self.set_header('Content-Type', 'image/png')
             self.set_header(
                 'Cache-Control',
@@ -1816,10 +2149,75 @@ class TileHandler(BaseHandler):
                 'images',
                 'broken.png'
             )
-            self.write(open(broken_filepath, 'rb').read())
+            data = yield tornado.gen.Task(
+                self.file_io.read,
+                broken_filepath
+            )
+            self.write(data)
+            self.finish()
+            return
+
+        data, etag, modified = tile
+        if data is not None:
+            self.tile_cache.set(cache_key, tile, size=len(data))
+        _cache_seconds = 60 * 60 * 24
+        self.set_header(
+            'Cache-Control',
+            'max-age=%d, public' % _cache_seconds
+        )
+        if _cache_seconds > 3600:
+            _expires = (
+                datetime.datetime.utcnow() +
+                datetime.timedelta(seconds=_cache_seconds)
+            )
+            self.set_header(
+                'Expires',
+                _expires.strftime('%a, %d %b %Y %H:%M:%S GMT')
+            )
+        if data is None or self.check_not_modified(etag, modified):
+            self.set_status(304)
+        else:
+            self.write(data)
+        fileid = image.replace('/', '')
+
+        lock_key = 'uploading:%s' % fileid
+        if made and not self.redis.get(lock_key):
+            q = Queue(connection=self.redis)
+            q.enqueue(
+                upload_tiles,
+                fileid,
+                self.application.settings['static_path'],
+                max_count=10,
+                only_if_no_cdn_domain=True
+            )
 
         self.finish()
 
+    @tornado.gen.engine
+    def _load_tile(self, image, size, zoom, row, col, extension, callback):
+        """callback with (data, etag, modified) or None if there is no
+        such tile. `data` is None if the client already has it."""
+        stat = yield tornado.gen.Task(
+            self.file_io.call,
+            self.tile_store.get_stat,
+            image, size, zoom, row, col, extension
+        )
+        if stat is None:
+            callback(None)
+            return
+        if self.check_not_modified(*stat):
+            callback((None,) + stat)
+            return
+        data = yield tornado.gen.Task(
+            self.file_io.call,
+            self.tile_store.read,
+            image, size, zoom, row, col, extension
+        )
+        if data is None:
+            callback(None)
+        else:
+            callback((data,) + stat)
+
 
 @route(r'/thumbnails/(?P<image>\w{1}/\w{2}/\w{6})/(?P<width>\w{1,3})'
        r'.(?P<extension>png|jpg)',
@@ -1832,37 +2230,45 @@ class ThumbnailHandler(BaseHandler):
         width = int(width)
         assert width > 0 and width < 1000, width
 
-        # stick it on a queue
-        q = Queue(connection=self.redis)
+        if extension == 'png':
+            self.set_header('Content-Type', 'image/png')
+        elif extension == 'jpg':
+            self.set_header('Content-Type', 'image/jpeg')
+        else:
+            raise ValueError(extension)
 
-        job = q.enqueue(
-            make_thumbnail,
+        thumbnail_filepath = get_thumbnail_path(
             image,
             width,
             extension,
             self.application.settings['static_path']
         )
-        ioloop_instance = tornado.ioloop.IOLoop.instance()
-        delay = 0.1
-        thumbnail_filepath = None
-        while True:
-            yield tornado.gen.Task(
-                ioloop_instance.add_timeout,
-                time.time() + delay
+        st = yield tornado.gen.Task(self.file_io.stat, thumbnail_filepath)
+        if st is None:
+            # only go to the queue if it really isn't made yet
+            q = Queue(connection=self.redis)
+            job = self.job_notifier.enqueue(
+                q,
+                make_thumbnail,
+                args=(
+                    image,
+                    width,
+                    extension,
+                    self.application.settings['static_path']
+                )
             )
-            delay *= 2
-            if job.result is not None:
-                thumbnail_filepath = job.result
-                break
-            elif delay > 2:
-                break
-
-        if extension == 'png':
-            self.set_header('Content-Type', 'image/png')
-        elif extension == 'jpg':
-            self.set_header('Content-Type', 'image/jpeg')
-        else:
-            raise ValueError(extension)
+            thumbnail_filepath = yield tornado.gen.Task(
+                self.job_notifier.wait,
+                job,
+                3
+            )
+            if thumbnail_filepath:
+                st = yield tornado.gen.Task(
+                    self.file_io.stat,
+                    thumbnail_filepath
+                )
+                if st is None:
+                    thumbnail_filepath = None
 
         if not thumbnail_filepath:
             self.set_header('Content-Type', 'image/png')
@@ -1890,7 +2296,15 @@ class ThumbnailHandler(BaseHandler):
                     'Expires',
                     _expires.strftime('%a, %d %b %Y %H:%M:%S GMT')
                 )
-        self.write(open(thumbnail_filepath, 'rb').read())
+            etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+            if self.check_not_modified(etag, st.st_mtime):
+                self.set_status(304)
+                self.finish()
+                return
+        data = yield tornado.gen.Task(self.file_io.read, thumbnail_filepath)
+        if data is None:
+            raise tornado.web.HTTPError(404, "Thumbnail gone")
+        self.write(data)
         self.finish()
 
 
@@ -1898,8 +2312,6 @@ class ThumbnailHandler(BaseHandler):
 class PreloadURLsHandler(BaseHandler):
 
     def get(self, fileid):
-        root = self.application.settings['static_path']
-        path = os.path.join(root, 'tiles')
         image_filename = (
             fileid[:1] +
             '/' +
@@ -1907,16 +2319,21 @@ class PreloadURLsHandler(BaseHandler):
             '/' +
             fileid[3:]
         )
-        path = os.path.join(path, image_filename)
-        path = os.path.join(path, '256', str(self.DEFAULT_ZOOM))
-
         urls = []
-        if os.path.isdir(path):
-            for f in os.listdir(path):
-                urls.append(os.path.join(path, f).replace(
-                    self.application.settings['static_path'],
-                    ''
-                ))
+        tiles = self.tile_store.list_zoom(
+            image_filename,
+            256,
+            self.DEFAULT_ZOOM
+        )
+        for row, col, extension in tiles:
+            urls.append('/' + self.tile_store.get_relative_path(
+                image_filename,
+                256,
+                self.DEFAULT_ZOOM,
+                row,
+                col,
+                extension
+            ))
 
         self.write({'urls': urls})
 
@@ -1983,81 +2400,80 @@ class PopularityHandler(BaseHandler):
     @tornado.gen.engine
     def get(self):
         data = {}
-
-        hits_key = 'popularity:hits'
-        this_month_key = 'popularity:hits_this_month'
-        served_key = 'popularity:served'
-
-        v1 = self.redis.get(hits_key)
-        v2 = self.redis.get(this_month_key)
-        v3 = self.redis.get(served_key)
-        if v1 is not None and v2 is not None and v3 is not None:
-            hits = tornado.escape.json_decode(v1)
-            this_month = tornado.escape.json_decode(v2)
-            served = tornado.escape.json_decode(v3)
-        else:
-            lists = yield tornado.gen.Task(self._get_data)
-            hits, this_month, served = lists
-            self.redis.setex(
-                hits_key,
-                tornado.escape.json_encode(hits),
-                60 * 60
-            )
-            self.redis.setex(
-                this_month_key,
-                tornado.escape.json_encode(this_month),
-                60 * 60
-            )
-            self.redis.setex(
-                served_key,
-                tornado.escape.json_encode(served),
-                60 * 60
+        try:
+            top = max(1, min(int(self.get_argument('top', 10)), 100))
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Invalid top")
+        user = self.get_argument('user', None)
+
+        boards = {}
+        fileids = set()
+        for board in (ranking.HITS, ranking.HITS_THIS_MONTH,
+                      ranking.BYTES_SERVED):
+            # a few extra in case some of them have been deleted
+            boards[board] = yield tornado.gen.Task(
+                self._get_top,
+                board,
+                top * 2,
+                user
             )
+            fileids.update(fileid for __, fileid in boards[board])
 
-        data['this_month_hits'] = this_month
-        data['hits'] = hits
-        data['served'] = served
-        self.render('popularity.html', **data)
-
-    @tornado.gen.engine
-    def _get_data(self, callback):
-        _now = datetime.datetime.utcnow()
-
-        this_month = []
-        hits = []
-        bytes = []
-        cursor = self.db.images.find({}, ('fileid', 'title'))
-        #image = yield motor.Op(cursor.next_object)
+        images = {}
+        cursor = self.db.images.find(
+            {'fileid': {'$in': list(fileids)}},
+            ('fileid', 'title', 'contenttype')
+        )
         while (yield cursor.fetch_next):
             image = cursor.next_object()
-            image = {'fileid': image['fileid'],
-                     'title': image.get('title')}
-            fileid = image['fileid']
-            hit_key = 'hits:%s' % fileid
-            hit_month_key = (
-                'hits:%s:%s:%s' %
-                (_now.year, _now.month, fileid)
-            )
-            number = self.redis.get(hit_key)
-            if number is not None:
-                hits.append((int(number), image))
-            number = self.redis.get(hit_month_key)
-            if number is not None:
-                this_month.append((int(number), image))
-            number = self.redis.hget('bytes_served', fileid)
-            if number is not None:
-                bytes.append((int(number), image))
-            #image = yield motor.Op(cursor.next_object)
-
-        hits.sort(reverse=True)
-        this_month.sort(reverse=True)
-        bytes.sort(reverse=True)
-
-        hits = hits[:10]
-        this_month = this_month[:10]
-        bytes = bytes[:10]
+            images[image['fileid']] = image
+
+        for board, scores in boards.items():
+            boards[board] = [
+                (score, images[fileid]) for score, fileid in scores
+                if fileid in images
+            ][:top]
+
+        deleted = fileids - set(images)
+        if deleted:
+            # so they don't take up places next time
+            pipe = self.async_redis.pipeline()
+            for board in (ranking.HITS, ranking.HITS_THIS_MONTH,
+                          ranking.BYTES_SERVED):
+                for fileid in deleted:
+                    pipe.zrem(ranking.get_key(board), fileid)
+            yield tornado.gen.Task(pipe.execute)
+
+        data['top'] = top
+        data['this_month_hits'] = boards[ranking.HITS_THIS_MONTH]
+        data['hits'] = boards[ranking.HITS]
+        data['served'] = boards[ranking.BYTES_SERVED]
+        self.render('popularity.html', **data)
 
-        callback((hits, this_month, bytes))
+    @tornado.gen.engine
+    def _get_top(self, board, top, user, callback):
+        # like ranking.get_top() but without blocking
+        key = ranking.get_key(board)
+        if user:
+            user_key = ranking.get_user_ranking_key(key, user)
+            exists = yield tornado.gen.Task(self.async_redis.exists, user_key)
+            if not exists:
+                pipe = self.async_redis.pipeline()
+                pipe.zinterstore(
+                    user_key,
+                    {key: 1, ranking.get_user_key(user): 0}
+                )
+                pipe.expire(user_key, 60)
+                yield tornado.gen.Task(pipe.execute)
+            key = user_key
+        scores = yield tornado.gen.Task(
+            self.async_redis.zrevrange,
+            key,
+            0,
+            top - 1,
+            True
+        )
+        callback([(int(score), fileid) for fileid, score in scores])
 
 
 @route(r'/unsubscribe/(?P<unsub_key>\w{12})', 'unsubscribe')
@@ -0,0 +1,114 @@
+import struct
+import hashlib
+
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# the JPEG start of frame markers, which are the ones with the size
+SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+# JPEG markers that aren't followed by a length
+STANDALONE_MARKERS = set([0x01, 0xD8] + range(0xD0, 0xD8))
+
+
+class ImageProbe(object):
+    """Fed the bytes of an image as they arrive, it works out the MD5
+    and byte count of the whole thing and, as soon as the header has
+    come past, the format and (width, height) of a JPEG or PNG without
+    decoding any pixels.
+
+    `size` stays None if the header isn't understood.
+    """
+
+    # give up looking for the size after this many bytes
+    MAX_HEADER_BYTES = 1024 * 1024
+
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self.bytes = 0
+        self.format = None
+        self.size = None
+        self._buffer = ''
+        # bytes of the current JPEG segment still to be skipped
+        self._skip = 0
+        self._done = False
+
+    @property
+    def hexdigest(self):
+        return self._md5.hexdigest()
+
+    def feed(self, data):
+        self._md5.update(data)
+        self.bytes += len(data)
+        if self._done:
+            return
+        self._buffer += data
+        if self.format is None:
+            self._sniff()
+        if self.format == 'png':
+            self._parse_png()
+        elif self.format == 'jpeg':
+            self._parse_jpeg()
+        if not self._done and self.bytes > self.MAX_HEADER_BYTES:
+            self._finish()
+
+    def _finish(self):
+        self._done = True
+        self._buffer = ''
+
+    def _sniff(self):
+        if len(self._buffer) < len(PNG_SIGNATURE):
+            return
+        if self._buffer.startswith(PNG_SIGNATURE):
+            self.format = 'png'
+        elif self._buffer.startswith('\xff\xd8'):
+            self.format = 'jpeg'
+        else:
+            self._finish()
+
+    def _parse_png(self):
+        # the IHDR chunk always comes first
+        if len(self._buffer) < 24:
+            return
+        if self._buffer[12:16] == 'IHDR':
+            self.size = struct.unpack('>II', self._buffer[16:24])
+        self._finish()
+
+    def _parse_jpeg(self):
+        while True:
+            if self._skip:
+                skipped = min(self._skip, len(self._buffer))
+                self._buffer = self._buffer[skipped:]
+                self._skip -= skipped
+                if self._skip:
+                    return
+            if len(self._buffer) < 4:
+                return
+            if self._buffer[0] != '\xff':
+                # not where a marker should be
+                self._finish()
+                return
+            marker = ord(self._buffer[1])
+            if marker == 0xFF:
+                # padding
+                self._buffer = self._buffer[1:]
+                continue
+            if marker in STANDALONE_MARKERS:
+                self._buffer = self._buffer[2:]
+                continue
+            if marker in (0xD9, 0xDA):
+                # end of image or start of scan and still no frame
+                self._finish()
+                return
+            if marker in SOF_MARKERS:
+                if len(self._buffer) < 9:
+                    return
+                height, width = struct.unpack('>HH', self._buffer[5:9])
+                self.size = (width, height)
+                self._finish()
+                return
+            length, = struct.unpack('>H', self._buffer[2:4])
+            if length < 2:
+                self._finish()
+                return
+            self._buffer = self._buffer[4:]
+            self._skip = length - 2
@@ -0,0 +1,108 @@
+import datetime
+import pymongo
+from bson.objectid import ObjectId
+import settings
+
+
+# every index the queries need, per collection
+INDEXES = {
+    'images': [
+        # ImageHandler and almost every other single image lookup
+        ([('fileid', pymongo.ASCENDING)], {}),
+        # pagination.find_page() of the home grid and the admin home
+        ([('date', pymongo.DESCENDING),
+          ('_id', pymongo.DESCENDING)], {}),
+        ([('featured', pymongo.ASCENDING),
+          ('date', pymongo.DESCENDING),
+          ('_id', pymongo.DESCENDING)], {}),
+        # "your" pictures, the newsletter and banned users
+        ([('user', pymongo.ASCENDING),
+          ('date', pymongo.DESCENDING),
+          ('_id', pymongo.DESCENDING)], {}),
+        # sampling.find_random()
+        ([('random', pymongo.ASCENDING)], {}),
+        # dedupe.find_by_content() and find_by_source()
+        ([('contenthash', pymongo.ASCENDING),
+          ('user', pymongo.ASCENDING)], {}),
+        ([('source', pymongo.ASCENDING),
+          ('date', pymongo.DESCENDING)], {}),
+    ],
+    'comments': [
+        ([('image', pymongo.ASCENDING)], {}),
+    ],
+    'annotations': [
+        ([('image', pymongo.ASCENDING)], {}),
+    ],
+    'banned': [
+        ([('email', pymongo.ASCENDING)], {}),
+    ],
+}
+
+
+def get_query_shapes():
+    """return (collection, spec, sort) of every kind of query the
+    app makes that is supposed to use an index"""
+    now = datetime.datetime.utcnow()
+    _id = ObjectId()
+    newest_first = [('date', -1), ('_id', -1)]
+    return [
+        ('images', {'fileid': 'abc123456'}, None),
+        ('images', {'fileid': {'$in': ['abc123456']}}, None),
+        ('images', {'date': {'$lt': now}, 'featured': True}, newest_first),
+        ('images', {'date': {'$lt': now}, 'featured': True,
+                    'user': 'peter@example.com'}, newest_first),
+        ('images', {'date': {'$lt': now}, 'featured': True,
+                    '$or': [{'date': {'$lt': now}},
+                            {'date': now, '_id': {'$lt': _id}}]},
+         newest_first),
+        ('images', {'width': {'$exists': True}}, newest_first),
+        ('images', {'user': 'peter@example.com'}, None),
+        ('images', {'contenthash': 'xxx', 'width': {'$exists': True}},
+         None),
+        ('images', {'source': 'http://example.com/massive.jpg',
+                    'contenthash': {'$exists': True}}, [('date', -1)]),
+        ('images', {'title': {'$exists': True}, 'date': {'$lt': now}},
+         [('date', -1)]),
+        ('images', {'date': {'$lt': now, '$gte': now}}, [('date', -1)]),
+        ('images', {'title': {'$exists': True}, 'date': {'$lt': now},
+                    'random': {'$gte': 0.5}}, [('random', 1)]),
+        ('comments', {'image': _id}, None),
+        ('annotations', {'image': _id}, None),
+        ('banned', {'email': 'peter@example.com'}, None),
+    ]
+
+
+def get_db():
+    return pymongo.MongoClient()[settings.DATABASE_NAME]
+
+
+def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            db[collection].ensure_index(keys, **options)
+
+
+def _is_collection_scan(explanation):
+    # 'BasicCursor' is how MongoDB < 3.0 says it
+    if isinstance(explanation, dict):
+        if explanation.get('stage') == 'COLLSCAN':
+            return True
+        if explanation.get('cursor') == 'BasicCursor':
+            return True
+        return any(_is_collection_scan(x) for x in explanation.values())
+    if isinstance(explanation, list):
+        return any(_is_collection_scan(x) for x in explanation)
+    return False
+
+
+def audit(db):
+    """return the (collection, spec, sort) of every query shape that
+    would scan the whole collection"""
+    bad = []
+    for collection, spec, sort in get_query_shapes():
+        cursor = db[collection].find(spec)
+        if sort:
+            cursor = cursor.sort(sort)
+        if _is_collection_scan(cursor.explain()):
+            bad.append((collection, spec, sort))
+    return bad
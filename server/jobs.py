@@ -0,0 +1,158 @@
+import time
+import uuid
+import logging
+import threading
+import cPickle
+import redis.client
+import redis.exceptions
+import tornado.ioloop
+import settings
+
+
+CHANNEL = 'jobdone:%s'
+
+
+def _get_redis():
+    return redis.client.Redis(
+        settings.REDIS_HOST,
+        settings.REDIS_PORT
+    )
+
+
+def run_and_notify(token, func, *args, **kwargs):
+    """what the queue workers actually run. Tells whoever is waiting
+    as soon as `func` is done (or has failed)."""
+    result = None
+    try:
+        result = func(*args, **kwargs)
+        return result
+    finally:
+        _get_redis().publish(CHANNEL % token, cPickle.dumps(result, 2))
+
+
+class JobNotifier(object):
+    """Lets handlers wait for queue jobs without polling `job.result`.
+
+    One thread per web process listens on the `jobdone:*` channels and
+    hands the results to the IOLoop::
+
+        job = self.job_notifier.enqueue(q, make_tile, args=(...))
+        result = yield tornado.gen.Task(self.job_notifier.wait, job, 60)
+
+    `result` is None if the job failed or didn't finish in time.
+
+    In case a notification is missed, while the listener reconnects or
+    before it has subscribed, waiting jobs are also checked every
+    `CHECK_INTERVAL` seconds.
+    """
+
+    CHECK_INTERVAL = 2
+    # how long to keep the result of a job nobody waits for or forgets
+    PENDING_EXPIRY = 60 * 60
+
+    def __init__(self):
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+        # token -> callback or, if the job finished before anybody
+        # started waiting, the result wrapped in a tuple
+        self._pending = {}
+        self._thread = threading.Thread(target=self._listen)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def enqueue(self, queue, func, args=(), kwargs=None, timeout=None,
+                depends_on=None):
+        token = uuid.uuid4().hex
+        self._pending[token] = None
+        job = queue.enqueue_call(
+            func=run_and_notify,
+            args=(token, func) + tuple(args),
+            kwargs=kwargs or {},
+            timeout=timeout,
+            depends_on=depends_on,
+        )
+        job.notify_token = token
+        self.io_loop.add_timeout(
+            time.time() + max(timeout or 0, self.PENDING_EXPIRY),
+            lambda: self._expire(token)
+        )
+        return job
+
+    def _expire(self, token):
+        if not callable(self._pending.get(token)):
+            # whoever waits for it has their own timeout
+            self._pending.pop(token, None)
+
+    def wait(self, job, timeout, callback):
+        token = job.notify_token
+        pending = self._pending.get(token)
+        if isinstance(pending, tuple):
+            del self._pending[token]
+            callback(pending[0])
+            return
+
+        handles = {}
+
+        def done(result):
+            for handle in handles.values():
+                self.io_loop.remove_timeout(handle)
+            callback(result)
+
+        def give_up():
+            self.io_loop.remove_timeout(handles.pop('check'))
+            self._pending.pop(token, None)
+            # in case the notification got lost on the way
+            callback(job.result)
+
+        def check():
+            if self._pending.get(token) is not done:
+                return
+            if job.is_finished or job.is_failed:
+                self._pending.pop(token)
+                done(job.result)
+            else:
+                handles['check'] = self.io_loop.add_timeout(
+                    time.time() + self.CHECK_INTERVAL,
+                    check
+                )
+
+        self._pending[token] = done
+        handles['give_up'] = self.io_loop.add_timeout(
+            time.time() + timeout,
+            give_up
+        )
+        handles['check'] = self.io_loop.add_timeout(
+            time.time() + self.CHECK_INTERVAL,
+            check
+        )
+
+    def forget(self, job):
+        """for jobs enqueued here that nobody is going to wait for"""
+        self._pending.pop(job.notify_token, None)
+
+    def _finished(self, token, result):
+        if token not in self._pending:
+            # nobody is waiting for it anymore
+            return
+        callback = self._pending.pop(token)
+        if callback is None:
+            self._pending[token] = (result,)
+        else:
+            callback(result)
+
+    def _listen(self):
+        prefix = CHANNEL % ''
+        while True:
+            try:
+                pubsub = _get_redis().pubsub()
+                pubsub.psubscribe(CHANNEL % '*')
+                for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    token = message['channel'][len(prefix):]
+                    result = cPickle.loads(message['data'])
+                    self.io_loop.add_callback(
+                        lambda t=token, r=result: self._finished(t, r)
+                    )
+            except redis.exceptions.ConnectionError:
+                logging.warning('Lost the jobdone listener', exc_info=True)
+                time.sleep(1)
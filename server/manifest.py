@@ -0,0 +1,139 @@
+import redis.client
+import settings
+
+
+def get_redis():
+    return redis.client.Redis(
+        settings.REDIS_HOST,
+        settings.REDIS_PORT
+    )
+
+
+class TileManifest(object):
+    """Keeps track of which tiles an image has and how big they are so
+    nobody has to walk the tile store to find out.
+
+    `tiles:<fileid>` is a hash of zoom level to total bytes (plus a
+    `built` field once it is known to be complete) and
+    `tiles:<fileid>:<zoom>` is a hash of '<row>,<col>.<extension>' to
+    the size of that tile.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, redis, fileid):
+        self.redis = redis
+        self.fileid = fileid
+        self.key = 'tiles:%s' % fileid
+
+    def get_zoom_key(self, zoom):
+        return 'tiles:%s:%s' % (self.fileid, zoom)
+
+    @staticmethod
+    def get_name(row, col, extension):
+        return '%s,%s.%s' % (row, col, extension)
+
+    def get_zooms(self):
+        return sorted(
+            int(x) for x in self.redis.hkeys(self.key)
+            if x.isdigit()
+        )
+
+    def is_built(self):
+        return bool(self.redis.hexists(self.key, 'built'))
+
+    def mark_built(self):
+        self.redis.hset(self.key, 'built', 1)
+
+    def add(self, tiles):
+        """record a list of (zoom, row, col, extension, size)"""
+        for i in range(0, len(tiles), self.BATCH_SIZE):
+            self._add(tiles[i:i + self.BATCH_SIZE])
+
+    def _add(self, tiles):
+        if not tiles:
+            return
+        # find out what was there before so the byte totals can be
+        # adjusted for tiles that are overwritten
+        pipe = self.redis.pipeline(transaction=False)
+        for zoom, row, col, extension, size in tiles:
+            pipe.hget(
+                self.get_zoom_key(zoom),
+                self.get_name(row, col, extension)
+            )
+        before = pipe.execute()
+
+        deltas = {}
+        pipe = self.redis.pipeline(transaction=False)
+        for (zoom, row, col, extension, size), old in zip(tiles, before):
+            pipe.hset(
+                self.get_zoom_key(zoom),
+                self.get_name(row, col, extension),
+                size
+            )
+            deltas[zoom] = deltas.get(zoom, 0) + size - int(old or 0)
+        for zoom, delta in deltas.items():
+            pipe.hincrby(self.key, zoom, delta)
+        pipe.execute()
+
+    def count(self, zoom=None):
+        if zoom is not None:
+            return self.redis.hlen(self.get_zoom_key(zoom))
+        pipe = self.redis.pipeline(transaction=False)
+        for zoom in self.get_zooms():
+            pipe.hlen(self.get_zoom_key(zoom))
+        return sum(pipe.execute())
+
+    def get_bytes(self, zoom=None):
+        if zoom is not None:
+            return int(self.redis.hget(self.key, zoom) or 0)
+        return sum(
+            int(value) for key, value in self.redis.hgetall(self.key).items()
+            if key.isdigit()
+        )
+
+    def get_names(self, zoom):
+        """return the set of '<row>,<col>.<extension>' of a zoom level"""
+        return set(self.redis.hkeys(self.get_zoom_key(zoom)))
+
+    def get_sizes(self, tiles):
+        """return the sizes of a list of (zoom, row, col, extension).
+        Tiles that don't exist get None."""
+        pipe = self.redis.pipeline(transaction=False)
+        for zoom, row, col, extension in tiles:
+            pipe.hget(
+                self.get_zoom_key(zoom),
+                self.get_name(row, col, extension)
+            )
+        return [x is not None and int(x) or None for x in pipe.execute()]
+
+    def iter_tiles(self, size=256):
+        """yield (size, zoom, row, col, extension) of every tile"""
+        for zoom in self.get_zooms():
+            for name in self.get_names(zoom):
+                row_col, extension = name.split('.')
+                row, col = [int(x) for x in row_col.split(',')]
+                yield size, zoom, row, col, extension
+
+    def rebuild(self, store, image):
+        """fill the manifest from what's actually in the tile store"""
+        self.delete()
+        tiles = []
+        for size, zoom, row, col, extension in store.list_tiles(image):
+            tiles.append((
+                zoom, row, col, extension,
+                store.get_size(image, size, zoom, row, col, extension)
+            ))
+        self.add(tiles)
+        self.mark_built()
+
+    def delete(self):
+        zooms = self.get_zooms()
+        self.redis.delete(self.key, *[self.get_zoom_key(x) for x in zooms])
+
+
+def record_tiles(image, tiles):
+    """called by the queue workers after they have made some tiles"""
+    if not tiles:
+        return
+    TileManifest(get_redis(), image.replace('/', '')).add(tiles)
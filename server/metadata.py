@@ -0,0 +1,116 @@
+import json
+import time
+import logging
+import tornado.gen
+import motor
+import tornadoredis
+
+
+# bump this whenever make_metadata() changes what it returns and
+# anything cached in the old format is ignored
+METADATA_VERSION = 2
+
+FOUND_SECONDS = 60 * 60
+# how long to remember that there's no such image
+MISSING_SECONDS = 60
+
+
+def get_key(fileid):
+    return 'metadata:%s' % fileid
+
+
+def make_metadata(document):
+    metadata = {
+        '_v': METADATA_VERSION,
+        'content_type': document['contenttype'],
+        'owner': document['user'],
+        'title': document.get('title', ''),
+        'description': document.get('description', ''),
+        'date_timestamp': time.mktime(document['date'].timetuple()),
+        'width': document.get('width'),
+        'cdn_domain': document.get('cdn_domain', None),
+        'wrap': document.get('wrap', False),
+    }
+    if document.get('ranges'):
+        metadata['ranges'] = document['ranges']
+    return metadata
+
+
+def dumps(metadata):
+    """`metadata` is what make_metadata() returns or None if there's
+    no such image"""
+    if metadata is None:
+        metadata = {'_v': METADATA_VERSION, 'missing': True}
+    return json.dumps(metadata)
+
+
+def loads(data):
+    """return (found, metadata). `found` is False if `data` is nothing
+    or in an old format."""
+    if not data:
+        return False, None
+    metadata = json.loads(data)
+    if metadata.get('_v') != METADATA_VERSION:
+        return False, None
+    if metadata.get('missing'):
+        return True, None
+    return True, metadata
+
+
+class MetadataLoader(object):
+    """Loads the cached metadata of an image or, on a cache miss, makes
+    it from the database. Callbacks get `(metadata, error)` like the
+    ones `motor.Op` expects and `metadata` is None if there's no such
+    image.
+
+    Concurrent loads of the same fileid share one Redis GET and at most
+    one database lookup.
+    """
+
+    def __init__(self, db, redis_pool):
+        self.db = db
+        self.redis_pool = redis_pool
+        # fileid -> callbacks waiting for it
+        self._waiting = {}
+
+    def load(self, fileid, callback):
+        if fileid in self._waiting:
+            self._waiting[fileid].append(callback)
+            return
+        self._waiting[fileid] = [callback]
+        self._load(fileid)
+
+    @tornado.gen.engine
+    def _load(self, fileid):
+        metadata = error = None
+        client = tornadoredis.Client(connection_pool=self.redis_pool)
+        try:
+            key = get_key(fileid)
+            found, metadata = loads(
+                (yield tornado.gen.Task(client.get, key))
+            )
+            if not found:
+                logging.info("Meta data cache miss (%s)" % fileid)
+                document = yield motor.Op(
+                    self.db.images.find_one,
+                    {'fileid': fileid}
+                )
+                if document:
+                    metadata = make_metadata(document)
+                    seconds = FOUND_SECONDS
+                else:
+                    seconds = MISSING_SECONDS
+                yield tornado.gen.Task(
+                    client.setex,
+                    key,
+                    seconds,
+                    dumps(metadata)
+                )
+        except Exception as error:
+            logging.error('Unable to load metadata of %s', fileid,
+                          exc_info=True)
+            metadata = None
+        finally:
+            client.disconnect()
+        for callback in self._waiting.pop(fileid):
+            callback(metadata, error)
@@ -1,30 +1,97 @@
 import time
 import os
+import shutil
+import tempfile
 from glob import glob
 import subprocess
 import stat
+from tilestore import get_tile_store
+from manifest import record_tiles, get_redis
+from tilecache import invalidate as invalidate_tile_cache
+import progress
 
 
 def optimize_images(image, zoom, extension, static_path):
+    progress.report(image.replace('/', ''), progress.OPTIMIZING, zoom=zoom)
+    store = get_tile_store(static_path)
+    if not store.filesystem:
+        return _optimize_stored_images(store, image, zoom, extension)
     root = os.path.join(
         static_path,
         'tiles'
     )
     root = os.path.join(root, image, '256', str(zoom))
+    shrunk = _optimize_images(root, extension)
+    # so the manifest has the sizes that are actually served
+    tiles = []
+    for path, size in shrunk.items():
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            row, col = [int(x) for x in name.split(',')]
+        except ValueError:
+            continue
+        tiles.append((zoom, row, col, extension, size))
+    record_tiles(image, tiles)
+    if tiles:
+        # or the web processes keep serving the bigger ones
+        invalidate_tile_cache(get_redis(), image, zoom)
+
+
+def _optimize_stored_images(store, image, zoom, extension):
+    # the optimizers only work on files so copy the tiles out of the store
+    # and put back the ones that got smaller
+    root = tempfile.mkdtemp()
+    try:
+        before = {}
+        for row, col, extension_ in store.list_zoom(image, 256, zoom):
+            if extension_ != extension:
+                continue
+            data = store.read(image, 256, zoom, row, col, extension)
+            path = os.path.join(root, '%s,%s.%s' % (row, col, extension))
+            with open(path, 'wb') as f:
+                f.write(data)
+            before[(row, col)] = len(data)
+        _optimize_images(root, extension)
+        tiles = []
+        for (row, col), size in before.items():
+            path = os.path.join(root, '%s,%s.%s' % (row, col, extension))
+            size_after = os.stat(path)[stat.ST_SIZE]
+            if size_after < size:
+                with open(path, 'rb') as f:
+                    store.write(image, 256, zoom, row, col, extension,
+                                f.read())
+                tiles.append((zoom, row, col, extension, size_after))
+        # the smaller ones were appended
+        store.compact(image, 256, zoom, extension)
+        record_tiles(image, tiles)
+        if tiles:
+            invalidate_tile_cache(get_redis(), image, zoom)
+    finally:
+        shutil.rmtree(root)
+
+
+def _optimize_images(root, extension):
+    """return {path: size} of the files that got smaller"""
     total_before = 0
     search_path = os.path.join(root, '*.%s' % extension)
     files = glob(search_path)
+    sizes = {}
     for each in files:
         size = os.stat(each)[stat.ST_SIZE]
         #print each, "IS", size
         total_before += size
+        sizes[each] = size
     t0 = time.time()
     out, err = _optimize(files, extension)
     t1 = time.time()
 
     total_after = 0
+    shrunk = {}
     for each in files:
-        total_after += os.stat(each)[stat.ST_SIZE]
+        size = os.stat(each)[stat.ST_SIZE]
+        total_after += size
+        if size < sizes[each]:
+            shrunk[each] = size
 
     def kb(s):
         return "%.1fKb" % (s / 1000.0)
@@ -32,6 +99,7 @@ def optimize_images(image, zoom, extension, static_path):
     print "Took", round(t1 - t0, 2), "seconds to optimize", len(files), "tiles"
     print "From", kb(total_before), "to", kb(total_after),
     print "saving", kb(total_before - total_after)
+    return shrunk
 
 def optimize_thumbnails(image, extension, static_path):
     root = os.path.join(
@@ -0,0 +1,104 @@
+import base64
+import datetime
+import calendar
+from bson.objectid import ObjectId
+import tornado.gen
+import motor
+
+
+COUNT_CACHE_SECONDS = 60 * 5
+
+
+def encode_cursor(document):
+    """opaque string that says where in the `(date, _id)` order a
+    document is"""
+    date = document['date']
+    timestamp = calendar.timegm(date.utctimetuple()) * 1000000
+    timestamp += date.microsecond
+    return base64.urlsafe_b64encode('%d:%s' % (timestamp, document['_id']))
+
+
+def decode_cursor(cursor):
+    """return (date, _id) or raise ValueError"""
+    try:
+        timestamp, _id = base64.urlsafe_b64decode(str(cursor)).split(':')
+        date = (
+            datetime.datetime.utcfromtimestamp(int(timestamp) / 1000000) +
+            datetime.timedelta(microseconds=int(timestamp) % 1000000)
+        )
+        return date, ObjectId(_id)
+    except Exception:
+        raise ValueError('Invalid cursor %r' % cursor)
+
+
+def _keyset_search(search, cursor, operator):
+    date, _id = decode_cursor(cursor)
+    search = dict(search)
+    search['$or'] = [
+        {'date': {operator: date}},
+        {'date': date, '_id': {operator: _id}},
+    ]
+    return search
+
+
+@tornado.gen.engine
+def find_page(collection, search, page_size, callback,
+              after=None, before=None, fields=None):
+    """callback with (documents, pagination) for one page of `search`,
+    newest first, without any skip().
+
+    `after` and `before` are cursors from a previous page and
+    `pagination` has the cursors of the next ('after') and previous
+    ('before') pages or None if there isn't one.
+    """
+    if before:
+        query = _keyset_search(search, before, '$gt')
+        sort = [('date', 1), ('_id', 1)]
+    elif after:
+        query = _keyset_search(search, after, '$lt')
+        sort = [('date', -1), ('_id', -1)]
+    else:
+        query = search
+        sort = [('date', -1), ('_id', -1)]
+
+    documents = []
+    # one more than we need to know if there's another page
+    cursor = collection.find(query, fields).sort(sort).limit(page_size + 1)
+    while (yield cursor.fetch_next):
+        documents.append(cursor.next_object())
+    more = len(documents) > page_size
+    documents = documents[:page_size]
+
+    pagination = {'before': None, 'after': None}
+    if before:
+        if not more:
+            # we're back at the beginning
+            result = yield tornado.gen.Task(
+                find_page,
+                collection,
+                search,
+                page_size,
+                fields=fields
+            )
+            callback(result)
+            return
+        documents.reverse()
+        pagination['before'] = encode_cursor(documents[0])
+        pagination['after'] = encode_cursor(documents[-1])
+    else:
+        if after and documents:
+            pagination['before'] = encode_cursor(documents[0])
+        if more:
+            pagination['after'] = encode_cursor(documents[-1])
+    callback((documents, pagination))
+
+
+@tornado.gen.engine
+def get_count(redis, collection, search, cache_key, callback):
+    """count of `search` that is allowed to be a few minutes old"""
+    cache_key = 'count:%s' % cache_key
+    count = redis.get(cache_key)
+    if count is None:
+        count = yield motor.Op(collection.find(search).count)
+        redis.setex(cache_key, count, COUNT_CACHE_SECONDS)
+    callback(int(count))
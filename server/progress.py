@@ -0,0 +1,174 @@
+import json
+import time
+import logging
+import threading
+import redis.client
+import redis.exceptions
+# `redis` is also what the functions below call a connection
+redis_exceptions = redis.exceptions
+import tornado.ioloop
+import settings
+
+
+# the latest state is a hash and every change to it is also published
+# on a channel of the same name
+KEY = 'progress:%s'
+EXPIRE = 60 * 60
+
+# stages
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+TILING = 'tiling'
+OPTIMIZING = 'optimizing'
+DONE = 'done'
+FAILED = 'failed'
+# the order they happen in. An upload never goes back to an earlier
+# stage and nothing changes once it's done or failed.
+STAGES = (QUEUED, DOWNLOADING, TILING, OPTIMIZING, DONE, FAILED)
+
+
+def _get_redis():
+    return redis.client.Redis(
+        settings.REDIS_HOST,
+        settings.REDIS_PORT
+    )
+
+
+def publish(redis, fileid, stage=None, **fields):
+    """record and tell whoever is following that something happened to
+    the upload of `fileid`. Fields that aren't mentioned stay as they
+    were.
+
+    Only QUEUED starts a new record so what the workers publish after
+    it has expired is ignored, as is anything after DONE or FAILED.
+    """
+    key = KEY % fileid
+    with redis.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                current = pipe.hget(key, 'stage')
+                if current is None and stage != QUEUED:
+                    return
+                current = current and json.loads(current)
+                if current in (DONE, FAILED):
+                    return
+                changed = dict(fields)
+                if stage and (
+                    not current or
+                    STAGES.index(stage) >= STAGES.index(current)
+                ):
+                    changed['stage'] = stage
+                    if stage in (DONE, FAILED):
+                        changed['finished'] = True
+                if not changed:
+                    return
+                pipe.multi()
+                pipe.hmset(
+                    key,
+                    dict((k, json.dumps(v)) for k, v in changed.items())
+                )
+                pipe.expire(key, EXPIRE)
+                pipe.publish(key, json.dumps(changed))
+                pipe.execute()
+                return
+            except redis_exceptions.WatchError:
+                # somebody else published in between
+                continue
+
+
+def get_progress(redis, fileid):
+    """return everything published about `fileid` so far or None"""
+    state = redis.hgetall(KEY % fileid)
+    if not state:
+        return None
+    return dict((k, json.loads(v)) for k, v in state.items())
+
+
+def report(fileid, stage=None, **fields):
+    """publish() for the workers, which have no connection of their own
+    and would rather carry on than fail over a progress report"""
+    try:
+        publish(_get_redis(), fileid, stage, **fields)
+    except redis.exceptions.ConnectionError:
+        logging.warning('Unable to publish progress', exc_info=True)
+
+
+class ByteCounter(object):
+    """for the downloader. Publishes how many bytes are in at most every
+    `interval` seconds."""
+
+    def __init__(self, fileid, total=None, interval=0.5):
+        self.fileid = fileid
+        self.total = total
+        self.interval = interval
+        self._redis = _get_redis()
+        self._next = 0
+
+    def update(self, done, force=False):
+        now = time.time()
+        if not force and now < self._next:
+            return
+        self._next = now + self.interval
+        fields = {'done': done}
+        if self.total:
+            fields['total'] = self.total
+        try:
+            publish(self._redis, self.fileid, DOWNLOADING, **fields)
+        except redis.exceptions.ConnectionError:
+            # not worth failing a download over
+            logging.warning('Unable to publish progress', exc_info=True)
+
+
+class ProgressHub(object):
+    """Lets handlers follow uploads as they happen.
+
+    One thread per web process listens on the `progress:*` channels and
+    hands what's published to the IOLoop::
+
+        self.progress_hub.add(fileid, callback)
+        ...
+        self.progress_hub.remove(fileid, callback)
+
+    `callback` is called with a dict of what changed.
+    """
+
+    def __init__(self):
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+        # fileid -> callbacks
+        self._listeners = {}
+        self._thread = threading.Thread(target=self._listen)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, fileid, callback):
+        self._listeners.setdefault(fileid, []).append(callback)
+
+    def remove(self, fileid, callback):
+        callbacks = self._listeners.get(fileid, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._listeners.pop(fileid, None)
+
+    def _published(self, fileid, fields):
+        for callback in list(self._listeners.get(fileid, [])):
+            callback(fields)
+
+    def _listen(self):
+        prefix = KEY % ''
+        while True:
+            try:
+                pubsub = _get_redis().pubsub()
+                pubsub.psubscribe(KEY % '*')
+                for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    fileid = message['channel'][len(prefix):]
+                    fields = json.loads(message['data'])
+                    self.io_loop.add_callback(
+                        lambda f=fileid, d=fields: self._published(f, d)
+                    )
+            except redis.exceptions.ConnectionError:
+                logging.warning('Lost the progress listener', exc_info=True)
+                time.sleep(1)
@@ -0,0 +1,97 @@
+import datetime
+
+
+# the leaderboards
+HITS = 'hits'
+HITS_THIS_MONTH = 'hits_this_month'
+BYTES_SERVED = 'bytes_served'
+
+# monthly leaderboards are only interesting for a while
+MONTH_EXPIRY = 60 * 60 * 24 * 62
+
+BATCH_SIZE = 1000
+
+
+def get_key(board, now=None):
+    if board == HITS_THIS_MONTH:
+        if not now:
+            now = datetime.datetime.utcnow()
+        return 'ranking:hits:%s:%s' % (now.year, now.month)
+    return 'ranking:%s' % board
+
+
+def get_user_key(user):
+    return 'userimages:%s' % user
+
+
+def incr(redis, board, fileid, amount, now=None):
+    """`redis` can be a pipeline"""
+    key = get_key(board, now=now)
+    redis.zincrby(key, fileid, amount)
+    if board == HITS_THIS_MONTH:
+        redis.expire(key, MONTH_EXPIRY)
+
+
+def add_image(redis, fileid, user):
+    redis.sadd(get_user_key(user), fileid)
+
+
+def remove_image(redis, fileid, user):
+    pipe = redis.pipeline(transaction=False)
+    for board in (HITS, HITS_THIS_MONTH, BYTES_SERVED):
+        pipe.zrem(get_key(board), fileid)
+    pipe.srem(get_user_key(user), fileid)
+    pipe.execute()
+
+
+def get_user_ranking_key(key, user):
+    return '%s:user:%s' % (key, user)
+
+
+def get_top(redis, board, n=10, user=None, now=None):
+    """return [(score, fileid), ...] of the `n` best"""
+    key = get_key(board, now=now)
+    if user:
+        user_key = get_user_ranking_key(key, user)
+        if not redis.exists(user_key):
+            # scores of the user's images only. It's fine for it to
+            # be a minute out of date.
+            redis.zinterstore(
+                user_key,
+                {key: 1, get_user_key(user): 0}
+            )
+            redis.expire(user_key, 60)
+        key = user_key
+    return [
+        (score, fileid) for fileid, score in
+        redis.zrevrange(key, 0, n - 1, withscores=True, score_cast_func=int)
+    ]
+
+
+def rebuild(redis, images, stats, now=None):
+    """build every leaderboard from scratch. `images` is a list of
+    (fileid, user) and `stats` what `stats.get_stats()` returns for
+    them."""
+    if not now:
+        now = datetime.datetime.utcnow()
+    users = set(user for fileid, user in images)
+    redis.delete(
+        get_key(HITS),
+        get_key(HITS_THIS_MONTH, now=now),
+        get_key(BYTES_SERVED),
+        *[get_user_key(x) for x in users]
+    )
+    for i in range(0, len(images), BATCH_SIZE):
+        batch = images[i:i + BATCH_SIZE]
+        boards = {HITS: {}, HITS_THIS_MONTH: {}, BYTES_SERVED: {}}
+        pipe = redis.pipeline(transaction=False)
+        for fileid, user in batch:
+            pipe.sadd(get_user_key(user), fileid)
+            for board, scores in boards.items():
+                if stats[fileid][board]:
+                    scores[fileid] = stats[fileid][board]
+        for board, scores in boards.items():
+            if scores:
+                pipe.zadd(get_key(board, now=now), **scores)
+        pipe.expire(get_key(HITS_THIS_MONTH, now=now), MONTH_EXPIRY)
+        pipe.execute()
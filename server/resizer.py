@@ -3,9 +3,34 @@ import time
 import os
 import logging
 import subprocess
+try:
+    import pyvips
+except ImportError:  # pragma: no cover
+    pyvips = None
+from PIL import Image
+import settings
 
 
 def resize_image(path, width, save_path):
+    backend = settings.RESIZE_BACKEND
+    if backend == 'pyvips' and pyvips is None:
+        logging.warning("resizer: pyvips not installed")
+        backend = 'vipsthumbnail'
+    save_path = os.path.abspath(save_path)
+    t0 = time.time()
+    try:
+        BACKENDS[backend](path, width, save_path)
+    except Exception:
+        if backend == 'vipsthumbnail':
+            raise
+        logging.error("resizer: %s failed" % backend, exc_info=True)
+        _resize_vipsthumbnail(path, width, save_path)
+    t1 = time.time()
+    print "RESIZE (%s) TOOK" % backend, t1 - t0
+    return save_path
+
+
+def _resize_vipsthumbnail(path, width, save_path):
     # _resize_tool = 'resize'
     # cmd = (
     #     'convert %s -%s %d %s' %
@@ -13,14 +38,12 @@ def resize_image(path, width, save_path):
     # )
     # cmd = 'MAGICK_THREAD_LIMIT=1 ' + cmd
     # see https://github.com/jcupitt/libvips/issues/216
-    save_path = os.path.abspath(save_path)
     cmd = (
         'vipsthumbnail %s -s %d -o %s' % (
             path, width, save_path
         )
     )
     print "CMD", repr(cmd)
-    t0 = time.time()
     process = subprocess.Popen(
         cmd,
         shell=True,
@@ -28,11 +51,35 @@ def resize_image(path, width, save_path):
         stderr=subprocess.PIPE
     )
     out, err = process.communicate()
-    t1 = time.time()
-    print "CMD TOOK", t1 - t0
     if err:
         logging.warning("resizer: %s" % err)
-    return save_path
+
+
+def _resize_pyvips(path, width, save_path):
+    # same as `vipsthumbnail -s width` but without the process
+    im = pyvips.Image.thumbnail(path, width, height=width)
+    im.write_to_file(save_path)
+
+
+def _resize_pil(path, width, save_path):
+    im = Image.open(path)
+    if im.format == 'JPEG':
+        # lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        im.draft(im.mode, (width, width))
+    if im.mode not in ('RGB', 'RGBA', 'L'):
+        if save_path.lower().endswith('.png'):
+            im = im.convert('RGBA')
+        else:
+            im = im.convert('RGB')
+    im.thumbnail((width, width), Image.ANTIALIAS)
+    im.save(save_path)
+
+
+BACKENDS = {
+    'vipsthumbnail': _resize_vipsthumbnail,
+    'pyvips': _resize_pyvips,
+    'pil': _resize_pil,
+}
 
 
 def make_resizes(path, ranges):
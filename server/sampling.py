@@ -0,0 +1,32 @@
+import random
+import tornado.gen
+
+
+# every image gets a random number in [0, 1) in this field when it's
+# created so a random one can be picked with one index lookup
+RANDOM_FIELD = 'random'
+
+
+def get_random_value():
+    return random.random()
+
+
+@tornado.gen.engine
+def find_random(collection, search, callback, fields=None):
+    """callback with a random document that matches `search` or None if
+    there are none. Needs an index on `RANDOM_FIELD`."""
+    value = get_random_value()
+    # the first one after the random value or, if there is none, the
+    # last one before it
+    for operator, direction in (('$gte', 1), ('$lt', -1)):
+        spec = dict(search)
+        spec[RANDOM_FIELD] = {operator: value}
+        cursor = (
+            collection.find(spec, fields)
+            .sort([(RANDOM_FIELD, direction)])
+            .limit(1)
+        )
+        if (yield cursor.fetch_next):
+            callback(cursor.next_object())
+            return
+    callback(None)
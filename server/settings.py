@@ -15,6 +15,52 @@ DEFAULT_CDN_TILER_DOMAIN = 'd220r9wol91huc.cloudfront.net'
 TILES_BUCKET_ID = 'tiler-tiles'
 ORIGINALS_BUCKET_ID = 'tiler-originals'
 
+# where tiles are kept. 'filesystem' is one file per tile, 'packed' is
+# one file per zoom level per image (see tilestore.py)
+TILE_STORE = 'filesystem'
+
+# how many packs each process of the 'packed' store keeps mapped
+PACKED_TILE_STORE_MAX_MAPS = 256
+
+# how resizes and thumbnails are made. One of 'vipsthumbnail' (runs the
+# command line program), 'pyvips' or 'pil' (both in-process)
+RESIZE_BACKEND = 'vipsthumbnail'
+
+# roughly how many bytes of decoded pixels a queue worker may hold in
+# memory when making tiles. Bigger images are tiled in strips, which
+# needs the optional pyvips.
+TILING_MAX_MEMORY = 512 * 1024 * 1024
+
+# how many processes a queue worker uses to cut the tiles of one zoom
+# level. 1 means no extra processes.
+TILING_WORKERS = 1
+
+# how many bytes of tiles each web process keeps in memory
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# threads each web process uses to read tiles and thumbnails off disk
+FILE_IO_THREADS = 4
+
+# hits and bytes served are written to Redis every this many
+# milliseconds or after this many of them, whichever comes first
+HIT_FLUSH_INTERVAL = 1000
+HIT_FLUSH_EVENTS = 200
+
+# connections each web process may have open for the non-blocking
+# Redis client
+REDIS_MAX_CONNECTIONS = 100
+
+# threads, each with its own S3 connection, a queue worker uses to
+# upload the tiles of an image
+S3_UPLOAD_THREADS = 8
+
+# big downloads from servers that accept ranges are fetched this many
+# bytes at a time over this many connections and each range is retried
+# from where it stopped this many times
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_RANGE_SIZE = 8 * 1024 * 1024
+DOWNLOAD_RANGE_ATTEMPTS = 5
+
 from local_settings import *
 
 assert BROWSERID_DOMAIN
@@ -29,6 +29,8 @@ var Utils = (function() {
 
 var Download = (function() {
   var _progress_interval;
+  var _progress_source;
+  var _progress_timeout;
   var _fileid;
   var _preload_timer;
   var _preload_urls = [];
@@ -88,8 +90,17 @@ var Download = (function() {
     }, preload_interval * 1000);
   }
 
-  function _really_post_success(response) {
+  function stop_progress() {
     clearInterval(_progress_interval);
+    clearTimeout(_progress_timeout);
+    if (_progress_source) {
+      _progress_source.close();
+      _progress_source = null;
+    }
+  }
+
+  function _really_post_success(response) {
+    stop_progress();
     $('#progress').hide();
     $('#progress-giveup').hide();
     if (response.error) {
@@ -107,7 +118,7 @@ var Download = (function() {
   }
 
   function _really_post_error(xhr, status, error_thrown) {
-    clearInterval(_progress_interval);
+    stop_progress();
     $('button, input').removeAttr('disabled', 'disabled');
     $('#progress').hide();
     $('#progress-giveup').hide();
@@ -118,16 +129,26 @@ var Download = (function() {
     alert(msg);
   }
 
+  function get_action(response, percentage) {
+    switch (response.stage) {
+      case 'tiling':
+        return 'Making tiles (zoom ' + response.zoom + ')';
+      case 'optimizing':
+        return 'Optimizing';
+    }
+    if (percentage >= 100) {
+      return 'Processing';
+    }
+    return 'Downloading';
+  }
+
   function _progress_post_success(response) {
     $('#downloaded').text(humanize.filesize(response.done));
-    var total = $('#expected_size').data('total');
+    var total = response.total || $('#expected_size').data('total');
     if (total) {
       var percentage = Math.round(response.done / total * 100);
-      if (percentage >= 100) {
-        $('#progress .progress-image-action').text('Processing');
-      } else {
-        $('#progress .progress-image-action').text('Downloading');
-      }
+      $('#progress .progress-image-action')
+        .text(get_action(response, percentage));
 
       $('#left').text(humanize.filesize(total - response.done));
       $('#percentage').text(percentage + '%');
@@ -136,7 +157,7 @@ var Download = (function() {
   }
 
   function _progress_give_up() {
-    clearInterval(_progress_interval);
+    stop_progress();
     $('button, input').attr('disabled', 'disabled');
     $('#progress').hide();
     $('#progress-giveup').show(100);
@@ -172,13 +193,30 @@ var Download = (function() {
         error: _really_post_error
       });
 
-      _progress_interval = setInterval(function() {
-        $.getJSON(PROGRESS_URL, {fileid: _fileid}, _progress_post_success);
-        _progress_load_count++;
-        if (_progress_load_count >= 60) {
-          _progress_give_up();
-        }
-      }, 1000);
+      if (window.EventSource) {
+        _progress_source = new EventSource(
+          PROGRESS_STREAM_URL + '?fileid=' + encodeURIComponent(_fileid)
+        );
+        _progress_source.onmessage = function(event) {
+          var response = $.parseJSON(event.data);
+          _progress_post_success(response);
+          if (response.finished && _progress_source) {
+            // or it reconnects when the server closes it
+            _progress_source.close();
+            _progress_source = null;
+          }
+        };
+        // same as when polling
+        _progress_timeout = setTimeout(_progress_give_up, 60 * 1000);
+      } else {
+        _progress_interval = setInterval(function() {
+          $.getJSON(PROGRESS_URL, {fileid: _fileid}, _progress_post_success);
+          _progress_load_count++;
+          if (_progress_load_count >= 60) {
+            _progress_give_up();
+          }
+        }, 1000);
+      }
   }
 
   function _preview_post_error(xhr, status, error_thrown) {
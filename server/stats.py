@@ -0,0 +1,208 @@
+import logging
+import datetime
+import tornado.ioloop
+import ranking
+
+
+# hash of site wide running totals. The fields are 'hits',
+# 'hits:<year>:<month>', 'bytes_served' and 'initialized' once the
+# totals have been counted up from every image.
+TOTALS_KEY = 'stats:totals'
+
+BATCH_SIZE = 1000
+
+
+def get_hit_keys(fileid, now=None):
+    if not now:
+        now = datetime.datetime.utcnow()
+    hit_key = 'hits:%s' % fileid
+    hit_month_key = (
+        'hits:%s:%s:%s' %
+        (now.year, now.month, fileid)
+    )
+    return hit_key, hit_month_key
+
+
+def _get_month_field(now):
+    return 'hits:%s:%s' % (now.year, now.month)
+
+
+def record_hit(redis, fileid, amount=1, now=None):
+    pipe = redis.pipeline(transaction=False)
+    _record_hit(pipe, fileid, amount, now or datetime.datetime.utcnow())
+    pipe.execute()
+
+
+def _record_hit(pipe, fileid, amount, now):
+    hit_key, hit_month_key = get_hit_keys(fileid, now)
+    pipe.incr(hit_key, amount)
+    pipe.incr(hit_month_key, amount)
+    pipe.hincrby(TOTALS_KEY, 'hits', amount)
+    pipe.hincrby(TOTALS_KEY, _get_month_field(now), amount)
+    ranking.incr(pipe, ranking.HITS, fileid, amount)
+    ranking.incr(pipe, ranking.HITS_THIS_MONTH, fileid, amount, now=now)
+
+
+def record_bytes_served(redis, fileid, bytes):
+    pipe = redis.pipeline(transaction=False)
+    _record_bytes_served(pipe, fileid, bytes)
+    pipe.execute()
+
+
+def _record_bytes_served(pipe, fileid, bytes):
+    pipe.hincrby('bytes_served', fileid, bytes)
+    pipe.hincrby(TOTALS_KEY, 'bytes_served', bytes)
+    ranking.incr(pipe, ranking.BYTES_SERVED, fileid, bytes)
+
+
+class HitBuffer(object):
+    """Adds up hits and bytes served in memory and writes them to Redis
+    in one pipeline every `interval` milliseconds or after `max_events`
+    of them, whichever comes first.
+
+    The rendered metadata of the images that got hits is invalidated
+    once per flush instead of on every hit.
+    """
+
+    def __init__(self, redis, interval, max_events):
+        self.redis = redis
+        self.max_events = max_events
+        self.hits = {}
+        self.served = {}
+        self.events = 0
+        self._periodic = tornado.ioloop.PeriodicCallback(
+            self.flush,
+            interval
+        )
+        self._periodic.start()
+
+    def hit(self, fileid):
+        self.hits[fileid] = self.hits.get(fileid, 0) + 1
+        self._added()
+
+    def serve(self, fileid, bytes):
+        self.served[fileid] = self.served.get(fileid, 0) + bytes
+        self._added()
+
+    def _added(self):
+        self.events += 1
+        if self.events >= self.max_events:
+            self.flush()
+
+    def flush(self):
+        if not self.events:
+            return
+        hits, served = self.hits, self.served
+        self.hits, self.served, self.events = {}, {}, 0
+
+        now = datetime.datetime.utcnow()
+        pipe = self.redis.pipeline(transaction=False)
+        for fileid, amount in hits.items():
+            _record_hit(pipe, fileid, amount, now)
+        for fileid, bytes in served.items():
+            _record_bytes_served(pipe, fileid, bytes)
+        if hits:
+            pipe.hdel('metadata-rendered', *hits.keys())
+        try:
+            pipe.execute()
+        except Exception:
+            logging.error('Unable to flush hits', exc_info=True)
+            # try again next time
+            for fileid, amount in hits.items():
+                self.hits[fileid] = self.hits.get(fileid, 0) + amount
+            for fileid, bytes in served.items():
+                self.served[fileid] = self.served.get(fileid, 0) + bytes
+            self.events += len(hits) + len(served)
+
+
+def forget_image(redis, fileid, now=None):
+    """take what a deleted image had off the running totals"""
+    if not now:
+        now = datetime.datetime.utcnow()
+    numbers = get_stats(redis, [fileid], now=now)[fileid]
+    pipe = redis.pipeline(transaction=False)
+    pipe.hincrby(TOTALS_KEY, 'hits', -(numbers['hits'] or 0))
+    pipe.hincrby(
+        TOTALS_KEY,
+        _get_month_field(now),
+        -(numbers['hits_this_month'] or 0)
+    )
+    pipe.hincrby(TOTALS_KEY, 'bytes_served', -(numbers['bytes_served'] or 0))
+    pipe.execute()
+
+
+def get_stats(redis, fileids, now=None):
+    """return a dict of fileid -> {'hits', 'hits_this_month',
+    'bytes_served'} with a handful of MGET/HMGET round trips no matter
+    how many fileids there are. Missing numbers are None."""
+    if not now:
+        now = datetime.datetime.utcnow()
+    fileids = list(fileids)
+    stats = {}
+    for i in range(0, len(fileids), BATCH_SIZE):
+        batch = fileids[i:i + BATCH_SIZE]
+        hit_keys, hit_month_keys = zip(
+            *[get_hit_keys(x, now) for x in batch]
+        )
+        pipe = redis.pipeline(transaction=False)
+        pipe.mget(hit_keys)
+        pipe.mget(hit_month_keys)
+        pipe.hmget('bytes_served', batch)
+        hits, hits_this_month, bytes_served = pipe.execute()
+        for j, fileid in enumerate(batch):
+            stats[fileid] = {
+                'hits': _int(hits[j]),
+                'hits_this_month': _int(hits_this_month[j]),
+                'bytes_served': _int(bytes_served[j]),
+            }
+    return stats
+
+
+def get_totals(redis, fileids, now=None):
+    total_hits = total_hits_this_month = total_bytes_served = 0
+    for each in get_stats(redis, fileids, now=now).values():
+        total_hits += each['hits'] or 0
+        total_hits_this_month += each['hits_this_month'] or 0
+        total_bytes_served += each['bytes_served'] or 0
+    return {
+        'total_hits': total_hits,
+        'total_hits_this_month': total_hits_this_month,
+        'total_bytes_served': total_bytes_served,
+    }
+
+
+def get_site_totals(redis, now=None):
+    """return the running totals or None if they have never been
+    initialized with `initialize_site_totals()`"""
+    if not now:
+        now = datetime.datetime.utcnow()
+    initialized, hits, hits_this_month, bytes_served = redis.hmget(
+        TOTALS_KEY,
+        ['initialized', 'hits', _get_month_field(now), 'bytes_served']
+    )
+    if not initialized:
+        return None
+    return {
+        'total_hits': _int(hits) or 0,
+        'total_hits_this_month': _int(hits_this_month) or 0,
+        'total_bytes_served': _int(bytes_served) or 0,
+    }
+
+
+def initialize_site_totals(redis, fileids, now=None):
+    if not now:
+        now = datetime.datetime.utcnow()
+    totals = get_totals(redis, fileids, now=now)
+    redis.hmset(TOTALS_KEY, {
+        'hits': totals['total_hits'],
+        _get_month_field(now): totals['total_hits_this_month'],
+        'bytes_served': totals['total_bytes_served'],
+        'initialized': 1,
+    })
+    return totals
+
+
+def _int(value):
+    if value is None:
+        return None
+    return int(value)
@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+import redis.client
+import redis.exceptions
+import tornado.ioloop
+import settings
+
+
+# what to drop from the caches of every web process is published here
+CHANNEL = 'tilecache:invalidate'
+
+
+def invalidate(redis, image, zoom=None):
+    """tell every TileCache to drop the tiles of `image` (the split
+    fileid) or only those of one zoom level"""
+    message = image if zoom is None else '%s %s' % (image, zoom)
+    redis.publish(CHANNEL, message)
+
+
+class TileCache(object):
+    """Least recently used cache of tiles that keeps the total size
+    of what it holds under `max_bytes`.
+
+    Keys are `(image, zoom, row, col, extension)` and the size of a value
+    is `len(value)` unless told otherwise. It's meant to live in the web
+    process so it's not thread safe.
+
+    Each web process has its own so once `listen()` has been called
+    it drops what `invalidate()` says has changed.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return None
+        # put it back on top as the most recently used
+        self._data[key] = (value, size)
+        return value
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = len(value)
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self._data[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            __, (oldest, oldest_size) = self._data.popitem(last=False)
+            self.bytes -= oldest_size
+
+    def pop(self, key):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return None
+        self.bytes -= size
+        return value
+
+    def delete_image(self, image, zoom=None):
+        for key in [x for x in self._data if x[0] == image]:
+            if zoom is None or key[1] == zoom:
+                self.pop(key)
+
+    def listen(self):
+        """start a thread that hands what's published on CHANNEL to the
+        IOLoop"""
+        io_loop = tornado.ioloop.IOLoop.instance()
+        thread = threading.Thread(target=self._listen, args=(io_loop,))
+        thread.daemon = True
+        thread.start()
+
+    def _invalidated(self, message):
+        bits = message.split()
+        if len(bits) == 2:
+            self.delete_image(bits[0], zoom=int(bits[1]))
+        else:
+            self.delete_image(bits[0])
+
+    def _listen(self, io_loop):
+        while True:
+            try:
+                pubsub = redis.client.Redis(
+                    settings.REDIS_HOST,
+                    settings.REDIS_PORT
+                ).pubsub()
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    io_loop.add_callback(
+                        lambda m=message['data']: self._invalidated(m)
+                    )
+            except redis.exceptions.ConnectionError:
+                logging.warning('Lost the tile cache listener', exc_info=True)
+                # anything could have changed in the meantime
+                io_loop.add_callback(self.clear)
+                time.sleep(1)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
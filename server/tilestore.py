@@ -0,0 +1,414 @@
+import os
+import stat
+import mmap
+import shutil
+import struct
+import fcntl
+import threading
+import collections
+import settings
+
+
+def _mkdir(newdir):
+    try:
+        os.makedirs(newdir)
+    except OSError:
+        # because tiles are written concurrently by the queue workers
+        # somebody else might have just made it
+        if not os.path.isdir(newdir):
+            raise
+
+
+class TileStore(object):
+    """Where the tiles of every image are kept.
+
+    Tiles are addressed by `(image, size, zoom, row, col, extension)`
+    where `image` is the split fileid, e.g. 'a/bc/def123'.
+    """
+
+    # True if every tile is a file at `get_relative_path()`
+    filesystem = False
+
+    def __init__(self, static_path):
+        self.static_path = static_path
+
+    def get_relative_path(self, image, size, zoom, row, col, extension):
+        return os.path.join(
+            'tiles',
+            image,
+            str(size),
+            str(zoom),
+            '%s,%s.%s' % (row, col, extension)
+        )
+
+    def get_image_root(self, image):
+        return os.path.join(self.static_path, 'tiles', image)
+
+    def exists(self, image, size, zoom, row, col, extension):
+        size = self.get_size(image, size, zoom, row, col, extension)
+        return size is not None
+
+    def get_size(self, image, size, zoom, row, col, extension):
+        raise NotImplementedError
+
+    def get_stat(self, image, size, zoom, row, col, extension):
+        """return (etag, modified) where `modified` is a timestamp or
+        None if the tile doesn't exist"""
+        raise NotImplementedError
+
+    def read(self, image, size, zoom, row, col, extension):
+        raise NotImplementedError
+
+    def write(self, image, size, zoom, row, col, extension, data):
+        raise NotImplementedError
+
+    def list_zoom(self, image, size, zoom):
+        """yield (row, col, extension) of every tile of this zoom level"""
+        raise NotImplementedError
+
+    def list_tiles(self, image):
+        """yield (size, zoom, row, col, extension) of every tile"""
+        root = self.get_image_root(image)
+        if not os.path.isdir(root):
+            return
+        for size in os.listdir(root):
+            if not size.isdigit():
+                continue
+            size_root = os.path.join(root, size)
+            zooms = set()
+            for each in os.listdir(size_root):
+                zoom = each.split('.')[0]
+                if zoom.isdigit():
+                    zooms.add(int(zoom))
+            for zoom in sorted(zooms):
+                for row, col, extension in self.list_zoom(image, size, zoom):
+                    yield int(size), zoom, row, col, extension
+
+    def compact(self, image, size, zoom, extension):
+        """give back the space of tiles that have been written again and
+        return how many bytes that was"""
+        return 0
+
+    def delete(self, image):
+        root = self.get_image_root(image)
+        if os.path.isdir(root):
+            shutil.rmtree(root)
+
+
+class FileSystemTileStore(TileStore):
+    """One file per tile. This is the layout the web server (and S3)
+    serves tiles from directly."""
+
+    filesystem = True
+
+    def get_path(self, image, size, zoom, row, col, extension):
+        return os.path.join(
+            self.static_path,
+            self.get_relative_path(image, size, zoom, row, col, extension)
+        )
+
+    def get_size(self, image, size, zoom, row, col, extension):
+        path = self.get_path(image, size, zoom, row, col, extension)
+        try:
+            return os.stat(path)[stat.ST_SIZE]
+        except OSError:
+            return None
+
+    def get_stat(self, image, size, zoom, row, col, extension):
+        path = self.get_path(image, size, zoom, row, col, extension)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+        return etag, st.st_mtime
+
+    def read(self, image, size, zoom, row, col, extension):
+        path = self.get_path(image, size, zoom, row, col, extension)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def write(self, image, size, zoom, row, col, extension, data):
+        path = self.get_path(image, size, zoom, row, col, extension)
+        _mkdir(os.path.dirname(path))
+        # write and rename so nobody ever reads a half written tile
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+    def list_zoom(self, image, size, zoom):
+        root = os.path.join(self.get_image_root(image), str(size), str(zoom))
+        if not os.path.isdir(root):
+            return
+        for filename in os.listdir(root):
+            name, extension = os.path.splitext(filename)
+            try:
+                row, col = [int(x) for x in name.split(',')]
+            except ValueError:
+                continue
+            yield row, col, extension[1:]
+
+
+class PackedTileStore(TileStore):
+    """All tiles of one zoom level of one image in one file.
+
+    The file starts with a header and a fixed size table with one
+    (offset, length) slot for every possible (row, col) followed by the
+    tile data. Writers append under an exclusive lock and readers mmap
+    the file so finding a tile is one slot lookup.
+
+    A tile that is written again is appended too so `compact()` is how
+    the space of the old ones is given back.
+    """
+
+    MAGIC = 'TPK1'
+    HEADER = struct.Struct('<4sI')
+    SLOT = struct.Struct('<QI')
+
+    def __init__(self, static_path, max_maps=None):
+        super(PackedTileStore, self).__init__(static_path)
+        if max_maps is None:
+            max_maps = settings.PACKED_TILE_STORE_MAX_MAPS
+        self.max_maps = max_maps
+        # pack path -> ((inode, size, mtime), mmap), least recently
+        # used first
+        self._maps = collections.OrderedDict()
+        # the file IO threads share the maps and one of them might close
+        # a map another is reading from
+        self._lock = threading.RLock()
+
+    def get_pack_path(self, image, size, zoom, extension):
+        return os.path.join(
+            self.get_image_root(image),
+            str(size),
+            '%s.%s.pack' % (zoom, extension)
+        )
+
+    def get_side(self, zoom):
+        # rows and cols go from 0 to 2 ** zoom + 1 inclusive
+        return 2 ** int(zoom) + 2
+
+    def get_table_end(self, side):
+        return self.HEADER.size + side * side * self.SLOT.size
+
+    def _get_slot_offset(self, side, row, col):
+        row, col = int(row), int(col)
+        if row < 0 or col < 0 or row >= side or col >= side:
+            raise ValueError('%s,%s outside %sx%s' % (row, col, side, side))
+        return self.HEADER.size + (row * side + col) * self.SLOT.size
+
+    def _close_map(self, pack_path):
+        cached = self._maps.pop(pack_path, None)
+        if cached is not None:
+            cached[1].close()
+
+    def _get_map(self, pack_path):
+        """return the mmap of the pack as it is on disk now or None if
+        there's no complete one"""
+        try:
+            st = os.stat(pack_path)
+        except OSError:
+            self._close_map(pack_path)
+            return None
+        # it's been appended to, compacted or deleted and made again
+        # if any of these change
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        cached = self._maps.pop(pack_path, None)
+        if cached is not None:
+            if cached[0] == key:
+                self._maps[pack_path] = cached
+                return cached[1]
+            cached[1].close()
+        try:
+            with open(pack_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.HEADER.size:
+                    return None
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, mmap.error):
+            return None
+        magic, side = self.HEADER.unpack_from(mapped, 0)
+        assert magic == self.MAGIC, pack_path
+        if len(mapped) < self.get_table_end(side):
+            # the writer hasn't finished the slot table yet
+            mapped.close()
+            return None
+        self._maps[pack_path] = (key, mapped)
+        while len(self._maps) > self.max_maps:
+            self._maps.popitem(last=False)[1][1].close()
+        return mapped
+
+    def _get_slot(self, image, size, zoom, row, col, extension):
+        """return (mmap, offset, length) or (None, None, None). Call
+        with the lock held."""
+        side = self.get_side(zoom)
+        try:
+            slot_offset = self._get_slot_offset(side, row, col)
+        except ValueError:
+            return None, None, None
+        pack_path = self.get_pack_path(image, size, zoom, extension)
+        mapped = self._get_map(pack_path)
+        if mapped is None:
+            return None, None, None
+        offset, length = self.SLOT.unpack_from(mapped, slot_offset)
+        if offset + length > len(mapped):
+            # it's been appended to since it was stat'ed
+            return None, None, None
+        return mapped, offset, length
+
+    def get_size(self, image, size, zoom, row, col, extension):
+        with self._lock:
+            mapped, offset, length = self._get_slot(
+                image, size, zoom, row, col, extension
+            )
+        if not length:
+            return None
+        return length
+
+    def get_stat(self, image, size, zoom, row, col, extension):
+        with self._lock:
+            mapped, offset, length = self._get_slot(
+                image, size, zoom, row, col, extension
+            )
+        if not length:
+            return None
+        # tiles are never written in place so where it is identifies it
+        etag = '"%x-%x"' % (offset, length)
+        pack_path = self.get_pack_path(image, size, zoom, extension)
+        try:
+            return etag, os.stat(pack_path).st_mtime
+        except OSError:
+            return None
+
+    def read(self, image, size, zoom, row, col, extension):
+        with self._lock:
+            mapped, offset, length = self._get_slot(
+                image, size, zoom, row, col, extension
+            )
+            if not length:
+                return None
+            return mapped[offset:offset + length]
+
+    def _open_locked(self, pack_path):
+        """return the pack opened for writing with an exclusive lock held,
+        making sure it's not one compact() has just replaced"""
+        while True:
+            fd = os.open(pack_path, os.O_RDWR | os.O_CREAT, 0644)
+            f = os.fdopen(fd, 'r+b')
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.stat(pack_path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except OSError:
+                pass
+            f.close()
+
+    def write(self, image, size, zoom, row, col, extension, data):
+        pack_path = self.get_pack_path(image, size, zoom, extension)
+        _mkdir(os.path.dirname(pack_path))
+        side = self.get_side(zoom)
+        slot_offset = self._get_slot_offset(side, row, col)
+        f = self._open_locked(pack_path)
+        try:
+            f.seek(0, os.SEEK_END)
+            if not f.tell():
+                f.write(self.HEADER.pack(self.MAGIC, side))
+                f.write('\0' * (side * side * self.SLOT.size))
+            offset = f.tell()
+            f.write(data)
+            # the data has to be there before the slot points to it
+            f.flush()
+            f.seek(slot_offset)
+            f.write(self.SLOT.pack(offset, len(data)))
+            f.flush()
+        finally:
+            # closing releases the lock
+            f.close()
+
+    def compact(self, image, size, zoom, extension):
+        """rewrite the pack with only the tiles the slots point to and
+        return how many bytes that saved"""
+        pack_path = self.get_pack_path(image, size, zoom, extension)
+        if not os.path.isfile(pack_path):
+            return 0
+        side = self.get_side(zoom)
+        table_end = self.get_table_end(side)
+        f = self._open_locked(pack_path)
+        try:
+            before = os.fstat(f.fileno()).st_size
+            if before < table_end:
+                return 0
+            f.seek(0)
+            header = f.read(table_end)
+            tmp_path = '%s.%s.tmp' % (pack_path, os.getpid())
+            with open(tmp_path, 'wb') as out:
+                out.write(header)
+                table = []
+                for slot_offset in range(self.HEADER.size, table_end,
+                                         self.SLOT.size):
+                    offset, length = self.SLOT.unpack_from(
+                        header, slot_offset
+                    )
+                    if length:
+                        f.seek(offset)
+                        table.append((slot_offset, out.tell(), length))
+                        out.write(f.read(length))
+                after = out.tell()
+                for slot_offset, offset, length in table:
+                    out.seek(slot_offset)
+                    out.write(self.SLOT.pack(offset, length))
+            # writers waiting for the lock notice the inode has changed
+            os.rename(tmp_path, pack_path)
+        finally:
+            f.close()
+        return before - after
+
+    def list_zoom(self, image, size, zoom):
+        root = os.path.join(self.get_image_root(image), str(size))
+        if not os.path.isdir(root):
+            return
+        side = self.get_side(zoom)
+        for filename in os.listdir(root):
+            bits = filename.split('.')
+            if len(bits) != 3 or bits[0] != str(zoom) or bits[2] != 'pack':
+                continue
+            extension = bits[1]
+            with self._lock:
+                mapped = self._get_map(os.path.join(root, filename))
+                if mapped is None:
+                    continue
+                found = []
+                for row in range(side):
+                    for col in range(side):
+                        offset, length = self.SLOT.unpack_from(
+                            mapped,
+                            self._get_slot_offset(side, row, col)
+                        )
+                        if length:
+                            found.append((row, col, extension))
+            for each in found:
+                yield each
+
+    def delete(self, image):
+        root = self.get_image_root(image)
+        with self._lock:
+            for pack_path in self._maps.keys():
+                if pack_path.startswith(root):
+                    self._close_map(pack_path)
+        super(PackedTileStore, self).delete(image)
+
+
+BACKENDS = {
+    'filesystem': FileSystemTileStore,
+    'packed': PackedTileStore,
+}
+
+
+def get_tile_store(static_path, backend=None):
+    if backend is None:
+        backend = settings.TILE_STORE
+    return BACKENDS[backend](static_path)
@@ -112,36 +112,49 @@ class ShowMetaData(tornado.web.UIModule):
         return self.handler.application.redis
 
     def render(self, image):
-        rendered = self.redis.hget(
-            'metadata-rendered',
-            image['fileid']
-        )
+        # see BaseHandler.prefetch_metadata()
+        prefetched = self.handler.prefetched_metadata.get(image['fileid'])
+        if prefetched is not None:
+            rendered = prefetched['rendered']
+        else:
+            rendered = self.redis.hget(
+                'metadata-rendered',
+                image['fileid']
+            )
         if rendered is None:
             logging.warning(
                 'Cache miss on metadata-rendered %s',
                 image['fileid']
             )
-            extras = self.get_extras(image['fileid'])
+            extras = self.get_extras(image['fileid'], prefetched)
             rendered = self.render_string(
                 '_meta.html',
                 image=image,
                 extras=extras,
             )
+            # not the handler's async client, which is disconnected as
+            # soon as the response is sent, possibly before this is
             self.redis.hset('metadata-rendered', image['fileid'], rendered)
         return rendered
 
-    def get_extras(self, fileid):
-        _now = datetime.datetime.utcnow()
+    def get_extras(self, fileid, prefetched=None):
+        if prefetched is not None:
+            hits = prefetched['hits']
+            hits_this_month = prefetched['hits_this_month']
+            comments = prefetched['comments']
+        else:
+            _now = datetime.datetime.utcnow()
+            hit_key = 'hits:%s' % fileid
+            hit_month_key = (
+                'hits:%s:%s:%s' %
+                (_now.year, _now.month, fileid)
+            )
+            hits = self.redis.get(hit_key)
+            hits_this_month = (
+                self.redis.get(hit_month_key)
+            )
+            comments = self.redis.hget('comments', fileid)
 
-        hit_key = 'hits:%s' % fileid
-        hit_month_key = (
-            'hits:%s:%s:%s' %
-            (_now.year, _now.month, fileid)
-        )
-        hits = self.redis.get(hit_key)
-        hits_this_month = (
-            self.redis.get(hit_month_key)
-        )
         extras = []
         if hits:
             hits = int(hits)
@@ -160,7 +173,6 @@ class ShowMetaData(tornado.web.UIModule):
                     )
             extras.append(h)
 
-        comments = self.redis.hget('comments', fileid)
         if comments is not None:
             comments = int(comments)
             if comments == 1:
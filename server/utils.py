@@ -2,9 +2,21 @@ import time
 import shutil
 import os
 import stat
+import tempfile
+import multiprocessing
+import cStringIO
 from PIL import Image
 import logging
+try:
+    import pyvips
+except ImportError:  # pragma: no cover
+    pyvips = None
 from resizer import make_resize, resize_image
+from tilestore import get_tile_store
+from manifest import record_tiles, TileManifest, get_redis
+from tilecache import invalidate as invalidate_tile_cache
+import progress
+import settings
 
 
 def mkdir(newdir):
@@ -25,62 +37,326 @@ def mkdir(newdir):
         os.mkdir(newdir)
 
 
-_RESIZES = {}
-_TIMESTAMPS = {}
+class TileSession(object):
+    """Makes the tiles for one zoom level of one image.
 
-def scale_and_crop(path, requested_size, row, col, zoom, image,
-                   cache_image_open=False):
-    im = Image.open(path)
-    x, y = [float(v) for v in im.size]
-    xr, yr = [float(v) for v in requested_size]
-    r = min(xr / x, yr / y)
+    The paths and directories are worked out once and the resized image
+    is opened and loaded into memory only once, the first time a tile
+    actually needs to be cropped out of it.
+    """
 
-    box = (256 * row, 256 * col, 256 * (row + 1), 256 * (col + 1))
+    def __init__(self, image, size, zoom, extension, static_path):
+        self.image = image
+        self.static_path = static_path
+        self.store = get_tile_store(static_path)
+        self.size = int(size)
+        self.zoom = int(zoom)
+        self.extension = extension
+        assert self.size == 256, self.size
+
+        self.path = _find_upload(image, static_path)
+        start, ext = os.path.splitext(self.path)
+        width = self.size * (2 ** self.zoom)
+        self.resized_path = '%s-%s-%s%s' % (start, self.zoom, width, ext)
+        self._im = None
+        # (zoom, row, col, extension, size) of tiles not yet recorded
+        # in the manifest
+        self.written = []
+
+    def get_image(self):
+        if self._im is None:
+            if not os.path.isfile(self.resized_path):
+                print "Having to use make_resize()"
+                t0 = time.time()
+                self.resized_path = make_resize(self.path, self.zoom)
+                t1 = time.time()
+                print "\ttook", round(t1 - t0, 2), "seconds"
+            im = Image.open(self.resized_path)
+            im.load()
+            self._im = im
+        return self._im
+
+    def save(self, row, col, tile):
+        size = save_tile(
+            self.store, self.image, self.size, self.zoom, row, col,
+            self.extension, tile, overwrite=False
+        )
+        if size:
+            self.written.append((self.zoom, row, col, self.extension, size))
+
+    def flush(self):
+        record_tiles(self.image, self.written)
+        self.written = []
+
+    def crop(self, row, col):
+        # convert (row, col) into PIL crop box
+        box = (
+            self.size * row,
+            self.size * col,
+            self.size * (row + 1),
+            self.size * (col + 1)
+        )
+        return self.get_image().crop(box)
+
+    def make(self, row, col):
+        if not self.store.exists(self.image, self.size, self.zoom,
+                                 row, col, self.extension):
+            self.save(row, col, self.crop(row, col))
+        return self.store.get_relative_path(
+            self.image, self.size, self.zoom, row, col, self.extension
+        )
 
-    w, h = int(round(x * r)), int(round(y * r))
-    _cache_key = '%s-%s-%s' % (image, zoom, w)
-    pathname, extension = os.path.splitext(path)
+    def make_all(self, rows, cols):
+        count = 0
+        for row in range(rows + 1):
+            for col in range(cols + 1):
+                self.make(row, col)
+                count += 1
+        self.flush()
+        return count
+
+    def iter_strips(self):
+        return _iter_strips(self.get_image(), self.size)
+
+    def make_all_parallel(self, rows, cols, workers):
+        return cut_tiles_parallel(
+            self.iter_strips(),
+            os.path.dirname(self.path),
+            self.image,
+            self.size,
+            self.zoom,
+            self.static_path,
+            self.extension,
+            rows,
+            cols,
+            workers,
+            overwrite=False
+        )
 
-    width = 256 * (2 ** zoom)
-    _resized_file = path.replace(
-        extension,
-        '-%s-%s%s' % (zoom, width, extension)
-    )
 
-    if not os.path.isfile(_resized_file):
-        # resizer.make_resize() uses `convert` so it's much more memory
-        # efficient
-        print "Having to use make_resize()"
-        t0 = time.time()
-        _resized_file = make_resize(path, zoom)
-        t1 = time.time()
-        print "\ttook", round(t1 - t0, 2), "seconds"
-        time.sleep(0.5)  # time to save it
+class StripTileSession(TileSession):
+    """Makes the tiles for one zoom level by decoding the resized image
+    one horizontal strip at a time instead of all at once.
 
+    The height of each strip is a multiple of the tile size picked so
+    that a strip never takes more than `max_memory` bytes.
+    """
 
-    if cache_image_open:
-        if _cache_key in _RESIZES:
-            im = _RESIZES[_cache_key]
+    def __init__(self, image, size, zoom, extension, static_path,
+                 max_memory=None):
+        super(StripTileSession, self).__init__(
+            image, size, zoom, extension, static_path
+        )
+        if max_memory is None:
+            max_memory = settings.TILING_MAX_MEMORY
+        self.max_memory = max_memory
+
+    def iter_strips(self):
+        if not os.path.isfile(self.resized_path):
+            self.resized_path = make_resize(self.path, self.zoom)
+        # sequential access means libvips only decodes as far down
+        # the image as the strips we ask for
+        im = pyvips.Image.new_from_file(
+            self.resized_path,
+            access='sequential'
+        )
+        if im.format != 'uchar':
+            im = im.cast('uchar')
+        modes = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+        if im.bands not in modes or im.interpretation == 'cmyk':
+            im = im.colourspace('srgb')
+        mode = modes[im.bands]
+
+        strip_bytes = im.width * self.size * im.bands
+        tiles_per_strip = max(1, self.max_memory / strip_bytes)
+        strip_height = self.size * tiles_per_strip
+        top = 0
+        while top < im.height:
+            height = min(strip_height, im.height - top)
+            strip = im.crop(0, top, im.width, height)
+            yield top, Image.frombuffer(
+                mode,
+                (im.width, height),
+                strip.write_to_memory(),
+                'raw',
+                mode,
+                0,
+                1
+            )
+            top += strip_height
+
+    def make_all(self, rows, cols):
+        count = 0
+        col = 0
+        strip = None
+        for top, strip in self.iter_strips():
+            bottom = top + strip.size[1]
+            while col <= cols and self.size * col < bottom:
+                y = self.size * col - top
+                for row in range(rows + 1):
+                    box = (
+                        self.size * row,
+                        y,
+                        self.size * (row + 1),
+                        y + self.size
+                    )
+                    self.save(row, col, strip.crop(box))
+                    count += 1
+                col += 1
+        if strip is not None and col <= cols:
+            # the tiles below the bottom edge of the picture are all blank
+            blank = Image.new(strip.mode, (self.size, self.size))
+            while col <= cols:
+                for row in range(rows + 1):
+                    self.save(row, col, blank)
+                    count += 1
+                col += 1
+        self.flush()
+        return count
+
+
+def _encode(im, extension):
+    buffer_ = cStringIO.StringIO()
+    im.save(buffer_, extension == 'jpg' and 'JPEG' or 'PNG')
+    return buffer_.getvalue()
+
+
+def save_tile(store, image, size, zoom, row, col, extension, tile,
+              overwrite=True):
+    """return the number of bytes written or None if the tile was
+    already there"""
+    if overwrite or not store.exists(image, size, zoom, row, col, extension):
+        data = _encode(tile, extension)
+        store.write(image, size, zoom, row, col, extension, data)
+        return len(data)
+
+
+def _iter_strips(im, size):
+    for top in range(0, im.size[1], size):
+        bottom = min(im.size[1], top + size)
+        yield top, im.crop((0, top, im.size[0], bottom))
+
+
+def _tobytes(im):
+    if hasattr(im, 'tobytes'):
+        return im.tobytes()
+    return im.tostring()
+
+
+def _frombytes(mode, size, data):
+    if hasattr(Image, 'frombytes'):
+        return Image.frombytes(mode, size, data)
+    return Image.fromstring(mode, size, data)
+
+
+def _cut_band(args):
+    """make the tiles for some columns out of the raw pixels that
+    cut_tiles_parallel() has written to disk. Runs in a pool process."""
+    (raw_path, mode, im_size, line_size, image, size, zoom, static_path,
+     extension, rows, cols, overwrite) = args
+    store = get_tile_store(static_path)
+    # only read the lines of pixels these tiles are cut from so each
+    # process holds a band, not the whole zoom level
+    top = size * cols[0]
+    height = size * len(cols)
+    lines = max(0, min(im_size[1], top + height) - top)
+    im = Image.new(mode, (im_size[0], height))
+    if lines:
+        with open(raw_path, 'rb') as f:
+            f.seek(top * line_size)
+            data = f.read(lines * line_size)
+        im.paste(_frombytes(mode, (im_size[0], lines), data), (0, 0))
+        del data
+    count = 0
+    written = []
+    for col in cols:
+        for row in range(rows + 1):
+            box = (size * row, size * col - top,
+                   size * (row + 1), size * (col + 1) - top)
+            tile_size = save_tile(
+                store, image, size, zoom, row, col, extension,
+                im.crop(box), overwrite=overwrite
+            )
+            if tile_size:
+                written.append((zoom, row, col, extension, tile_size))
+            count += 1
+    record_tiles(image, written)
+    return count
+
+
+def cut_tiles_parallel(strips, raw_dir, image, size, zoom, static_path,
+                       extension, rows, cols, workers, overwrite=True):
+    """Write the decoded pixels of `strips` to a raw file once and then
+    let a pool of `workers` processes cut the tiles out of it in bands
+    of columns."""
+    fd, raw_path = tempfile.mkstemp(suffix='.raw', dir=raw_dir)
+    try:
+        width = height = line_size = 0
+        mode = None
+        with os.fdopen(fd, 'wb') as f:
+            for top, strip in strips:
+                strip = _prepare_mode(strip, extension)
+                mode = strip.mode
+                width = strip.size[0]
+                height = top + strip.size[1]
+                data = _tobytes(strip)
+                line_size = len(data) / strip.size[1]
+                f.write(data)
+
+        all_cols = range(cols + 1)
+        # a couple of bands per worker evens out the ones that finish early
+        band_size = max(1, len(all_cols) / (workers * 2))
+        tasks = []
+        for i in range(0, len(all_cols), band_size):
+            tasks.append((
+                raw_path, mode, (width, height), line_size, image, size,
+                zoom, static_path, extension, rows,
+                all_cols[i:i + band_size], overwrite
+            ))
+        pool = multiprocessing.Pool(workers)
+        try:
+            return sum(pool.map(_cut_band, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        os.remove(raw_path)
+
+
+def get_decoded_size(path):
+    """return how many bytes the decoded pixels of this image would take
+    without actually decoding it"""
+    return _get_decoded_size(Image.open(path))
+
+
+def _get_decoded_size(im):
+    bands = len(im.getbands())
+    if im.mode == 'P':
+        bands = 4
+    return im.size[0] * im.size[1] * bands
+
+
+def get_tile_session(image, size, zoom, extension, static_path,
+                     max_memory=None):
+    """return a StripTileSession if the resized image for this zoom level
+    is too big to decode into memory in one go"""
+    if max_memory is None:
+        max_memory = settings.TILING_MAX_MEMORY
+    session = TileSession(image, size, zoom, extension, static_path)
+    if not os.path.isfile(session.resized_path):
+        session.resized_path = make_resize(session.path, session.zoom)
+    if get_decoded_size(session.resized_path) > max_memory:
+        if pyvips is None:
+            logging.warning(
+                "%s is too big to tile in memory but pyvips is not "
+                "installed" % session.resized_path
+            )
         else:
-            im = Image.open(_resized_file)
-            print "Having to use Image.open()"
-            _RESIZES[_cache_key] = im
-            _TIMESTAMPS[_cache_key] = time.time()
-
-        # to avoid memory bloat of `_RESIZES` getting too large, instead use the
-        # `_TIMESTAMPS` dict to keep track of which Image instances are getting old
-        _now = time.time()
-        for key, timestamp in _TIMESTAMPS.items():
-            age = _now - timestamp
-            if age > 10:
-                print "CLEAR", key
-                del _TIMESTAMPS[key]
-                del _RESIZES[key]
-    else:
-        im = Image.open(_resized_file)
-
-    # convert (width, height, x, y) into PIL crop box
-    return im.crop(box)
+            session = StripTileSession(
+                image, size, zoom, extension, static_path,
+                max_memory=max_memory
+            )
+    return session
 
 
 def make_thumbnail(*args, **kwargs):  # wrapper on _make_thumbnail()
@@ -91,6 +367,15 @@ def make_thumbnail(*args, **kwargs):  # wrapper on _make_thumbnail()
     return result
 
 
+def get_thumbnail_path(image, width, extension, static_path):
+    return os.path.join(
+        static_path,
+        'thumbnails',
+        image,
+        '%s.%s' % (width, extension)
+    )
+
+
 def _make_thumbnail(image, width, extension, static_path,
                     raise_error_if_not_found=False):
     root = os.path.join(
@@ -128,24 +413,14 @@ def _make_thumbnail(image, width, extension, static_path,
     # smallest comes first
     path = candidates[0][1]
 
-    save_filepath = save_root
-    save_filepath = os.path.join(save_filepath, image)
-    if not os.path.isdir(save_filepath):
-        mkdir(save_filepath)
-
-    save_filepath = os.path.join(
-        save_filepath,
-        '%s.%s' % (width, extension)
-    )
+    save_filepath = get_thumbnail_path(image, width, extension, static_path)
+    mkdir(os.path.dirname(save_filepath))
     if not os.path.isfile(save_filepath):
-        thumbnail_image = _resize_thumbnail(
+        _resize_thumbnail(
             path,
             width,
             save_filepath,
         )
-        if thumbnail_image is not None:
-            #print "Created", save_filepath
-            thumbnail_image.save(save_filepath)
 
     return save_filepath
 
@@ -162,85 +437,145 @@ def _resize_thumbnail(path, width, save_filepath):
     #               resample=Image.ANTIALIAS)
     t1 = time.time()
     print "Took", round(t1 - t0, 2), "seconds to resize thumbnail", path
-    return Image.open(save_filepath)
-
-
-def make_tile(image, size, zoom, row, col, extension, static_path,
-              cache_image_open=False):
-
-    size = int(size)
-    zoom = int(zoom)
-    row = int(row)
-    col = int(col)
+    return save_filepath
 
-    assert size == 256, size
 
+def _find_upload(image, static_path):
     root = os.path.join(
         static_path,
         'uploads'
     )
-    if not os.path.isdir(root):
-        os.mkdir(root)
-    save_root = os.path.join(
-        static_path,
-        'tiles'
-    )
-    if not os.path.isdir(save_root):
-        os.mkdir(save_root)
-    path = os.path.join(root, image)
     for i in ('.png', '.jpg'):
         path = os.path.join(root, image + i)
         if os.path.isfile(path):
-            break
-    else:
-        raise IOError(image)
-
-    save_filepath = save_root
-    for p in (image, str(size), str(zoom)):
-        save_filepath = os.path.join(save_filepath, p)
-        if not os.path.isdir(save_filepath):
-            try:
-                mkdir(save_filepath)
-            except OSError:
-                # because this function is called concurrently by the queue
-                # workers this is not thread safe so it might raise an OSError
-                # even though the file already exists
-                time.sleep(0.1)
-                if not os.path.isdir(save_filepath):
-                    raise
-    save_filepath = os.path.join(
-        save_filepath,
-        '%s,%s.%s' % (row, col, extension)
-    )
-    if not os.path.isfile(save_filepath):
-        #print "From", image, "make", '%s,%s.%s' % (row, col, extension)
-        width = size * (2 ** zoom)
-        cropped_image = scale_and_crop(
-            path,
-            (width, width),
-            row, col,
-            zoom=zoom,
-            image=image,
-            cache_image_open=cache_image_open
-        )
-        if cropped_image is not None:
-            #print "Created", save_filepath
-            cropped_image.save(save_filepath)
+            return path
+    raise IOError(image)
 
-    return save_filepath
+
+def _prepare_mode(im, extension):
+    # PIL can only antialias resize 'L', 'RGB' and 'RGBA' images
+    # and JPEGs can't be saved with an alpha channel
+    if extension == 'jpg':
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+    elif im.mode not in ('RGB', 'RGBA', 'L'):
+        im = im.convert('RGBA')
+    return im
 
 
-def make_tiles(image, size, zoom, rows, cols, extension, static_path):
-    # this is an "optimization" over make_tile() since we make one Image
-    # instance and re-use it for every row and every column.
+def make_pyramid(image, size, grids, extension, static_path,
+                 workers=None):
+    """Make all tiles for all zoom levels from one decode of the original.
+
+    `grids` is a list of `(zoom, rows, cols)` in the order the zoom levels
+    should be written to disk. The biggest zoom level is resized from the
+    original and every smaller zoom level is made by halving the one
+    above it.
+    """
+    size = int(size)
+    assert size == 256, size
+    if workers is None:
+        workers = settings.TILING_WORKERS
+    path = _find_upload(image, static_path)
+
+    zooms = sorted(set(x[0] for x in grids), reverse=True)
+    top = zooms[0]
+    fileid = image.replace('/', '')
+
+    t0 = time.time()
+    im = Image.open(path)
+    x, y = [float(v) for v in im.size]
+    width = size * (2 ** top)
+    r = min(width / x, width / y)
+    w, h = int(round(x * r)), int(round(y * r))
+    if im.format == 'JPEG':
+        # lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        im.draft(im.mode, (w, h))
+    # the decoded original and all levels of the pyramid, which are
+    # about 4/3 of the biggest one
+    needed = _get_decoded_size(im) + w * h * 4 * 4 / 3
+    if needed > settings.TILING_MAX_MEMORY:
+        print "Too big to make a pyramid in memory. Tiling in strips."
+        if pyvips is None:
+            logging.error(
+                "%s needs %s bytes to tile in memory but pyvips is not "
+                "installed so each zoom level is decoded whole" %
+                (path, needed)
+            )
+        count = 0
+        for zoom, rows, cols in grids:
+            progress.report(fileid, progress.TILING, zoom=zoom)
+            session = get_tile_session(
+                image, size, zoom, extension, static_path
+            )
+            if workers > 1:
+                count += session.make_all_parallel(rows, cols, workers)
+            else:
+                count += session.make_all(rows, cols)
+        # so no web process keeps serving tiles from before
+        invalidate_tile_cache(get_redis(), image)
+        return "%s tiles made" % count
+    progress.report(fileid, progress.TILING, zoom=top)
+    im = _prepare_mode(im, extension)
+    if im.size != (w, h):
+        im = im.resize((w, h), Image.ANTIALIAS)
+    t1 = time.time()
+    print "Decoded and resized", path, "in", round(t1 - t0, 2), "seconds"
+
+    levels = {top: im}
+    for zoom in range(top - 1, zooms[-1] - 1, -1):
+        w, h = im.size
+        im = im.resize((max(1, w / 2), max(1, h / 2)), Image.ANTIALIAS)
+        levels[zoom] = im
+    del im
+
+    store = get_tile_store(static_path)
     count = 0
-    for row in range(rows + 1):
-        for col in range(cols + 1):
-            make_tile(image, size, zoom, row, col, extension, static_path,
-                      cache_image_open=True)
-            count += 1
+    for zoom, rows, cols in grids:
+        t0 = time.time()
+        progress.report(fileid, progress.TILING, zoom=zoom)
+        im = levels.pop(zoom)
+        if workers > 1:
+            count += cut_tiles_parallel(
+                _iter_strips(im, size),
+                os.path.dirname(path),
+                image,
+                size,
+                zoom,
+                static_path,
+                extension,
+                rows,
+                cols,
+                workers
+            )
+        else:
+            written = []
+            for row in range(rows + 1):
+                for col in range(cols + 1):
+                    box = (size * row, size * col,
+                           size * (row + 1), size * (col + 1))
+                    tile_size = save_tile(
+                        store, image, size, zoom, row, col, extension,
+                        im.crop(box)
+                    )
+                    written.append((zoom, row, col, extension, tile_size))
+                    count += 1
+            record_tiles(image, written)
+        del im
+        t1 = time.time()
+        print "Made zoom", zoom, "tiles in", round(t1 - t0, 2), "seconds"
+
+    invalidate_tile_cache(get_redis(), image)
     return "%s tiles made" % count
 
+
+def make_tile(image, size, zoom, row, col, extension, static_path):
+    session = TileSession(image, size, zoom, extension, static_path)
+    relative_path = session.make(int(row), int(col))
+    session.flush()
+    return relative_path
+
+
 def delete_image(image, static_path):
     uploads_root = os.path.join(
         static_path,
@@ -258,14 +593,86 @@ def delete_image(image, static_path):
         static_path,
         'thumbnails'
     )
-    tiles_root = os.path.join(
-        static_path,
-        'tiles'
-    )
+    dir_ = os.path.join(thumbnails_root, image)
+    shutil.rmtree(dir_)
+
+    get_tile_store(static_path).delete(image)
 
-    for root in (thumbnails_root, tiles_root):
-        dir_ = os.path.join(root, image)
-        shutil.rmtree(dir_)
+
+def _link(path, target):
+    try:
+        os.link(path, target)
+    except OSError:
+        # e.g. not the same file system
+        shutil.copy2(path, target)
+
+
+def _link_tree(source, destination):
+    count = 0
+    for root, dirs, files in os.walk(source):
+        target = os.path.normpath(
+            os.path.join(destination, os.path.relpath(root, source))
+        )
+        mkdir(target)
+        for filename in files:
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(root, filename)
+            if filename.endswith('.pack'):
+                # packs are appended to so they can't be shared
+                shutil.copy2(path, os.path.join(target, filename))
+            else:
+                _link(path, os.path.join(target, filename))
+            count += 1
+    return count
+
+
+def clone_image(source, image, static_path, with_original=True):
+    """give `image` the tiles and thumbnails, and the original unless
+    `with_original` is False, of `source` (both split fileids) so they
+    don't have to be made again. Files are hard linked where possible.
+
+    Returns False if `source` doesn't have them anymore.
+    """
+    bits = source.split('/')
+    source_fileid = bits.pop()
+    fileid = image.split('/')[-1]
+    if with_original:
+        uploads = os.path.join(static_path, 'uploads', '/'.join(bits))
+        target = os.path.join(
+            static_path,
+            'uploads',
+            os.path.dirname(image)
+        )
+        mkdir(target)
+        linked = 0
+        for f in os.path.isdir(uploads) and os.listdir(uploads) or []:
+            if source_fileid in f:
+                _link(
+                    os.path.join(uploads, f),
+                    os.path.join(target, f.replace(source_fileid, fileid))
+                )
+                linked += 1
+        if not linked:
+            logging.warning("%s has no original to clone" % source)
+            return False
+
+    thumbnails_root = os.path.join(static_path, 'thumbnails')
+    _link_tree(
+        os.path.join(thumbnails_root, source),
+        os.path.join(thumbnails_root, image)
+    )
+    store = get_tile_store(static_path)
+    count = _link_tree(
+        store.get_image_root(source),
+        store.get_image_root(image)
+    )
+    if not count:
+        logging.warning("%s has no tiles to clone" % source)
+        return False
+    TileManifest(get_redis(), image.replace('/', '')).rebuild(store, image)
+    invalidate_tile_cache(get_redis(), image)
+    return "%s tiles cloned" % count
 
 
 def find_original(fileid, static_path, extension):
@@ -276,30 +683,3 @@ def find_original(fileid, static_path, extension):
     )
     path = os.path.join(root, image + '.' + extension)
     return os.path.isfile(path) and path or None
-
-
-def count_all_tiles(fileid, static_path):
-    return len(list(find_all_tiles(fileid, static_path)))
-
-
-def find_all_tiles(fileid, static_path):
-    image = fileid[:1] + '/' + fileid[1:3] + '/' + fileid[3:]
-    tiles_root = os.path.join(
-        static_path,
-        'tiles'
-    )
-
-    def walk(in_):
-        here = []
-        for f in os.listdir(in_):
-            p = os.path.join(in_, f)
-            if os.path.isdir(p):
-                here.extend(walk(p))
-            elif os.path.isfile(p):
-                here.append(p)
-        return here
-
-    dir_ = os.path.join(tiles_root, image)
-    if os.path.isdir(dir_):
-        for each in walk(dir_):
-            yield each